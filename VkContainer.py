@@ -3,7 +3,8 @@
 This module houses the VkContainer class. Each VkContainer object stores
 data associated with a particular Keyence Profilometry vk data file. The
 data is extracted using functions in the vk4extract module and primarily
-stored in dictionaries.
+stored in dictionaries, the image layers in the slotted layer classes of
+the vk4layer module, which support dictionary style access.
 
 VkContainer objects are constructed using a builder pattern. Therefore a
 user can create VkContainer objects storing different image data depending
@@ -24,13 +25,14 @@ Created
 
 Last Modified
 -------------
-19 July 2018
+18 October 2026
 
 """
 
 import logging
 import numpy as np
 import vk4extract as vk4in
+import vk4layer
 
 log = logging.getLogger("vk4_driver.VkContainer")
 
@@ -50,6 +52,13 @@ class VkContainer(object):
         self.string_data = None
         self.image_width = None
         self.image_height = None
+        # path of the vk file the container was built from, if known
+        self.file_name = None
+        # layers computed from the extracted data, keyed by layer name
+        self.derived_data = dict()
+        # boolean (height, width) arrays, False for invalid pixels, keyed by
+        # 'height' or 'light' (see the vk4mask module)
+        self.valid_masks = dict()
 
     def __str__(self):
         return self.string_data['title']
@@ -93,6 +102,68 @@ class VkContainer(object):
         log.debug("Exiting get_single_color_values()")
         return color_array
 
+    def get_pixel_size(self):
+        """get_pixel_size
+
+        Returns the x and y length of a pixel in micrometers as a tuple
+        """
+        # x and y length per pixel are stored in picometers
+        return (self.measurement_conditions['x_length_per_pixel'] / 1.0e6,
+                self.measurement_conditions['y_length_per_pixel'] / 1.0e6)
+
+    def get_calibrated_height(self):
+        """get_calibrated_height
+
+        Returns the height data as a (height, width) array of float64 values
+        in micrometers, scaled by the z length per digit. Pixels marked
+        invalid in the height mask of valid_masks are set to NaN.
+        """
+        log.debug("Entering get_calibrated_height()")
+        # z length per digit is stored in picometers
+        z_scale = self.measurement_conditions['z_length_per_digit'] / 1.0e6
+        height_matrix = vk4layer.layer_matrix(self.height_data)
+        calibrated = np.multiply(height_matrix, z_scale, dtype=np.float64)
+        if 'height' in self.valid_masks:
+            np.copyto(calibrated, np.nan, where=~self.valid_masks['height'])
+
+        log.debug("Exiting get_calibrated_height()")
+        return calibrated
+
+    def add_derived_layer(self, name, matrix, unit):
+        """add_derived_layer
+
+        Stores a (height, width) array computed from this container's data,
+        e.g. a height difference map, in the derived_data dict. The layer is
+        stored like the height and light layers, as a vk4layer.ScalarLayer
+        with its values flattened into a float32 'data' array, so it can be
+        output by every vk4out writer using its name as the layer argument.
+
+        :param name: string - name of the layer, used as its key
+        :param matrix: 2d numpy array of values
+        :param unit: string - unit of the values, e.g. 'um'
+        """
+        log.debug("Adding derived layer '%s' in %s" % (name, unit))
+        self.derived_data[name] = vk4layer.ScalarLayer(name=name,
+                                                       width=matrix.shape[1],
+                                                       height=matrix.shape[0],
+                                                       scale=1.0,
+                                                       unit=unit,
+                                                       data=np.ravel(matrix).astype(np.float32))
+
+    async def write_async(self, output_type, layer, **options):
+        """write_async
+
+        Coroutine outputting a layer of this container without blocking the
+        event loop, see vk4async.write_async
+
+        :param output_type: string - output type, as the -t argument
+        :param layer: string - data layer, as the -l argument
+        :param options: keyword arguments of vk4async.write_async
+        """
+        # imported here as vk4async builds containers using this module
+        import vk4async
+        return await vk4async.write_async(self, output_type, layer, **options)
+
 
 class VkDirector(object):
     """VkDirector
@@ -124,6 +195,8 @@ class VkDirector(object):
                          'VkContainer.Vk4BuilderRGBpeak': ('rgb_peak',),
                          'VkContainer.Vk4BuilderRGBlight': ('rgb_light',),
                          'VkContainer.Vk4BuilderHeight': ('height',),
+                         'VkContainer.Vk4BuilderHeightRGBpeak': ('height', 'rgb_peak'),
+                         'VkContainer.Vk4BuilderHeightLight': ('height', 'light'),
                          'VkContainer.Vk4BuilderLight': ('light',)}
 
         build_layers = build_options[self.builder_type]
@@ -185,6 +258,7 @@ class Vk4Builder(VkBuilder):
     def __init__(self, in_file):
         log.debug("Building vk4 VkContainer object")
         self.vk4 = VkContainer()
+        self.vk4.file_name = getattr(in_file, 'name', None)
         self.in_file = in_file
         self.offsets = vk4in.extract_offsets(self.in_file)
 
@@ -206,10 +280,16 @@ class Vk4Builder(VkBuilder):
     def light(self):
         self.vk4.light_intensity_data = \
             vk4in.extract_img_data(self.offsets, 'light', self.in_file)
+        self.vk4.light_intensity_data.scale = 1.0
+        self.vk4.light_intensity_data.unit = ''
 
     def height(self):
         self.vk4.height_data = \
             vk4in.extract_img_data(self.offsets, 'height', self.in_file)
+        # z length per digit is stored in picometers
+        self.vk4.height_data.scale = \
+            self.vk4.measurement_conditions['z_length_per_digit'] / 1.0e6
+        self.vk4.height_data.unit = 'um'
 
     def string_data(self):
         self.vk4.string_data = \
@@ -284,3 +364,32 @@ class Vk4BuilderRGBlight(Vk4Builder):
     def image_width(self):
         self.vk4.image_width = self.vk4.rgb_light_data['width']
 
+
+class Vk4BuilderHeightRGBpeak(Vk4Builder):
+    """Vk4BuilderHeightRGBpeak
+
+    Builder class that houses methods to construct VkContainer objects
+    from vk4 files.
+
+    Contains height and RGB peak image data, e.g. for colored mesh output.
+    """
+    def image_height(self):
+        self.vk4.image_height = self.vk4.height_data['height']
+
+    def image_width(self):
+        self.vk4.image_width = self.vk4.height_data['width']
+
+
+class Vk4BuilderHeightLight(Vk4Builder):
+    """Vk4BuilderHeightLight
+
+    Builder class that houses methods to construct VkContainer objects
+    from vk4 files.
+
+    Contains height and light image data, e.g. for summary statistics.
+    """
+    def image_height(self):
+        self.vk4.image_height = self.vk4.height_data['height']
+
+    def image_width(self):
+        self.vk4.image_width = self.vk4.height_data['width']
@@ -20,6 +20,18 @@ output file name.
         This example pulls red and green peak color data from the input Vk4
         file and outputs a .csv file with the default output filename
 
+Several input files may be given to convert them as a batch. Each file is
+validated before it is decoded and invalid files are skipped. Files can also
+be validated without converting them using --check
+
+    $ python3 Vk4_driver.py --check -i *.vk4
+
+The metadata of files (offsets, measurement conditions and string data) is
+printed as JSON by the info subcommand, which only reads the file headers.
+Without a subcommand (info, check or convert) the convert command is run
+
+    $ python3 Vk4_driver.py info scan.vk4
+
 Use python3 Vk4_driver.py -h for argument options
 
 Note
@@ -46,14 +58,39 @@ Created
 
 Last Modified
 -------------
-19 July 2018
+18 October 2026
 
 """
 
 import argparse
+import json
 import logging
-import vk4out
-import VkContainer
+import os
+import signal
+import sys
+import vk4progress
+import vk4validate
+# The modules decoding and writing layer data (and so NumPy and PIL) are
+# imported by the functions using them, keeping -h, check and info fast
+
+log = logging.getLogger("vk4_driver")
+
+# output types able to write derived (calibrated float) layers
+derived_output_types = ('csv', 'hcsv', 'npy', 'raw', 'tiff', 'gsf', 'sdf')
+
+# all output types
+output_types = ('csv', 'hcsv', 'npy', 'raw', 'jpeg', 'png', 'tiff', 'ply', 'stl', 'gsf',
+                'sdf')
+
+# names of the VkContainer builder classes
+builder_dict = {'L': 'Vk4BuilderLight',
+                'H': 'Vk4BuilderHeight',
+                'rgb_light': 'Vk4BuilderRGBlight',
+                'rgb_peak': 'Vk4BuilderRGBpeak',
+                'height_rgb_peak': 'Vk4BuilderHeightRGBpeak'}
+
+# subcommands, the command line without one is the convert command
+commands = ('info', 'check', 'convert')
 
 
 def config_logging(debug_level):
@@ -68,28 +105,272 @@ def config_logging(debug_level):
     return log
 
 
-def main():
+def main(argv=None):
+    """main
+
+    Runs the subcommand named by the first argument, or the convert command
+    if the first argument is not a subcommand, so that command lines from
+    before subcommands existed keep working. Returns the exit status.
+
+    :param argv: list of command line arguments, defaults to sys.argv[1:]
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = argv.pop(0) if argv and argv[0] in commands else 'convert'
+    if command == 'info':
+        return info_command(argv)
+    if command == 'check':
+        return check_command(argv)
+    return convert_command(argv)
+
+
+def info_command(argv):
+    """info_command
+
+    Prints the metadata of vk4 files as JSON, keyed by file name: the
+    header, layer offsets, measurement conditions, string data and the
+    width, height and bit depth of each layer. Only the headers are read,
+    no layer data is decoded. Returns 0 if every file is valid, otherwise 1.
+
+    :param argv: list of command line arguments following 'info'
+    """
+    parser = argparse.ArgumentParser(prog='vk4_driver.py info', description="Print " +
+                                     "the metadata of vk4 files as JSON without " +
+                                     "decoding their image data.")
+    parser.add_argument('input', nargs='+', help="vk4 file(s) to read")
+    parser.add_argument('-v', '--verbose', help="Log at DEBUG level.",
+                        action='store_true')
+    args = parser.parse_args(argv)
+    log = config_logging(logging.DEBUG if args.verbose else logging.INFO)
+    log.debug("In info_command()\n\tCommand line args:\n\t{}".format(args))
+
+    import vk4extract
+    status = 0
+    results = {}
+    for in_file_name in args.input:
+        in_file_name = in_file_name.strip("'")
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Skipping invalid file - {}\n\t{}"
+                      .format(in_file_name, '\n\t'.join(problems)))
+            status = 1
+            continue
+        with open(in_file_name, 'rb') as in_file:
+            results[in_file_name] = vk4extract.extract_metadata(in_file)
+
+    print(json.dumps(results, indent=2))
+    return status
 
+
+def check_command(argv):
+    """check_command
+
+    Validates vk4 files without decoding them (see check_files)
+
+    :param argv: list of command line arguments following 'check'
+    """
+    parser = argparse.ArgumentParser(prog='vk4_driver.py check', description="Check " +
+                                     "that vk4 files are complete and consistent " +
+                                     "without converting them.")
+    parser.add_argument('input', nargs='+', help="vk4 file(s) to check")
+    parser.add_argument('-v', '--verbose', help="Log at DEBUG level.",
+                        action='store_true')
+    args = parser.parse_args(argv)
+    config_logging(logging.DEBUG if args.verbose else logging.INFO)
+    return check_files(args.input)
+
+
+def convert_command(argv):
+    """convert_command
+
+    Converts vk4 files, or runs one of the other modes selected with the
+    options below, as the driver did before it had subcommands. Returns the
+    exit status.
+
+    :param argv: list of command line arguments following 'convert', or
+        all arguments if no subcommand was given
+    """
     parser = argparse.ArgumentParser(description="Vk4 File Format Data" +
-                                     "Extraction Tool\n")
+                                     "Extraction Tool\n", epilog="Subcommands: " +
+                                     "'info FILE...' prints file metadata as " +
+                                     "JSON, 'check FILE...' validates files and " +
+                                     "'convert' (the default) takes the " +
+                                     "options above.")
     # group = parser.add_mutually_exclusive_group(required=True)
 
-    parser.add_argument('-i', '--input', required=True, help="Specify input " +
-                        "file to read.\n")
-    parser.add_argument('-t', '--type', required=True, help="Specify output " +
+    parser.add_argument('-i', '--input', nargs='+', help="Specify " +
+                        "input file(s) to read. Several files may be given to " +
+                        "process them as a batch, in which case each file is " +
+                        "validated first and invalid files are skipped.\n")
+    parser.add_argument('-t', '--type', help="Specify output " +
                         "type. Options: csv, hcsv (csv file with metadata " +
-                        "header), jpeg, png, tiff.\n")
+                        "header), npy (NumPy array), raw (headerless " +
+                        "little-endian values), jpeg, png, tiff, ply (binary " +
+                        "point cloud " +
+                        "mesh), stl (binary triangle mesh), gsf (Gwyddion " +
+                        "simple field), sdf (binary BCR/ISO 25178-71 " +
+                        "surface data), vk4 (a vk4 file holding the layers " +
+                        "given with -l as a comma separated list of RGB, " +
+                        "LRGB, L and H, all by default, see --crop).\n")
 
-    parser.add_argument('-l', '--layer', required=True, help="Specify data " +
+    parser.add_argument('-l', '--layer', help="Specify data " +
                         "layer for output. Options: R, G, B, RL, GL, BL, L, " +
                         "H, RGB, LRGB. Different combinations of R, G, or B; " +
                         "or L followed by combinations of R, G, or B are " +
-                        "allowed - e.g. RB, LGB, LRB, G.")
+                        "allowed - e.g. RB, LGB, LRB, G. The layers waviness " +
+                        "and roughness give the Gaussian filtered height data " +
+                        "(see --cutoff), and gradient, slope, aspect and " +
+                        "curvature the surface maps of the height data (see " +
+                        "the vk4surface module).")
 
     parser.add_argument('-o', '--output', help="Specify the output file " +
                         "basename (extension will be generated). If this " +
                         "argument is not specified, the basename will remain " +
-                        "the same as the input basename")
+                        "the same as the input basename. Use - to write the " +
+                        "output to standard output, e.g. to pipe it to " +
+                        "another program.")
+
+    parser.add_argument('-d', '--decimate', type=int, default=1, help="Only " +
+                        "use every Nth pixel along each axis for ply and stl " +
+                        "mesh output. Defaults to 1 (full resolution).")
+
+    parser.add_argument('--check', help="Only validate the input file(s), " +
+                        "checking the header, offset table and layer sizes " +
+                        "for corruption or truncation, and print the result " +
+                        "for each file. Exits with status 1 if any file is " +
+                        "invalid.", action='store_true')
+
+    parser.add_argument('--compare', metavar='BEFORE', help="Compare the " +
+                        "height data of the input scan (after) to this scan " +
+                        "(before). The scans are registered by phase " +
+                        "correlation and the volume added and removed and " +
+                        "the changed area are printed as JSON. If -t is given " +
+                        "the difference map (after - before, in micrometers) " +
+                        "is also output as the layer 'difference' (csv, hcsv, " +
+                        "tiff, gsf or sdf).")
+
+    parser.add_argument('--bearing', help="Compute the bearing area " +
+                        "(Abbott-Firestone) curve of each input scan's height " +
+                        "data, or of the waviness or roughness given with -l, " +
+                        "and print its ISO 25178-2 functional parameters " +
+                        "(Sk, Spk, Svk, Smr1, Smr2, Vmp, Vmc, Vvc, Vvv) as " +
+                        "JSON.", action='store_true')
+
+    parser.add_argument('--features', choices=('particles', 'pits'), help="Detect " +
+                        "particles (above) or pits (below the median level) " +
+                        "in the leveled height data, or the light data with " +
+                        "-l L, and output the area, volume, maximum height, " +
+                        "centroid and bounding box of each feature as csv or " +
+                        "json (-t).")
+
+    parser.add_argument('--profile', action='append', metavar='X0,Y0;X1,Y1;...',
+                        help="Sample the height data, or the light data with " +
+                        "-l L, along a polyline through the given points " +
+                        "(in pixels, or micrometers with --units um) by " +
+                        "bilinear interpolation and output the profiles as " +
+                        "csv or npy (-t). May be given several times; all " +
+                        "profiles of a file are written to one output.")
+
+    parser.add_argument('--profile-file', help="Text file of profiles to " +
+                        "sample, one X0,Y0;X1,Y1;... polyline per line.")
+
+    parser.add_argument('--units', choices=('px', 'um'), default='px', help="Units " +
+                        "of the --profile points. Defaults to px.")
+
+    parser.add_argument('--threshold', type=float, help="Height change in " +
+                        "micrometers above which a pixel counts as changed " +
+                        "with --compare, or distance from the median level " +
+                        "beyond which pixels belong to features with " +
+                        "--features. Defaults to three times the robust " +
+                        "standard deviation of the difference map or data.")
+
+    parser.add_argument('--cutoff', type=float, help="Cutoff wavelength in " +
+                        "micrometers of the ISO 16610-61 Gaussian filter used " +
+                        "to separate the height data into the waviness and " +
+                        "roughness layers.")
+
+    parser.add_argument('--mask', help="Treat invalid pixels (0 or " +
+                        "saturated at the effective bit depth) of the height " +
+                        "and light data as missing. They are written as nan " +
+                        "in csv, tiff, gsf and sdf output, left out of ply " +
+                        "and stl meshes and excluded from filtering and " +
+                        "comparison statistics.", action='store_true')
+
+    parser.add_argument('--fill', choices=('nearest', 'laplacian'), help="Fill " +
+                        "invalid pixels of the height and light data with the " +
+                        "mean of the nearest valid pixels or by Laplacian " +
+                        "inpainting before any other processing.")
+
+    parser.add_argument('--crop', metavar='X,Y,W,H', help="Crop the vk4 " +
+                        "file written with -tvk4 to the window of W by H " +
+                        "pixels whose top left pixel is at column X and row " +
+                        "Y. Thumbnails are regenerated for the window.")
+
+    parser.add_argument('--pitch', metavar='X[,Y]', help="Resample the " +
+                        "layers to pixels of X by Y micrometers (X by X if Y " +
+                        "is not given) after --mask or --fill and before " +
+                        "any other processing or output, area averaging " +
+                        "where the pitch grows and interpolating where it " +
+                        "shrinks, so scans taken at different magnifications " +
+                        "can be compared pixel for pixel.")
+
+    parser.add_argument('--summarize', metavar='REPORT', help="Summarize " +
+                        "the input files for quality control, in parallel " +
+                        "(--workers processes), without converting them. The " +
+                        "valid pixel coverage, height range, saturated light " +
+                        "fraction, light histogram and key measurement " +
+                        "conditions of each file are written to REPORT.csv, " +
+                        "and together with the batch totals and combined " +
+                        "histogram to REPORT.json.")
+
+    parser.add_argument('--stack', metavar='STACK', help="Stack the height " +
+                        "(or light, with -lL) data of the input files, which " +
+                        "must have the same image size, pixel size, z " +
+                        "resolution and magnification, into STACK.npy, a " +
+                        "(files, height, width) float32 array, decoding " +
+                        "--workers files at once, and write the per-pixel " +
+                        "mean, std, min, max and count to STACK_stats.npz.")
+
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help="Run as a " +
+                        "local HTTP conversion service on the given port " +
+                        "(and host, default localhost) instead of converting " +
+                        "input files. See the vk4server module for the " +
+                        "convert, stats, metadata and metrics endpoints.")
+
+    parser.add_argument('--watch', metavar='FOLDER', help="Watch a folder " +
+                        "and convert (with -t and -l) every new or changed " +
+                        "vk4 file once it has been completely written. " +
+                        "Processed files are recorded in the --state file so " +
+                        "that they are not converted again after a restart.")
+
+    parser.add_argument('--state', default='vk4_watch_state.json', help="State " +
+                        "file of the files processed with --watch. Defaults to " +
+                        "vk4_watch_state.json in the current directory.")
+
+    parser.add_argument('--interval', type=float, default=5.0, help="Seconds " +
+                        "between polls of the --watch folder. Defaults to 5.")
+
+    parser.add_argument('--queue-size', type=int, default=16, help="Number of " +
+                        "files waiting to be converted with --watch before " +
+                        "polling pauses. Defaults to 16.")
+
+    parser.add_argument('--workers', type=int, default=4, help="Number of " +
+                        "requests worked on at once with --serve, files " +
+                        "converted at once with --watch, processes " +
+                        "summarizing files with --summarize, or files " +
+                        "decoded at once with --stack. Defaults to 4.")
+
+    parser.add_argument('--cache-size', type=int, default=8, help="Number of " +
+                        "decoded files kept in memory with --serve. Defaults " +
+                        "to 8.")
+
+    parser.add_argument('--max-upload', type=int, default=1024, help="Largest " +
+                        "request body in megabytes accepted with --serve; " +
+                        "larger requests get a 413 status. Defaults to 1024.")
+
+    parser.add_argument('--progress', help="Show the progress of decoding, " +
+                        "writing and the batch (bytes read, rows written, " +
+                        "files done, throughput and time remaining) on " +
+                        "standard error.", action='store_true')
 
     parser.add_argument('-v', '--verbose', help="Specify logging level as " +
                         "verbose, meaning at DEBUG level, otherwise logging " +
@@ -99,49 +380,652 @@ def main():
 
     # TODO define mutually exclusive arguments
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    log = config_logging(logging.DEBUG if args.verbose else logging.INFO)
+    log.info("In convert_command() after parsing command line arguments")
+    log.debug("In convert_command()\n\tCommand line args:\n\t{}".format(args))
+
+    if args.pitch is not None:
+        import vk4resample
+        try:
+            args.pitch = vk4resample.parse_pitch(args.pitch)
+        except ValueError as err:
+            parser.error(str(err))
+        if args.profile is not None or args.profile_file is not None or \
+                args.summarize is not None or args.stack is not None:
+            parser.error("--pitch cannot be used with --profile, --summarize or --stack")
+
+    if args.serve is not None:
+        host, _, port = args.serve.rpartition(':')
+        if not port.isdigit() or args.workers < 1 or args.cache_size < 1 or \
+                args.max_upload < 1:
+            parser.error("--serve takes [HOST:]PORT, --workers, --cache-size and " +
+                         "--max-upload must be positive")
+        import vk4server
+        vk4server.serve(host or 'localhost', int(port), args.workers, args.cache_size,
+                        max_upload=args.max_upload * 2 ** 20)
+        log.info("Program completed execution")
+        return 0
+
+    if args.watch is not None:
+        status = watch_folder(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.input is None:
+        parser.error("the following arguments are required: -i/--input")
+
+    if args.check:
+        status = check_files(args.input)
+        log.info("Program completed execution")
+        return status
+
+    if args.compare is not None:
+        status = compare_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.summarize is not None:
+        status = summarize_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.stack is not None:
+        status = stack_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.bearing:
+        status = bearing_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.features is not None:
+        status = feature_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.profile is not None or args.profile_file is not None:
+        status = profile_files(args, parser)
+        log.info("Program completed execution")
+        return status
+
+    if args.type == 'vk4':
+        status = subset_files(args, parser)
+        log.info("Program completed execution")
+        return status
+    if args.crop is not None:
+        parser.error("--crop can only be used with -tvk4")
+
+    if args.type is None or args.layer is None:
+        parser.error("the following arguments are required: -t/--type, -l/--layer")
+    if len(args.input) > 1 and args.output is not None:
+        parser.error("-o/--output cannot be used with more than one input file")
+
+    try:
+        builder_class = select_builder(args)
+    except ValueError as err:
+        parser.error(str(err))
+
+    # A scheduler stopping the job with SIGTERM cancels it at the next chunk
+    # of work; the output being written is then removed, not left partial.
+    token = vk4progress.CancelToken()
+    signal.signal(signal.SIGTERM, lambda signum, frame: token.cancel())
+    tracker = vk4progress.ProgressTracker(vk4progress.render_progress if args.progress
+                                          else None, token)
+
+    # Every file is validated before it is decoded, so in batch mode (more
+    # than one input file) corrupt or truncated files are skipped immediately.
+    status = 0
+    in_file_name = None
+    try:
+        with vk4progress.tracking(tracker):
+            tracker.begin('files', len(args.input), 'files')
+            for in_file_name in args.input:
+                in_file_name = in_file_name.strip("'")
+                problems = vk4validate.validate_file(in_file_name)
+                if problems:
+                    log.error("Skipping invalid file - {}\n\t{}"
+                              .format(in_file_name, '\n\t'.join(problems)))
+                    status = 1
+                else:
+                    file_args = argparse.Namespace(**vars(args))
+                    file_args.input = in_file_name
+                    convert_file(builder_class, file_args)
+                tracker.advance('files', 1)
+    except vk4progress.Cancelled:
+        log.error("Cancelled at {}, no partial output was left".format(in_file_name))
+        return 1
+
+    log.info("Exiting convert_command()")
+    log.info("Program completed execution")
+    return status
 
-    log_dict = {True: logging.DEBUG, False: logging.INFO}
 
-    log_level = log_dict[args.verbose]
-    log = config_logging(log_level)
-    log.info("In main() after parsing command line arguments")
-    log.debug("In main()\n\tCommand line args:\n\t{}".format(args))
+def select_builder(args):
+    """select_builder
 
-    in_file_name = args.input.strip("'")
+    Returns the VkBuilder class extracting the layers needed for the output
+    type and layer given in args. Raises ValueError with a message for the
+    user if the type and layer cannot be output together.
 
+    :param args: list of argparse arguments
+    """
+    import VkContainer
+    import vk4surface
     layers = args.layer
-    log.debug("In main()\n\tLayers: {}\tlen(layers): {}".format(layers, len(layers)))
+    log.debug("In select_builder()\n\tLayers: {}\tlen(layers): {}".format(layers, len(layers)))
 
-    if len(layers) == 1 and (layers == 'L' or layers == 'H'):  # Height or Light data layers
+    if args.type not in output_types:
+        raise ValueError("type must be one of: " + ", ".join(output_types))
+    if layers in vk4surface.surface_maps:  # Surface maps of the height data
+        if args.type not in derived_output_types:
+            raise ValueError("type for surface map output must be one of: " +
+                             ", ".join(derived_output_types))
+        return VkContainer.Vk4BuilderHeight
+    if layers in ('waviness', 'roughness'):  # Gaussian filtered height data
+        if args.cutoff is None or args.cutoff <= 0:
+            raise ValueError("a positive --cutoff is required for waviness and roughness")
+        if args.type not in derived_output_types:
+            raise ValueError("type for waviness and roughness output must be one of: " +
+                             ", ".join(derived_output_types))
+        build = 'H'
+    elif args.type in ('ply', 'stl'):  # Mesh output, optionally colored by RGB peak data
+        if layers not in ('H', 'RGB') or (args.type == 'stl' and layers != 'H'):
+            raise ValueError("layer for ply output must be H or RGB, for stl output H")
+        if args.decimate < 1:
+            raise ValueError("decimate must be a positive integer")
+        build = 'H' if layers == 'H' else 'height_rgb_peak'
+    elif args.type in ('gsf', 'sdf'):  # Calibrated surface fields
+        if layers not in ('H', 'L'):
+            raise ValueError("layer for gsf and sdf output must be H or L")
+        build = layers
+    elif len(layers) == 1 and (layers == 'L' or layers == 'H'):  # Height or Light data layers
         build = layers
+    elif not layers or set(layers) - set('RGBL'):
+        raise ValueError("layer must be H, L, waviness, roughness or a combination " +
+                         "of R, G and B, optionally preceded by L")
     elif len(layers) > 1 and (layers[0] == 'L' or layers[1] == 'L'):  # RGB + light data layers
         build = 'rgb_light'
     else:  # RGB peak data layers
         build = 'rgb_peak'
 
-    builder_dict = {'L': VkContainer.Vk4BuilderLight,
-                    'H': VkContainer.Vk4BuilderHeight,
-                    'rgb_light': VkContainer.Vk4BuilderRGBlight,
-                    'rgb_peak': VkContainer.Vk4BuilderRGBpeak}
+    return getattr(VkContainer, builder_dict[build])
+
+
+def watch_folder(args, parser):
+    """watch_folder
+
+    Converts every new or changed vk4 file dropped into the --watch folder,
+    as defined by the arguments provided with args, until interrupted.
+    Returns 0 once stopped.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering watch_folder()")
+    if args.type is None or args.layer is None:
+        parser.error("the following arguments are required: -t/--type, -l/--layer")
+    if args.output is not None:
+        parser.error("-o/--output cannot be used with --watch")
+    if not os.path.isdir(args.watch):
+        parser.error("--watch folder {} does not exist".format(args.watch))
+    if args.interval <= 0 or args.queue_size < 1 or args.workers < 1:
+        parser.error("--interval, --queue-size and --workers must be positive")
+    try:
+        builder_class = select_builder(args)
+    except ValueError as err:
+        parser.error(str(err))
+
+    def process(path):
+        file_args = argparse.Namespace(**vars(args))
+        file_args.input = path
+        return convert_file(builder_class, file_args) is not None
+
+    import vk4watch
+    state = vk4watch.StateStore(args.state)
+    watcher = vk4watch.FolderWatcher(args.watch, process, state, args.interval,
+                                     args.queue_size, args.workers)
+    watcher.run()
+
+    log.debug("Exiting watch_folder()")
+    return 0
+
+
+def compare_files(args, parser):
+    """compare_files
+
+    Compares the height data of the scan given with --compare (before) to
+    the input scan (after), prints the comparison statistics as JSON and,
+    if an output type is given, outputs the height difference map. Returns
+    0 on success, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering compare_files()")
+    import vk4compare
+    import vk4out
+    import VkContainer
+    if len(args.input) > 1:
+        parser.error("--compare takes exactly one input file")
+    if args.layer not in (None, 'difference'):
+        parser.error("layer for --compare output must be difference")
+    if args.type is not None and args.type not in derived_output_types:
+        parser.error("type for --compare output must be one of: " +
+                     ", ".join(derived_output_types))
+
+    containers = []
+    for in_file_name in (args.compare.strip("'"), args.input[0].strip("'")):
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Invalid file - {}\n\t{}".format(in_file_name, '\n\t'.join(problems)))
+            return 1
+        log.info("Opening file - %s" % in_file_name)
+        with open(in_file_name, 'rb') as in_file:
+            director = VkContainer.VkDirector(VkContainer.Vk4BuilderHeight(in_file))
+            vk4_container = director.build()
+        log.info("Closing file - %s" % in_file_name)
+        prepare_container(vk4_container, args)
+        containers.append(vk4_container)
+
+    before, after = containers
+    result = vk4compare.compare_containers(before, after, threshold=args.threshold)
+    if result is None:
+        return 1
+    # with -o - standard output carries the difference map
+    print(json.dumps(result['statistics'], indent=2),
+          file=sys.stderr if args.output == '-' else sys.stdout)
+
+    if args.type is not None:
+        after.add_derived_layer('difference', result['difference'], 'um')
+        out_args = argparse.Namespace(**vars(args))
+        out_args.input = args.input[0].strip("'")
+        out_args.layer = 'difference'
+        vk4out.output_data(after, out_args)
+
+    log.debug("Exiting compare_files()")
+    return 0
+
+
+def summarize_files(args, parser):
+    """summarize_files
+
+    Summarizes the input files in parallel and writes the quality control
+    report (see vk4summary). Returns 0 if every file was valid, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering summarize_files()")
+    import vk4summary
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+    file_names = [in_file_name.strip("'") for in_file_name in args.input]
+    tracker = vk4progress.ProgressTracker(vk4progress.render_progress if args.progress
+                                          else None)
+    with vk4progress.tracking(tracker):
+        summaries, combined = vk4summary.summarize_files(file_names, args.workers)
+    for summary in summaries:
+        if summary['problems']:
+            log.error("Invalid file - {}\n\t{}".format(summary['file'], summary['problems']))
+    csv_name, json_name = vk4summary.write_report(args.summarize, summaries, combined)
+    log.info("Summarized {} files into {} and {}".format(combined['files'], csv_name, json_name))
+
+    log.debug("Exiting summarize_files()")
+    return 1 if combined['invalid_files'] else 0
+
+
+def stack_files(args, parser):
+    """stack_files
+
+    Stacks the height (or light) data of the input files into one memory
+    mapped npy file and writes the per-pixel statistics over the stack (see
+    vk4stack). Returns 0 if the stack was built, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering stack_files()")
+    import vk4stack
+    if args.layer not in (None, 'H', 'L'):
+        parser.error("layer for --stack must be H or L")
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+    if args.fill is not None:
+        parser.error("--fill cannot be used with --stack")
+    file_names = [in_file_name.strip("'") for in_file_name in args.input]
+    for in_file_name in file_names:
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Invalid file - {}\n\t{}".format(in_file_name, '\n\t'.join(problems)))
+            return 1
+    layer = 'H' if args.layer is None else args.layer
+
+    tracker = vk4progress.ProgressTracker(vk4progress.render_progress if args.progress
+                                          else None)
+    with vk4progress.tracking(tracker):
+        stack = vk4stack.build_stack(file_names, args.stack + '.npy', layer, args.workers,
+                                     args.mask)
+        if stack is None:
+            return 1
+        statistics = vk4stack.stack_statistics(stack)
+    stats_name = vk4stack.output_statistics(statistics, args.stack + '_stats.npz')
+    log.info("Stacked {} files into {}.npy and {}".format(len(file_names), args.stack,
+                                                         stats_name))
+
+    log.debug("Exiting stack_files()")
+    return 0
+
+
+def bearing_files(args, parser):
+    """bearing_files
+
+    Computes the functional parameters of the bearing area curve of each
+    input file's height data (or its waviness or roughness if given as the
+    layer) and prints them as JSON, keyed by file name. Invalid files are
+    skipped. Returns 0 if every file was processed, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering bearing_files()")
+    import vk4bearing
+    import vk4filter
+    import VkContainer
+    if args.layer not in (None, 'H', 'waviness', 'roughness'):
+        parser.error("layer for --bearing must be H, waviness or roughness")
+    if args.layer in ('waviness', 'roughness') and (args.cutoff is None or args.cutoff <= 0):
+        parser.error("a positive --cutoff is required for waviness and roughness")
+
+    status = 0
+    results = {}
+    for in_file_name in args.input:
+        in_file_name = in_file_name.strip("'")
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Skipping invalid file - {}\n\t{}"
+                      .format(in_file_name, '\n\t'.join(problems)))
+            status = 1
+            continue
+        log.info("Opening file - %s" % in_file_name)
+        with open(in_file_name, 'rb') as in_file:
+            director = VkContainer.VkDirector(VkContainer.Vk4BuilderHeight(in_file))
+            vk4_container = director.build()
+        log.info("Closing file - %s" % in_file_name)
+
+        prepare_container(vk4_container, args)
+        layer = 'H'
+        if args.layer in ('waviness', 'roughness'):
+            vk4filter.filter_container(vk4_container, args.cutoff)
+            layer = args.layer
+        histogram = vk4bearing.histogram_container(vk4_container, layer)
+        results[in_file_name] = vk4bearing.functional_parameters(histogram)
+
+    print(json.dumps(results, indent=2))
+    log.debug("Exiting bearing_files()")
+    return status
 
+
+def feature_files(args, parser):
+    """feature_files
+
+    Detects the particles or pits of each input file's height (or light)
+    data and outputs one row per feature as csv or json. Invalid files are
+    skipped. Returns 0 if every file was processed, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering feature_files()")
+    import vk4out
+    import vk4segment
+    import VkContainer
+    if args.layer not in (None, 'H', 'L'):
+        parser.error("layer for --features must be H or L")
+    if args.type not in ('csv', 'json'):
+        parser.error("type for --features output must be csv or json")
+    if len(args.input) > 1 and args.output is not None:
+        parser.error("-o/--output cannot be used with more than one input file")
+    layer = 'H' if args.layer is None else args.layer
+    builder_class = {'H': VkContainer.Vk4BuilderHeight, 'L': VkContainer.Vk4BuilderLight}[layer]
+    writers = {'csv': vk4segment.output_features_csv, 'json': vk4segment.output_features_json}
+    out_stream = sys.stdout.buffer if args.output == '-' else None
+
+    status = 0
+    for in_file_name in args.input:
+        in_file_name = in_file_name.strip("'")
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Skipping invalid file - {}\n\t{}"
+                      .format(in_file_name, '\n\t'.join(problems)))
+            status = 1
+            continue
+        log.info("Opening file - %s" % in_file_name)
+        with open(in_file_name, 'rb') as in_file:
+            vk4_container = VkContainer.VkDirector(builder_class(in_file)).build()
+        log.info("Closing file - %s" % in_file_name)
+
+        prepare_container(vk4_container, args)
+        result = vk4segment.detect_features(vk4_container, args.features, layer,
+                                            args.threshold)
+        if result is None:
+            status = 1
+            continue
+        log.info("Found {} {} in {}".format(len(result['features']), args.features,
+                                             in_file_name))
+
+        # files are named like other outputs, with the feature type as type
+        out_args = argparse.Namespace(**vars(args))
+        out_args.input = in_file_name
+        out_args.type = args.features
+        out_args.layer = layer
+        out_file_name = '-' if out_stream is not None else \
+            vk4out.output_file_name_maker(out_args) + '.' + args.type
+        writers[args.type](result, out_file_name, out_stream)
+
+    log.debug("Exiting feature_files()")
+    return status
+
+
+def profile_files(args, parser):
+    """profile_files
+
+    Samples the height (or light) data of each input file along the
+    profiles given with --profile and --profile-file and outputs them as
+    csv or npy. The layer data is memory mapped rather than decoded. Invalid
+    files are skipped. Returns 0 if every file was processed, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering profile_files()")
+    import vk4out
+    import vk4profile
+    if args.layer not in (None, 'H', 'L'):
+        parser.error("layer for --profile must be H or L")
+    if args.type not in ('csv', 'npy'):
+        parser.error("type for --profile output must be csv or npy")
+    if len(args.input) > 1 and args.output is not None:
+        parser.error("-o/--output cannot be used with more than one input file")
+    if args.fill is not None:
+        parser.error("--fill cannot be used with --profile")
+    texts = list(args.profile or [])
+    if args.profile_file is not None:
+        with open(args.profile_file) as profile_file:
+            texts.extend(line for line in profile_file if line.strip())
+    try:
+        polylines = [vk4profile.parse_polyline(text) for text in texts]
+    except ValueError as err:
+        parser.error(str(err))
+    layer = 'H' if args.layer is None else args.layer
+    writers = {'csv': vk4profile.output_profiles_csv, 'npy': vk4profile.output_profiles_npy}
+    out_stream = sys.stdout.buffer if args.output == '-' else None
+
+    status = 0
+    for in_file_name in args.input:
+        in_file_name = in_file_name.strip("'")
+        problems = vk4validate.validate_file(in_file_name)
+        if problems:
+            log.error("Skipping invalid file - {}\n\t{}"
+                      .format(in_file_name, '\n\t'.join(problems)))
+            status = 1
+            continue
+        result = vk4profile.sample_file(in_file_name, polylines, layer, args.units, args.mask)
+
+        # files are named like other outputs, with profile as type
+        out_args = argparse.Namespace(**vars(args))
+        out_args.input = in_file_name
+        out_args.type = 'profile'
+        out_args.layer = layer
+        out_file_name = '-' if out_stream is not None else \
+            vk4out.output_file_name_maker(out_args) + '.' + args.type
+        writers[args.type](result, out_file_name, out_stream)
+        log.info("Sampled {} profiles of {}".format(len(polylines), in_file_name))
+
+    log.debug("Exiting profile_files()")
+    return status
+
+
+def subset_files(args, parser):
+    """subset_files
+
+    Writes a vk4 file of each input file holding the layers given with -l,
+    cropped to the --crop window, copying the layer data without decoding
+    it (see vk4subset). Invalid files are skipped. Returns 0 if every file
+    was written, otherwise 1.
+
+    :param args: list of argparse arguments
+    :param parser: argparse parser, used to report invalid arguments
+    """
+    log.debug("Entering subset_files()")
+    import vk4out
+    import vk4subset
+    names = list(vk4subset.subset_layers) if args.layer is None else args.layer.split(',')
+    if any(name not in vk4subset.subset_layers for name in names):
+        parser.error("layers for vk4 output must be a comma separated list of " +
+                     ", ".join(vk4subset.subset_layers))
+    if args.mask or args.fill is not None or args.pitch is not None:
+        parser.error("--mask, --fill and --pitch cannot be used with -tvk4")
+    if len(args.input) > 1 and args.output is not None:
+        parser.error("-o/--output cannot be used with more than one input file")
+    crop = None
+    if args.crop is not None:
+        try:
+            crop = vk4subset.parse_crop(args.crop)
+        except ValueError as err:
+            parser.error(str(err))
+    layers = [vk4subset.subset_layers[name] for name in names]
+    out_stream = sys.stdout.buffer if args.output == '-' else None
+
+    status = 0
+    tracker = vk4progress.ProgressTracker(vk4progress.render_progress if args.progress
+                                          else None)
+    with vk4progress.tracking(tracker):
+        for in_file_name in args.input:
+            in_file_name = in_file_name.strip("'")
+            problems = vk4validate.validate_file(in_file_name)
+            if problems:
+                log.error("Skipping invalid file - {}\n\t{}"
+                          .format(in_file_name, '\n\t'.join(problems)))
+                status = 1
+                continue
+            # files are named like other outputs, the layers joined by '-'
+            out_args = argparse.Namespace(**vars(args))
+            out_args.input = in_file_name
+            out_args.layer = '-'.join(names)
+            out_file_name = '-' if out_stream is not None else \
+                vk4out.output_file_name_maker(out_args) + '.vk4'
+            if vk4subset.write_subset(in_file_name, out_file_name, layers, crop,
+                                      out_stream) is None:
+                status = 1
+                continue
+            log.info("Wrote {} of {} to {}".format(', '.join(names), in_file_name,
+                                                   out_file_name))
+
+    log.debug("Exiting subset_files()")
+    return status
+
+
+def check_files(file_names):
+    """check_files
+
+    Validates each vk4 file and prints one line per file stating whether it
+    is valid, followed by any problems found. Returns 0 if every file is
+    valid, otherwise 1.
+
+    :param file_names: list of vk4 filenames
+    """
+    log.debug("Entering check_files()")
+    status = 0
+    for file_name in file_names:
+        file_name = file_name.strip("'")
+        problems = vk4validate.validate_file(file_name)
+        if problems:
+            status = 1
+            print("INVALID {}: {}".format(file_name, '; '.join(problems)))
+        else:
+            print("OK      {}".format(file_name))
+
+    log.debug("Exiting check_files()")
+    return status
+
+
+def convert_file(builder_class, args):
+    """convert_file
+
+    Builds a VkContainer from a single vk4 file using the given builder class
+    and outputs its data as defined by the arguments provided with args.
+    Returns the name of the file written.
+
+    :param builder_class: VkBuilder class deciding which layers to extract
+    :param args: list of argparse arguments, with input set to one file
+    """
+    import vk4filter
+    import vk4out
+    import vk4surface
+    import VkContainer
+    in_file_name = args.input
     log.info("Opening file - %s" % in_file_name)
+    vk4progress.begin('decode', None, 'bytes')
 
     with open(in_file_name, 'rb') as in_file:
-        builder = builder_dict[build](in_file)
+        builder = builder_class(in_file)
         director = VkContainer.VkDirector(builder)
         vk4_container = director.build()
         log.debug("Vk4_container:\n\tVkContainer type:\n\t{}".format(type(vk4_container)))
 
     log.info("Closing file - %s" % in_file_name)
 
-    vk4out.output_data(vk4_container, args)
+    prepare_container(vk4_container, args)
+    if args.layer in ('waviness', 'roughness'):
+        vk4filter.filter_container(vk4_container, args.cutoff)
+    elif args.layer in vk4surface.surface_maps:
+        vk4surface.surface_container(vk4_container, (args.layer,))
 
-    log.info("Exiting main()")
-    log.info("Program completed execution")
+    return vk4out.output_data(vk4_container, args)
 
 
-if __name__ == '__main__':
-    main()
+def prepare_container(vk4_container, args):
+    """prepare_container
+
+    Masks or fills the invalid pixels of the VkContainer's height and light
+    data if requested with --mask or --fill, then resamples its layers to the
+    pixel pitch given with --pitch
 
+    :param vk4_container: VkContainer object
+    :param args: list of argparse arguments
+    """
+    import vk4mask
+    if args.fill is not None:
+        vk4mask.fill_container(vk4_container, args.fill)
+    elif args.mask:
+        vk4mask.mask_container(vk4_container)
+    if getattr(args, 'pitch', None) is not None:
+        import vk4resample
+        vk4resample.resample_container(vk4_container, *args.pitch)
 
+
+if __name__ == '__main__':
+    sys.exit(main())
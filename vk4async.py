@@ -0,0 +1,247 @@
+"""vk4async
+
+This module provides coroutines for reading and writing vk4 data from
+asyncio programs without blocking the event loop. Reading a file is split
+into reading the requested layers into a VkContainer, run on a pool of I/O
+threads, and the masking or filling of its invalid pixels, run on a pool for
+CPU work, so that while one file is being processed or written the next one
+can already be read from slow (e.g. network) storage. Only the offset table,
+metadata and requested layers are read, straight into the layer arrays, so
+the file is never held in memory as a whole. The number of reads and writes
+in progress at once is bounded by a semaphore.
+
+The CPU pool defaults to threads, which NumPy releases the GIL for during
+bulk array work. Any concurrent.futures executor may be given instead, e.g.
+a ProcessPoolExecutor, at the cost of copying containers between processes.
+
+Example
+-------
+    async def convert(paths):
+        for path in paths:
+            vk4_container = await vk4async.open_async(path, layers='H')
+            await vk4_container.write_async('tiff', 'H')
+
+    vk4async.configure(io_workers=8, cpu_workers=4, max_concurrency=8)
+    asyncio.run(convert(paths))
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import argparse
+import asyncio
+import copy
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import vk4_driver
+import vk4filter
+import vk4mask
+import vk4out
+import vk4surface
+import vk4validate
+import VkContainer
+
+log = logging.getLogger('vk4_driver.vk4async')
+
+# layers argument of open_async: builder class extracting those layers
+layer_builders = {'H': VkContainer.Vk4BuilderHeight,
+                  'L': VkContainer.Vk4BuilderLight,
+                  'rgb_peak': VkContainer.Vk4BuilderRGBpeak,
+                  'rgb_light': VkContainer.Vk4BuilderRGBlight,
+                  'height_rgb_peak': VkContainer.Vk4BuilderHeightRGBpeak,
+                  'all': VkContainer.Vk4Builder}
+
+
+class AsyncPool(object):
+    """AsyncPool
+
+    Executors for the I/O and CPU work of the coroutines and the limit on
+    how many operations are in progress at once
+
+    :param io_workers: number of threads reading files
+    :param cpu_workers: number of threads masking and writing, defaults to
+        the number of CPUs
+    :param max_concurrency: largest number of reads and writes in
+        progress at once, defaults to io_workers + cpu_workers
+    :param cpu_executor: optional concurrent.futures executor used for CPU
+        work instead of a thread pool
+    """
+    def __init__(self, io_workers=4, cpu_workers=None, max_concurrency=None, cpu_executor=None):
+        cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.io_executor = ThreadPoolExecutor(io_workers, thread_name_prefix='vk4-io')
+        self.cpu_executor = cpu_executor or \
+            ThreadPoolExecutor(cpu_workers, thread_name_prefix='vk4-cpu')
+        self.max_concurrency = max_concurrency or io_workers + cpu_workers
+        self.semaphores = dict()
+
+    def semaphore(self):
+        # semaphores belong to an event loop, so one is made for each loop
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[loop]
+
+    def shutdown(self):
+        self.io_executor.shutdown()
+        self.cpu_executor.shutdown()
+
+
+default_pool = None
+
+
+def configure(io_workers=4, cpu_workers=None, max_concurrency=None, cpu_executor=None):
+    """configure
+
+    Replaces the pool used by coroutines not given a pool of their own.
+    Returns the new AsyncPool.
+
+    :param io_workers: number of threads reading files
+    :param cpu_workers: number of threads masking and writing
+    :param max_concurrency: largest number of operations in progress at once
+    :param cpu_executor: optional executor used for CPU work
+    """
+    global default_pool
+    if default_pool is not None:
+        default_pool.shutdown()
+    default_pool = AsyncPool(io_workers, cpu_workers, max_concurrency, cpu_executor)
+    return default_pool
+
+
+def get_pool(pool):
+    if pool is not None:
+        return pool
+    if default_pool is None:
+        configure()
+    return default_pool
+
+
+def read_container(file_name, builder_class):
+    """read_container
+
+    Validates a vk4 file and reads it into a VkContainer using the given
+    builder class, which seeks to and reads only the layers it extracts.
+    Returns None if the file is invalid.
+
+    :param file_name: path to the vk4 file, stored in the container
+    :param builder_class: VkBuilder class deciding which layers to extract
+    """
+    with open(file_name, 'rb') as in_file:
+        problems = vk4validate.validate_vk4(in_file)
+        if problems:
+            log.error("In read_container()\n\tInvalid file - {}\n\t{}"
+                      .format(file_name, '\n\t'.join(problems)))
+            return None
+        vk4_container = VkContainer.VkDirector(builder_class(in_file)).build()
+    vk4_container.file_name = file_name
+    return vk4_container
+
+
+def mask_container(vk4_container, mask=False, fill=None):
+    """mask_container
+
+    Masks or fills the invalid pixels of a VkContainer if requested and
+    returns the container
+
+    :param vk4_container: VkContainer object
+    :param mask: if True invalid pixels are masked (see vk4mask)
+    :param fill: None, or 'nearest' or 'laplacian' to fill invalid pixels
+    """
+    if fill is not None:
+        vk4mask.fill_container(vk4_container, fill)
+    elif mask:
+        vk4mask.mask_container(vk4_container)
+    return vk4_container
+
+
+async def open_async(file_name, layers='H', mask=False, fill=None, pool=None):
+    """open_async
+
+    Coroutine reading the requested layers of a vk4 file into a VkContainer
+    on the pool's I/O threads, and masking or filling its invalid pixels on
+    its CPU pool. Returns None if the file is invalid.
+
+    :param file_name: path to the vk4 file
+    :param layers: string - layers to extract, a key of layer_builders, or a
+        VkBuilder class
+    :param mask: if True invalid pixels are masked (see vk4mask)
+    :param fill: None, or 'nearest' or 'laplacian' to fill invalid pixels
+    :param pool: AsyncPool object, defaults to the one set with configure()
+    """
+    pool = get_pool(pool)
+    builder_class = layer_builders.get(layers, layers)
+    loop = asyncio.get_running_loop()
+    async with pool.semaphore():
+        log.debug("In open_async()\n\tReading {}".format(file_name))
+        vk4_container = await loop.run_in_executor(pool.io_executor, read_container,
+                                                   file_name, builder_class)
+        if vk4_container is None or (not mask and fill is None):
+            return vk4_container
+        log.debug("In open_async()\n\tMasking {}".format(file_name))
+        return await loop.run_in_executor(pool.cpu_executor, mask_container, vk4_container,
+                                          mask, fill)
+
+
+def write_container(vk4_container, args):
+    """write_container
+
+    Outputs a layer of a VkContainer as defined by args, first computing the
+    waviness, roughness or surface map if that layer is requested. These are
+    computed on every call, with the cutoff given, on a shallow copy of the
+    container with its own derived layers, so the container is not changed
+    and concurrent writes do not see each other's layers. Returns the name
+    of the file written.
+
+    :param vk4_container: VkContainer object
+    :param args: argparse Namespace with the arguments vk4out.output_data uses
+    """
+    if args.layer in ('waviness', 'roughness') or args.layer in vk4surface.surface_maps:
+        working = copy.copy(vk4_container)
+        working.derived_data = dict(vk4_container.derived_data)
+        if args.layer in vk4surface.surface_maps:
+            vk4surface.surface_container(working, (args.layer,))
+        else:
+            vk4filter.filter_container(working, args.cutoff)
+        vk4_container = working
+    return vk4out.output_data(vk4_container, args)
+
+
+async def write_async(vk4_container, output_type, layer, output=None, decimate=1, cutoff=None,
+                      pool=None):
+    """write_async
+
+    Coroutine outputting a layer of a VkContainer, as vk4_driver does for
+    the -t and -l arguments, on the pool's CPU pool. Returns the name of the
+    file written. Raises ValueError if the type and layer cannot be output
+    together or the cutoff of waviness or roughness is missing.
+
+    :param vk4_container: VkContainer object
+    :param output_type: string - output type, as the -t argument
+    :param layer: string - data layer, as the -l argument
+    :param output: output file basename, defaults to one made from the
+        container's file name, type and layer
+    :param decimate: use every Nth pixel for ply and stl output
+    :param cutoff: Gaussian filter cutoff in micrometers for the waviness
+        and roughness layers
+    :param pool: AsyncPool object, defaults to the one set with configure()
+    """
+    pool = get_pool(pool)
+    args = argparse.Namespace(input=vk4_container.file_name or 'vk4.vk4', type=output_type,
+                              layer=layer, output=output, decimate=decimate, cutoff=cutoff)
+    # checks the arguments as the command line and the server do
+    vk4_driver.select_builder(args)
+    loop = asyncio.get_running_loop()
+    async with pool.semaphore():
+        return await loop.run_in_executor(pool.cpu_executor, write_container,
+                                          vk4_container, args)
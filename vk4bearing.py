@@ -0,0 +1,344 @@
+"""vk4bearing
+
+This module computes the areal material ratio (bearing area or
+Abbott-Firestone) curve of VkContainer height data and the ISO 25178-2
+functional parameters derived from it: the Sk family (Sk, Spk, Svk, Smr1,
+Smr2) and the material and void volumes (Vmp, Vmc, Vvc, Vvv).
+
+Rather than sorting every height value, the curve is built from a histogram
+of the integer height counts. The counts are already quantized by the z
+length per digit, so a histogram with one bin per count loses nothing and is
+built in a single O(N) pass. If the range of the counts would need more than
+MAX_BINS bins, neighbouring counts are combined into bins of 2, 4, 8...
+counts, which at 2 ** 16 bins still resolves the range of the data to a few
+thousandths of a percent. The blocks of a scan are counted straight into one
+histogram, widened only when a block reaches past its bins. Histograms of
+separate tiles can also be built and merged, so the whole scan never needs
+to be held as floats.
+
+A histogram is a dictionary holding the height of one count in micrometers
+('z_scale'), the number of counts combined per bin as a power of two
+('bin_shift'), the first bin ('offset') and the bin 'counts'.
+
+Example
+-------
+    histogram = vk4bearing.histogram_container(vk4_container)
+    parameters = vk4bearing.functional_parameters(histogram)
+    material_ratio, height = vk4bearing.bearing_curve(histogram)
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+
+log = logging.getLogger('vk4_driver.vk4bearing')
+
+# largest number of histogram bins before counts are combined into wider bins
+MAX_BINS = 2 ** 16
+
+# number of height values added to a histogram per block
+HISTOGRAM_BLOCK_CELLS = 2 ** 20
+
+
+def fitting_shift(low, high, bin_shift=0):
+    """fitting_shift
+
+    Returns the smallest bin shift, not less than the one given, with which
+    the counts from low to high fit in MAX_BINS bins
+
+    :param low: lowest count
+    :param high: highest count
+    :param bin_shift: number of counts per bin as a power of two
+    """
+    while (high >> bin_shift) - (low >> bin_shift) >= MAX_BINS:
+        bin_shift += 1
+    return bin_shift
+
+
+def histogram_counts(values, z_scale, bin_shift=0):
+    """histogram_counts
+
+    Returns the histogram of an array of integer height counts, e.g. one tile
+    or block of rows of the height data. The bin shift is increased from the
+    one given until the range of the values fits in MAX_BINS bins.
+
+    :param values: numpy array of integer height counts
+    :param z_scale: height of one count in micrometers
+    :param bin_shift: number of counts per bin as a power of two
+    """
+    values = np.ravel(values)
+    # np.bincount takes values which cast safely to intp
+    if not np.can_cast(values.dtype, np.intp):
+        values = values.astype(np.int64)
+    if not values.size:
+        return {'z_scale': z_scale, 'bin_shift': bin_shift, 'offset': 0,
+                'counts': np.zeros(0, dtype=np.int64)}
+    bin_shift = fitting_shift(int(values.min()), int(values.max()), bin_shift)
+    low = int(values.min()) >> bin_shift
+    high = int(values.max()) >> bin_shift
+    counts = np.zeros(high - low + 1, dtype=np.int64)
+    add_counts(counts, values, bin_shift, low)
+    return {'z_scale': z_scale, 'bin_shift': bin_shift, 'offset': low, 'counts': counts}
+
+
+def add_counts(counts, values, bin_shift, offset):
+    """add_counts
+
+    Adds the integer height counts of an array to the bins of a histogram's
+    counts in place. The values must fall within the bins.
+
+    :param counts: int64 numpy array of bin counts
+    :param values: 1d numpy array of integer height counts
+    :param bin_shift: number of counts per bin as a power of two
+    :param offset: first bin of counts
+    """
+    # for unsigned counts the subtraction cannot wrap, as no value lies
+    # below the first bin
+    bins = values >> bin_shift if bin_shift else values - 0
+    bins -= values.dtype.type(offset)
+    counts += np.bincount(bins, minlength=counts.size)
+
+
+def coarsen_histogram(histogram, bin_shift):
+    """coarsen_histogram
+
+    Returns a copy of a histogram with its bins combined so that each bin
+    spans 2 ** bin_shift counts
+
+    :param histogram: histogram dictionary
+    :param bin_shift: new bin shift, not less than the histogram's bin shift
+    """
+    extra = bin_shift - histogram['bin_shift']
+    counts = histogram['counts']
+    bins = (histogram['offset'] + np.arange(counts.size, dtype=np.int64)) >> extra
+    offset = int(bins[0]) if bins.size else histogram['offset'] >> extra
+    return {'z_scale': histogram['z_scale'], 'bin_shift': bin_shift, 'offset': offset,
+            'counts': np.bincount(bins - offset, weights=counts,
+                                  minlength=int(counts.size > 0)).astype(np.int64)}
+
+
+def merge_histograms(histograms):
+    """merge_histograms
+
+    Returns the histogram of all values counted by a list of histograms, e.g.
+    those of the tiles of a scan, which must share the same z scale. The
+    bins are coarsened where needed so that they line up and the merged
+    range fits in MAX_BINS bins.
+
+    :param histograms: list of histogram dictionaries
+    """
+    histograms = [histogram for histogram in histograms if histogram['counts'].size]
+    if not histograms:
+        return histogram_counts(np.zeros(0, dtype=np.int64), 1.0)
+    z_scale = histograms[0]['z_scale']
+    if any(histogram['z_scale'] != z_scale for histogram in histograms):
+        log.error("In merge_histograms()\n\tHistograms have different z scales")
+        return None
+
+    # lowest and highest count covered by any histogram
+    low_count = min(histogram['offset'] << histogram['bin_shift']
+                    for histogram in histograms)
+    high_count = max(((histogram['offset'] + histogram['counts'].size) << histogram['bin_shift']) - 1
+                     for histogram in histograms)
+    bin_shift = fitting_shift(low_count, high_count,
+                              max(histogram['bin_shift'] for histogram in histograms))
+    low, high = low_count >> bin_shift, high_count >> bin_shift
+
+    counts = np.zeros(high - low + 1, dtype=np.int64)
+    for histogram in histograms:
+        if histogram['bin_shift'] != bin_shift:
+            histogram = coarsen_histogram(histogram, bin_shift)
+        start = histogram['offset'] - low
+        counts[start:start + histogram['counts'].size] += histogram['counts']
+    return {'z_scale': z_scale, 'bin_shift': bin_shift, 'offset': low, 'counts': counts}
+
+
+def bin_heights(histogram):
+    """bin_heights
+
+    Returns the height in micrometers at the centre of every bin of a
+    histogram
+
+    :param histogram: histogram dictionary
+    """
+    width = 2 ** histogram['bin_shift']
+    bins = histogram['offset'] + np.arange(histogram['counts'].size)
+    return (bins * width + (width - 1) / 2.0) * histogram['z_scale']
+
+
+def histogram_container(vk4_container, layer='H'):
+    """histogram_container
+
+    Returns the histogram of the height data of a VkContainer, excluding the
+    pixels marked invalid in its height mask. The data is counted in blocks
+    of about HISTOGRAM_BLOCK_CELLS pixels, added to the histogram in place;
+    the histogram is only widened, and its bins coarsened, when a block
+    reaches past its bins, so it ends up sized from the range of the valid
+    counts. Derived layers in micrometers, such as 'roughness',
+    are quantized to the container's z length per digit first, and their NaN
+    pixels excluded.
+
+    :param vk4_container: VkContainer object
+    :param layer: 'H' for the height data or the name of a derived layer
+    """
+    log.debug("Entering histogram_container()\n\tLayer: {}".format(layer))
+    z_scale = vk4_container.measurement_conditions['z_length_per_digit'] / 1.0e6
+    if layer == 'H':
+        data = vk4_container.height_data['data']
+        valid = vk4_container.valid_masks.get('height')
+    else:
+        data = vk4_container.derived_data[layer]['data']
+        valid = None
+    if valid is not None:
+        valid = np.ravel(valid)
+
+    histogram = histogram_counts(np.zeros(0, dtype=np.int64), z_scale)
+    for start in range(0, data.size, HISTOGRAM_BLOCK_CELLS):
+        block = data[start:start + HISTOGRAM_BLOCK_CELLS]
+        if layer != 'H':
+            block = np.rint(block[np.isfinite(block)] / z_scale).astype(np.int64)
+        elif valid is not None:
+            block = block[valid[start:start + HISTOGRAM_BLOCK_CELLS]]
+        if not block.size:
+            continue
+        bin_shift = histogram['bin_shift']
+        first = histogram['offset']
+        last = first + histogram['counts'].size - 1
+        if histogram['counts'].size and first <= int(block.min()) >> bin_shift and \
+                int(block.max()) >> bin_shift <= last:
+            add_counts(histogram['counts'], block, bin_shift, first)
+        else:
+            # the first block, or one reaching past the bins so far, widens
+            # (and if need be coarsens) the histogram
+            histogram = merge_histograms([histogram, histogram_counts(block, z_scale, bin_shift)])
+
+    log.debug("Exiting histogram_container()\n\tBins: {} of {} counts"
+              .format(histogram['counts'].size, 2 ** histogram['bin_shift']))
+    return histogram
+
+
+def material_ratio(histogram, height):
+    """material_ratio
+
+    Returns the areal material ratio Smr(c), the fraction of values at or
+    above the given height, from a histogram
+
+    :param histogram: histogram dictionary
+    :param height: height c in micrometers
+    """
+    counts = histogram['counts']
+    total = counts.sum()
+    if not total:
+        return 0.0
+    return float(counts[bin_heights(histogram) >= height].sum()) / total
+
+
+def bearing_curve(histogram, n_points=1001):
+    """bearing_curve
+
+    Returns the bearing area (Abbott-Firestone) curve of a histogram as two
+    arrays, the material ratios from 0 to 1 and the height in micrometers
+    at which each material ratio is reached, i.e. the inverse areal material
+    ratio Smc(mr) measured from zero height.
+
+    :param histogram: histogram dictionary
+    :param n_points: number of equally spaced material ratios
+    """
+    ratios = np.linspace(0.0, 1.0, n_points)
+    counts = histogram['counts'][::-1]
+    heights = bin_heights(histogram)[::-1]
+    above = np.cumsum(counts) / float(max(counts.sum(), 1))
+    index = np.searchsorted(above, ratios * (1.0 - 1.0e-12))
+    np.minimum(index, heights.size - 1, out=index)
+    return ratios, heights[index]
+
+
+def mean_excess(histogram, height, above):
+    """mean_excess
+
+    Returns the mean over all values of how far each lies above (or below)
+    the given height, counting values on the other side as 0. This is the
+    area between the bearing area curve and a horizontal line at that
+    height, i.e. a material volume (above) or void volume (below) per unit
+    area.
+
+    :param histogram: histogram dictionary
+    :param height: height in micrometers
+    :param above: True to measure values above the height, False below
+    """
+    counts = histogram['counts']
+    excess = bin_heights(histogram) - height
+    if not above:
+        excess = -excess
+    return float((counts * np.maximum(excess, 0.0)).sum()) / max(counts.sum(), 1)
+
+
+def functional_parameters(histogram, p=0.1, q=0.8):
+    """functional_parameters
+
+    Computes the ISO 25178-2 functional parameters of a histogram and
+    returns them in a dictionary:
+
+        Sk_um - core height, the height difference of the equivalent line
+            through the flattest 40% secant of the bearing area curve
+            between material ratios 0 and 100%
+        Spk_um, Svk_um - reduced peak and valley heights, the heights of the
+            triangles with the same area as the peaks above and the valleys
+            below the core
+        Smr1_pct, Smr2_pct - material ratios at the top and bottom of the core
+        Vmp_ml_m2 - peak material volume at material ratio p
+        Vmc_ml_m2 - core material volume between material ratios p and q
+        Vvc_ml_m2 - core void volume between material ratios p and q
+        Vvv_ml_m2 - dale void volume at material ratio q
+
+    Volumes per unit area are in ml/m2, which equals um3/um2.
+
+    :param histogram: histogram dictionary
+    :param p: material ratio dividing the peaks from the core, 0 to 1
+    :param q: material ratio dividing the core from the dales, 0 to 1
+    """
+    log.debug("Entering functional_parameters()")
+    ratios, heights = bearing_curve(histogram)
+
+    # flattest secant spanning 40% of the material ratio
+    window = int(round(0.4 * (ratios.size - 1)))
+    drops = heights[:-window] - heights[window:]
+    start = int(np.argmin(drops))
+    slope = (heights[start + window] - heights[start]) / (ratios[start + window] - ratios[start])
+    top = float(heights[start] - slope * ratios[start])
+    bottom = float(top + slope)
+
+    smr1 = material_ratio(histogram, top)
+    smr2 = material_ratio(histogram, bottom)
+    peak_area = mean_excess(histogram, top, True)
+    valley_area = mean_excess(histogram, bottom, False)
+
+    p_height = float(np.interp(p, ratios, heights))
+    q_height = float(np.interp(q, ratios, heights))
+    parameters = {'Sk_um': float(top - bottom),
+                  'Spk_um': 2.0 * peak_area / smr1 if smr1 > 0 else 0.0,
+                  'Svk_um': 2.0 * valley_area / (1.0 - smr2) if smr2 < 1 else 0.0,
+                  'Smr1_pct': 100.0 * smr1,
+                  'Smr2_pct': 100.0 * smr2,
+                  'Vmp_ml_m2': mean_excess(histogram, p_height, True),
+                  'Vmc_ml_m2': mean_excess(histogram, q_height, True) -
+                  mean_excess(histogram, p_height, True),
+                  'Vvc_ml_m2': mean_excess(histogram, p_height, False) -
+                  mean_excess(histogram, q_height, False),
+                  'Vvv_ml_m2': mean_excess(histogram, q_height, False)}
+
+    log.debug("Exiting functional_parameters()\n\tParameters: {}".format(parameters))
+    return parameters
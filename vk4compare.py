@@ -0,0 +1,299 @@
+"""vk4compare
+
+This module compares the height data of two VkContainer objects, typically
+a scan of a part before and after some process such as cleaning. The scans
+are registered by a subpixel translation found with FFT phase correlation,
+after which a per-pixel height difference map (after - before) and summary
+statistics in physical units are computed.
+
+The difference map can be stored in the 'after' container as a derived layer
+named 'difference' so that it can be output by any of the vk4out writers.
+
+Example
+-------
+    before = VkDirector(Vk4BuilderHeight(before_file)).build()
+    after = VkDirector(Vk4BuilderHeight(after_file)).build()
+    result = vk4compare.compare_containers(before, after)
+    after.add_derived_layer('difference', result['difference'], 'um')
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+
+log = logging.getLogger('vk4_driver.vk4compare')
+
+# fraction of the peak cross-power magnitude added to every frequency bin
+# before normalizing in phase_correlation
+PHASE_REGULARIZATION = 1.0e-2
+
+# subdivisions of a pixel on which refine_peak evaluates the correlation
+UPSAMPLE_FACTOR = 20
+
+# phase_correlation re-estimates the shift until it moves by less than
+# SHIFT_TOLERANCE pixels, at most SHIFT_ESTIMATES times
+SHIFT_TOLERANCE = 1.0e-2
+SHIFT_ESTIMATES = 8
+
+
+def phase_correlation(reference, moving):
+    """phase_correlation
+
+    Estimates the translation (dy, dx) in pixels, with subpixel precision,
+    such that moving[y, x] ~= reference[y - dy, x - dx]. The (regularized)
+    normalized cross-power spectrum of the two Hann windowed images is
+    transformed back to find the correlation peak, which is refined with
+    refine_peak.
+
+    Windowing both images alike weights the same surface differently in
+    each, which pulls the estimate towards zero shift by a tenth of a pixel
+    or more, the more so the larger the shift is compared to the image. The
+    shift is therefore estimated again with the window of moving shifted by
+    the last estimate, until the estimate settles.
+
+    :param reference: 2d numpy array
+    :param moving: 2d numpy array of the same shape as reference
+    """
+    log.debug("Entering phase_correlation()")
+    rows, cols = reference.shape
+    # invalid (NaN) pixels are set to the mean, i.e. zero after centring
+    reference = centre_finite(reference)
+    moving = centre_finite(moving)
+    ref_fft = np.conj(np.fft.rfft2(reference * np.outer(hann_window(rows), hann_window(cols))))
+
+    shift = (0.0, 0.0)
+    for estimate in range(SHIFT_ESTIMATES):
+        window = np.outer(hann_window(rows, shift[0]), hann_window(cols, shift[1]))
+        cross_power = np.fft.rfft2(moving * window) * ref_fft
+        magnitude = np.abs(cross_power)
+        # the regularization term keeps near-empty frequency bins of smooth
+        # surfaces from being amplified into noise by the normalization
+        cross_power /= magnitude + PHASE_REGULARIZATION * magnitude.max()
+        correlation = np.fft.irfft2(cross_power, s=(rows, cols))
+        peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+        # peaks past the midpoint correspond to negative shifts
+        peak = tuple(int(p) - size if p > size // 2 else int(p)
+                     for p, size in zip(peak, (rows, cols)))
+        last, shift = shift, refine_peak(cross_power, (rows, cols), peak)
+        if estimate and max(abs(shift[0] - last[0]), abs(shift[1] - last[1])) < SHIFT_TOLERANCE:
+            break
+
+    log.debug("Exiting phase_correlation() with shift (dy, dx): {}".format(shift))
+    return shift
+
+
+def hann_window(size, shift=0.0):
+    """hann_window
+
+    Returns the Hann window of numpy.hanning(size) translated by shift
+    pixels, zero where it is moved past the ends
+
+    :param size: number of samples
+    :param shift: translation in pixels
+    """
+    if size < 2:
+        return np.ones(size)
+    position = np.arange(size) - shift
+    window = 0.5 - 0.5 * np.cos(2.0 * np.pi * position / (size - 1))
+    window[(position < 0) | (position > size - 1)] = 0.0
+    return window
+
+
+def refine_peak(cross_power, shape, peak):
+    """refine_peak
+
+    Returns the subpixel position (dy, dx) of the correlation peak nearest
+    the whole pixel peak. The correlation is evaluated on a grid of
+    1 / UPSAMPLE_FACTOR pixels within 1.5 pixels of peak by a matrix
+    multiplied inverse DFT of the cross-power spectrum (Guizar-Sicairos et
+    al.'s upsampled DFT), and a parabola is fitted through the grid maximum
+    and its neighbours along each axis.
+
+    :param cross_power: normalized cross-power spectrum from numpy.fft.rfft2
+    :param shape: tuple - rows and columns of the images
+    :param peak: tuple - whole pixel position of the peak, signed
+    """
+    rows, cols = shape
+    offsets = (np.arange(3 * UPSAMPLE_FACTOR + 1) - 1.5 * UPSAMPLE_FACTOR) / UPSAMPLE_FACTOR
+    ys = peak[0] + offsets
+    xs = peak[1] + offsets
+    row_kernel = np.exp(2j * np.pi * np.outer(ys, np.fft.fftfreq(rows)))
+    col_kernel = np.exp(2j * np.pi * np.outer(np.fft.rfftfreq(cols), xs))
+    # the rfft2 spectrum holds half of the columns, the others being complex
+    # conjugates which add the same real part
+    weights = np.full(col_kernel.shape[0], 2.0)
+    weights[0] = 1.0
+    if cols % 2 == 0:
+        weights[-1] = 1.0
+    correlation = (row_kernel @ (cross_power * weights) @ col_kernel).real
+
+    iy, ix = np.unravel_index(np.argmax(correlation), correlation.shape)
+    shift = []
+    for position, index, axis_values in ((ys, iy, correlation[:, ix]),
+                                         (xs, ix, correlation[iy, :])):
+        offset = 0.0
+        if 0 < index < len(axis_values) - 1:
+            before, centre, after = axis_values[index - 1:index + 2]
+            denominator = before - 2.0 * centre + after
+            if denominator != 0:
+                offset = 0.5 * (before - after) / denominator / UPSAMPLE_FACTOR
+        shift.append(float(position[index] + offset))
+    return tuple(shift)
+
+
+def centre_finite(matrix):
+    """centre_finite
+
+    Returns a copy of matrix minus the mean of its finite values, with
+    non-finite (invalid) values set to 0.
+
+    :param matrix: 2d numpy array
+    """
+    finite = np.isfinite(matrix)
+    mean = matrix[finite].mean() if finite.any() else 0.0
+    return np.where(finite, matrix - mean, 0.0)
+
+
+def shift_matrix(matrix, dy, dx):
+    """shift_matrix
+
+    Returns a float64 copy of matrix translated by (dy, dx) pixels using
+    bilinear interpolation, such that out[y, x] = matrix[y - dy, x - dx].
+    Pixels that fall outside of the original matrix are set to NaN.
+
+    :param matrix: 2d numpy array
+    :param dy: shift along rows in pixels
+    :param dx: shift along columns in pixels
+    """
+    log.debug("Entering shift_matrix()")
+    int_y, int_x = int(np.floor(dy)), int(np.floor(dx))
+    frac_y, frac_x = dy - int_y, dx - int_x
+
+    out = np.zeros(matrix.shape, dtype=np.float64)
+    for sy, sx, weight in ((int_y, int_x, (1 - frac_y) * (1 - frac_x)),
+                           (int_y, int_x + 1, (1 - frac_y) * frac_x),
+                           (int_y + 1, int_x, frac_y * (1 - frac_x)),
+                           (int_y + 1, int_x + 1, frac_y * frac_x)):
+        # terms with no weight are skipped so they do not spread NaN edges
+        if weight > 0:
+            out += weight * integer_shift(matrix, sy, sx)
+
+    log.debug("Exiting shift_matrix()")
+    return out
+
+
+def integer_shift(matrix, sy, sx):
+    """integer_shift
+
+    Returns a float64 copy of matrix translated by whole pixels, such that
+    out[y, x] = matrix[y - sy, x - sx], with NaN where there is no source.
+
+    :param matrix: 2d numpy array
+    :param sy: shift along rows in pixels
+    :param sx: shift along columns in pixels
+    """
+    rows, cols = matrix.shape
+    out = np.full((rows, cols), np.nan)
+    if abs(sy) >= rows or abs(sx) >= cols:
+        return out
+    out[max(sy, 0):rows + min(sy, 0), max(sx, 0):cols + min(sx, 0)] = \
+        matrix[max(-sy, 0):rows + min(-sy, 0), max(-sx, 0):cols + min(-sx, 0)]
+    return out
+
+
+def compare_containers(before, after, threshold=None, register=True):
+    """compare_containers
+
+    Registers the height data of two VkContainers and computes the per-pixel
+    height difference (after - before) in micrometers. Returns a dictionary
+    holding the 'difference' map, a (height, width) float64 array with NaN
+    where the registered scans do not overlap or either scan's height mask
+    marks a pixel invalid, and 'statistics', a dictionary of summary values:
+
+        shift_x, shift_y - registration shift in pixels
+        shift_x_um, shift_y_um - registration shift in micrometers
+        overlap_fraction - fraction of pixels covered by valid pixels of
+            both scans
+        threshold_um - height change threshold used
+        mean_difference_um - mean height change
+        volume_added_um3, volume_removed_um3 - volume of the pixels that rose
+            or fell by more than the threshold
+        net_volume_um3 - volume change over all overlapping pixels
+        changed_area_um2, changed_area_fraction - area, and fraction of the
+            overlap, that changed by more than the threshold
+
+    Returns None if the scans differ in size or pixel size, or if no valid
+    pixels of the registered scans overlap.
+
+    :param before: VkContainer object with height data
+    :param after: VkContainer object with height data
+    :param threshold: height change in micrometers above which a pixel is
+        counted as changed. Defaults to three times the robust standard
+        deviation (1.4826 * median absolute deviation) of the difference map
+    :param register: if False the scans are compared without registration
+    """
+    log.debug("Entering compare_containers()")
+    before_height = before.get_calibrated_height()
+    after_height = after.get_calibrated_height()
+    if before_height.shape != after_height.shape:
+        log.error("In compare_containers()\n\tScans of {} and {} pixels cannot "
+                  "be compared".format(before_height.shape, after_height.shape))
+        return None
+    if before.get_pixel_size() != after.get_pixel_size():
+        log.error("In compare_containers()\n\tScans with pixel sizes {} and {} um "
+                  "cannot be compared".format(before.get_pixel_size(),
+                                              after.get_pixel_size()))
+        return None
+
+    x_size, y_size = after.get_pixel_size()
+    if register:
+        dy, dx = phase_correlation(before_height, after_height)
+        difference = after_height - shift_matrix(before_height, dy, dx)
+    else:
+        dy, dx = 0.0, 0.0
+        difference = after_height - before_height
+    del before_height, after_height
+
+    valid = np.isfinite(difference)
+    valid_difference = difference[valid]
+    if not valid_difference.size:
+        log.error("In compare_containers()\n\tThe scans have no valid pixels in common "
+                  "after a shift of ({:.2f}, {:.2f}) pixels".format(dx, dy))
+        return None
+    if threshold is None:
+        median = np.median(valid_difference)
+        threshold = 3.0 * 1.4826 * np.median(np.abs(valid_difference - median))
+
+    pixel_area = x_size * y_size
+    added = valid_difference > threshold
+    removed = valid_difference < -threshold
+    statistics = {'shift_x': dx,
+                  'shift_y': dy,
+                  'shift_x_um': dx * x_size,
+                  'shift_y_um': dy * y_size,
+                  'overlap_fraction': valid_difference.size / float(difference.size),
+                  'threshold_um': float(threshold),
+                  'mean_difference_um': float(valid_difference.mean()),
+                  'volume_added_um3': float(valid_difference[added].sum() * pixel_area),
+                  # abs so that no volume removed is 0.0 rather than -0.0
+                  'volume_removed_um3': float(abs(valid_difference[removed].sum()) * pixel_area),
+                  'net_volume_um3': float(valid_difference.sum() * pixel_area),
+                  'changed_area_um2': float((added.sum() + removed.sum()) * pixel_area),
+                  'changed_area_fraction': float(added.sum() + removed.sum()) /
+                  valid_difference.size}
+
+    log.debug("Exiting compare_containers()\n\tStatistics: {}".format(statistics))
+    return {'difference': difference, 'statistics': statistics}
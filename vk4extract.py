@@ -15,16 +15,80 @@ Created
 
 Last Modified
 -------------
-19 July 2018
+18 October 2026
 
 """
 import logging
 import struct
-import numpy as np
+import vk4layer
+import vk4progress
+# NumPy is imported by the functions decoding layer data, so that reading
+# headers and metadata (e.g. vk4_driver info) does not pay for importing it
 # import readbinary as rb
 
 log = logging.getLogger('vk4_driver.vk4extract')
 
+# vk4 files begin with these four bytes
+VK4_EXTENSION = b'VK4_'
+
+# bytes of the width, height, bit depth, compression, byte size, palette
+# range and palette fields before the height and light data
+IMG_HEADER_BYTES = 28 + 768
+
+# header fields of the height and light data and their storage data types
+img_header_fields = ('width', 'height', 'bit_depth', 'compression', 'data_byte_size',
+                     'palette_range_min', 'palette_range_max')
+img_data_types = {'height': '<u4', 'light': '<u2'}
+
+# layer data is read in chunks of this many bytes, between which progress
+# is reported and cancellation checked (see vk4progress)
+READ_CHUNK_BYTES = 2 ** 24
+
+
+def read_into_array(in_file, array):
+    """read_into_array
+
+    Fills a contiguous numpy array with the next array.nbytes bytes of the
+    file, reading straight into the array in chunks of READ_CHUNK_BYTES.
+    Raises EOFError if the file ends early, so a truncated vk4 file fails at
+    once instead of partway through a layer.
+
+    :param in_file: open file obj, must be vk4 file
+    :param array: contiguous numpy array to fill
+    """
+    buffer = memoryview(array).cast('B')
+    n_read = 0
+    while n_read < array.nbytes:
+        n_chunk = in_file.readinto(buffer[n_read:n_read + READ_CHUNK_BYTES])
+        if not n_chunk:
+            raise EOFError("vk4 file ended after {} of {} bytes of layer data"
+                           .format(n_read, array.nbytes))
+        n_read += n_chunk
+        vk4progress.advance('decode', n_chunk)
+    return array
+
+
+# extract the file header
+def extract_header(in_file):
+    """extract_header
+
+    Extracts the 12 byte header at the start of a vk4 file, namely the file
+    extension, dll version and file type. Returns values in dictionary
+
+    :param in_file: open file obj, must be vk4 file
+    """
+    log.debug("Entering extract_header()")
+
+    header = dict()
+    in_file.seek(0)
+    header['extension'] = in_file.read(4)
+    header['dll_version'] = struct.unpack('<I', in_file.read(4))[0]
+    header['file_type'] = struct.unpack('<I', in_file.read(4))[0]
+
+    log.debug("Exiting extract_header()")
+    return header
+
+
 # extract offsets for data sections of vk4 file
 def extract_offsets(in_file):
     """extract_offsets
@@ -186,16 +250,17 @@ def extract_color_data(offset_dict, color_type, in_file):
     """extract_color_data
 
     Extracts RGB metadata and raw image data from a vk4 file. Stores data and
-    returns as dictionary
+    returns as a vk4layer.ColorLayer, which supports dictionary access
 
     :param offset_dict: dictionary - offset values in vk4
     :param color_type: string - type of data, must be 'peak' or 'light'
     :param in_file: open file obj, must be vk4 file
     """
     log.debug("Entering extract_color_data()")
+    import numpy as np
 
     rgb_types = {'peak': 'color_peak', 'light': 'color_light'}
-    rgb_color_data = dict()
+    rgb_color_data = vk4layer.ColorLayer()
     rgb_color_data['name'] = 'RGB ' + color_type
     in_file.seek(offset_dict[rgb_types[color_type]])
 
@@ -205,16 +270,9 @@ def extract_color_data(offset_dict, color_type, in_file):
     rgb_color_data['compression'] = struct.unpack('<I', in_file.read(4))[0]
     rgb_color_data['data_byte_size'] = struct.unpack('<I', in_file.read(4))[0]
 
-    rgb_color_arr = np.zeros(((rgb_color_data['width'] * rgb_color_data['height']),
+    rgb_color_arr = np.empty(((rgb_color_data['width'] * rgb_color_data['height']),
                               (rgb_color_data['bit_depth'] // 8)), dtype=np.uint8)
-
-    i = 0
-    for val in range(rgb_color_data['width'] * rgb_color_data['height']):
-        rgb = []
-        for channel in range(3):
-            rgb.append(ord(in_file.read(1)))
-        rgb_color_arr[i] = rgb
-        i = i + 1
+    read_into_array(in_file, rgb_color_arr)
 
     rgb_color_data['data'] = rgb_color_arr
 
@@ -228,19 +286,19 @@ def extract_img_data(offset_dict, d_type, in_file):
 
     Extracts image data, either height or light intensity, from the vk4 file.
     All metadata and raw image data pertaining to the particular aforementioned
-    type is extracted and returned as a dictionary.
+    type is extracted and returned as a vk4layer.ScalarLayer, which supports
+    dictionary access.
 
     :param offset_dict: dictionary - offset values in vk4
     :param d_type: string - type of data, must be 'height' or 'light'
     :param in_file: open file obj, must be vk4 file
     """
     log.debug("Entering extract_img_data()")
+    import numpy as np
 
-    data_types = {'height': ('height', np.uint32, '<I', 4),
-                  'light': ('light', np.uint16, '<H', 2)}
-    data = dict()
+    data = vk4layer.ScalarLayer()
     data['name'] = d_type.capitalize()
-    in_file.seek(offset_dict[data_types[d_type][0]])
+    in_file.seek(offset_dict[d_type])
     data['width'] = struct.unpack('<I', in_file.read(4))[0]
     data['height'] = struct.unpack('<I', in_file.read(4))[0]
     data['bit_depth'] = struct.unpack('<I', in_file.read(4))[0]
@@ -250,28 +308,98 @@ def extract_img_data(offset_dict, d_type, in_file):
     data['palette_range_max'] = struct.unpack('<I', in_file.read(4))[0]
     # The palette section of the hexdump is 768 bytes long has 256 3-byte
     # repeats, for now I will store them as a 1d array of uint8 values
-    palette = np.zeros(768, dtype=np.uint8)
-
-    i = 0
-    for val in range(768):
-        palette[i] = ord(in_file.read(1))
-        i = i+1
+    palette = np.empty(768, dtype=np.uint8)
+    read_into_array(in_file, palette)
     data['palette'] = palette
 
-    array = np.zeros((data['width']*data['height']), dtype=data_types[d_type][1])
-    int_type = data_types[d_type][2]
-    bytesize = data_types[d_type][3]
-    i = 0
-    for val in range(data['width']*data['height']):
-        # array[i] = data_types[d_type][2](in_file)
-        array[i] = struct.unpack(int_type, in_file.read(bytesize))[0]
-        i = i + 1
+    array = np.empty((data['width']*data['height']), dtype=img_data_types[d_type])
+    read_into_array(in_file, array)
     data['data'] = array
 
     log.debug("Exiting extract_img_data()")
     return data
 
 
+# light and height data memory mapped with map_img_data
+def map_img_data(offset_dict, d_type, file_name):
+    """map_img_data
+
+    Extracts the metadata and palette of the height or light intensity data
+    like extract_img_data, but memory maps the image data read only instead
+    of reading it, so that only the parts of it accessed are read from
+    disk. Returns a vk4layer.ScalarLayer whose 'data' is a numpy.memmap.
+
+    :param offset_dict: dictionary - offset values in vk4
+    :param d_type: string - type of data, must be 'height' or 'light'
+    :param file_name: path to the vk4 file
+    """
+    log.debug("Entering map_img_data()")
+    import numpy as np
+
+    with open(file_name, 'rb') as in_file:
+        in_file.seek(offset_dict[d_type])
+        fields = struct.unpack('<7I', in_file.read(28))
+        palette = np.frombuffer(in_file.read(768), dtype=np.uint8).copy()
+    data = vk4layer.ScalarLayer(name=d_type.capitalize(), palette=palette,
+                                **dict(zip(img_header_fields, fields)))
+    data['data'] = np.memmap(file_name, dtype=img_data_types[d_type], mode='r',
+                             offset=offset_dict[d_type] + IMG_HEADER_BYTES,
+                             shape=(data['width'] * data['height'],))
+
+    log.debug("Exiting map_img_data()")
+    return data
+
+
+# extract the headers of the image layers without their data
+def extract_layer_headers(offset_dict, in_file):
+    """extract_layer_headers
+
+    Extracts the width, height, bit depth, compression and data byte size of
+    each image layer present in a vk4 file without reading the image data.
+    Returns a dictionary of dictionaries keyed by the layer's offset key.
+
+    :param offset_dict: dictionary - offset values in vk4
+    :param in_file: open file obj, must be vk4 file
+    """
+    log.debug("Entering extract_layer_headers()")
+
+    layer_headers = dict()
+    for key in ('color_peak', 'color_light', 'light', 'height'):
+        if offset_dict[key] == 0:
+            continue
+        in_file.seek(offset_dict[key])
+        values = struct.unpack('<5I', in_file.read(20))
+        layer_headers[key] = dict(zip(('width', 'height', 'bit_depth', 'compression',
+                                       'data_byte_size'), values))
+
+    log.debug("Exiting extract_layer_headers()")
+    return layer_headers
+
+
+# extract all metadata without any image data
+def extract_metadata(in_file):
+    """extract_metadata
+
+    Extracts the header, offsets, measurement conditions, string data and
+    image layer headers of a vk4 file, i.e. everything but the image data,
+    reading only a few kilobytes. Returns values in dictionary
+
+    :param in_file: open file obj, must be vk4 file
+    """
+    log.debug("Entering extract_metadata()")
+
+    metadata = extract_header(in_file)
+    metadata['extension'] = metadata['extension'].decode('ascii', 'replace')
+    offsets = extract_offsets(in_file)
+    metadata['offsets'] = offsets
+    metadata['measurement_conditions'] = extract_measurement_conditions(offsets, in_file)
+    metadata['string_data'] = extract_string_data(offsets, in_file)
+    metadata['layers'] = extract_layer_headers(offsets, in_file)
+
+    log.debug("Exiting extract_metadata()")
+    return metadata
+
+
 # extract string meta data
 def extract_string_data(offset_dict, in_file):
     """extract_string_data
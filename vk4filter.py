@@ -0,0 +1,185 @@
+"""vk4filter
+
+This module separates the height data of VkContainer objects into waviness
+and roughness surfaces with the areal Gaussian filter of ISO 16610-61. The
+waviness is the height data convolved with the Gaussian weighting function
+
+    s(x) = 1 / (alpha * cutoff) * exp(-pi * (x / (alpha * cutoff)) ** 2)
+
+    alpha = sqrt(ln(2) / pi)
+
+applied along each axis in turn, and the roughness is the height minus the
+waviness. The cutoff wavelength is given in micrometers and converted to
+pixels separately for the x and y axes.
+
+Each 1D pass is computed with FFTs and the image is processed in blocks of
+rows with a halo of kernel rows above and below each block (overlap-save),
+so only a bounded number of rows is held in memory at any time apart from
+the output. The filter is normalized by the filtered pixel weights, which
+corrects the end effects at the edges of the image and lets invalid pixels
+be excluded from the filter.
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+
+log = logging.getLogger('vk4_driver.vk4filter')
+
+# ISO 16610-61 Gaussian weighting function constant
+ALPHA = np.sqrt(np.log(2.0) / np.pi)
+
+# number of pixels filtered per block of rows
+FILTER_BLOCK_CELLS = 2 ** 21
+
+
+def gaussian_kernel(cutoff, max_half_width):
+    """gaussian_kernel
+
+    Returns the sampled ISO 16610-61 Gaussian weighting function for a cutoff
+    wavelength given in pixels, truncated at +/- one cutoff (or at
+    max_half_width pixels if that is smaller) and normalized to a sum of 1.
+
+    :param cutoff: cutoff wavelength in pixels
+    :param max_half_width: largest number of pixels on each side of the centre
+    """
+    half_width = max(min(int(np.ceil(cutoff)), max_half_width), 0)
+    x = np.arange(-half_width, half_width + 1, dtype=np.float64)
+    kernel = np.exp(-np.pi * (x / (ALPHA * cutoff)) ** 2)
+    return kernel / kernel.sum()
+
+
+def fast_length(n):
+    """fast_length
+
+    Returns the smallest integer >= n whose only prime factors are 2, 3 and
+    5, for which FFTs are fast.
+
+    :param n: minimum length
+    """
+    length = max(n, 1)
+    while True:
+        remainder = length
+        for factor in (2, 3, 5):
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return length
+        length += 1
+
+
+def convolve_axis(data, kernel, axis):
+    """convolve_axis
+
+    Convolves every line of a 2d array along the given axis with a centred,
+    odd length kernel, treating values beyond the array as zero. The 'same'
+    sized result is computed with real FFTs of all lines at once.
+
+    :param data: 2d numpy array
+    :param kernel: 1d numpy array of odd length
+    :param axis: axis to convolve along
+    """
+    size = data.shape[axis]
+    half_width = kernel.size // 2
+    n_fft = fast_length(size + kernel.size - 1)
+
+    kernel_fft = np.fft.rfft(kernel, n_fft)
+    if axis == 0:
+        kernel_fft = kernel_fft[:, np.newaxis]
+    spectrum = np.fft.rfft(data, n_fft, axis=axis)
+    spectrum *= kernel_fft
+    full = np.fft.irfft(spectrum, n_fft, axis=axis)
+
+    if axis == 0:
+        return full[half_width:half_width + size]
+    return full[:, half_width:half_width + size]
+
+
+def gaussian_filter(height_matrix, x_cutoff, y_cutoff, valid=None):
+    """gaussian_filter
+
+    Returns the waviness of a height matrix, i.e. the matrix filtered with
+    the separable ISO 16610-61 Gaussian filter, as a float64 array. Rows are
+    processed in blocks of about FILTER_BLOCK_CELLS pixels, each block being
+    extended by the kernel half width in rows above and below.
+
+    :param height_matrix: 2d numpy array of height values
+    :param x_cutoff: cutoff wavelength along x (columns) in pixels
+    :param y_cutoff: cutoff wavelength along y (rows) in pixels
+    :param valid: optional 2d boolean array, False for pixels to exclude
+    """
+    log.debug("Entering gaussian_filter()\n\tCutoff (x, y) in pixels: ({}, {})"
+              .format(x_cutoff, y_cutoff))
+    n_rows, n_cols = height_matrix.shape
+    # weights beyond the image are zero, so a kernel wider than the image
+    # can be cut down to the image size without changing the result
+    x_kernel = gaussian_kernel(x_cutoff, n_cols - 1)
+    y_kernel = gaussian_kernel(y_cutoff, n_rows - 1)
+    halo = y_kernel.size // 2
+
+    waviness = np.empty((n_rows, n_cols), dtype=np.float64)
+    rows_per_block = max(1, FILTER_BLOCK_CELLS // n_cols)
+    for start in range(0, n_rows, rows_per_block):
+        stop = min(start + rows_per_block, n_rows)
+        # the halo rows make the column pass exact for the block's rows
+        halo_start, halo_stop = max(start - halo, 0), min(stop + halo, n_rows)
+        block = np.asarray(height_matrix[halo_start:halo_stop], dtype=np.float64)
+        if valid is None:
+            weights = np.ones(block.shape)
+        else:
+            weights = valid[halo_start:halo_stop].astype(np.float64)
+            block = np.where(weights > 0, block, 0.0)
+
+        block_rows = slice(start - halo_start, stop - halo_start)
+        numerator = convolve_axis(block * weights, y_kernel, 0)[block_rows]
+        denominator = convolve_axis(weights, y_kernel, 0)[block_rows]
+        numerator = convolve_axis(numerator, x_kernel, 1)
+        denominator = convolve_axis(denominator, x_kernel, 1)
+
+        # pixels with no valid neighbours within the kernel have no waviness
+        out = waviness[start:stop]
+        out[...] = np.nan
+        np.divide(numerator, denominator, out=out, where=denominator > 1.0e-12)
+
+    log.debug("Exiting gaussian_filter()")
+    return waviness
+
+
+def filter_container(vk4_container, cutoff):
+    """filter_container
+
+    Separates the height data of a VkContainer into waviness and roughness
+    surfaces in micrometers with the ISO 16610-61 Gaussian filter and stores
+    them in the container as the derived layers 'waviness' and 'roughness'.
+    Pixels marked invalid in the container's height mask are excluded from
+    the filter and are NaN in the roughness. Returns the waviness and
+    roughness as (height, width) float64 arrays.
+
+    :param vk4_container: VkContainer object with height data
+    :param cutoff: cutoff wavelength in micrometers
+    """
+    log.debug("Entering filter_container()\n\tCutoff: {} um".format(cutoff))
+    x_size, y_size = vk4_container.get_pixel_size()
+    height_matrix = vk4_container.get_calibrated_height()
+
+    waviness = gaussian_filter(height_matrix, cutoff / x_size, cutoff / y_size,
+                               vk4_container.valid_masks.get('height'))
+    roughness = height_matrix - waviness
+    vk4_container.add_derived_layer('waviness', waviness, 'um')
+    vk4_container.add_derived_layer('roughness', roughness, 'um')
+
+    log.debug("Exiting filter_container()")
+    return waviness, roughness
@@ -0,0 +1,167 @@
+"""vk4layer
+
+This module holds the classes storing the image layers of VkContainer
+objects. ScalarLayer stores height, light intensity and derived layers and
+ColorLayer the RGB peak and RGB + light layers. Both keep the layer's values
+as the flat 'data' array read from the vk4 file and expose them as a zero
+copy (height, width) or (height, width, 3) view through the matrix
+attribute, so consumers no longer reshape the data themselves using the
+container's image size.
+
+The classes use __slots__, which keeps thousands of layers in memory
+without a dictionary per layer, and support the dictionary style access the
+layers had when they were plain dicts (layer['data'], layer['width'],
+'palette' in layer, dict(layer), ...). numpy.asarray(layer) returns the
+matrix view.
+
+Example
+-------
+    heights = vk4_container.height_data.matrix * vk4_container.height_data.scale
+    rgb = np.asarray(vk4_container.rgb_peak_data)   # (height, width, 3) uint8
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+
+class Layer(object):
+    """Layer
+
+    Base class of the image layers. Fields which were never set are missing
+    from the dictionary style interface, as they would be from a dict.
+
+    :param fields: initial values of the layer's fields
+    """
+    __slots__ = ('name', 'width', 'height', 'data')
+    field_names = __slots__
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    @property
+    def matrix(self):
+        return self.data.reshape(self.height, self.width)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __array__(self, dtype=None, copy=None):
+        # NumPy 2 passes copy=False when a copy must not be made
+        matrix = self.matrix
+        if dtype is not None and matrix.dtype != dtype:
+            if copy is False:
+                raise ValueError("converting {} layer data to {} requires a copy"
+                                 .format(matrix.dtype, dtype))
+            return matrix.astype(dtype)
+        return matrix.copy() if copy else matrix
+
+    def __buffer__(self, flags):
+        # buffer protocol of Python 3.12 and later
+        return memoryview(self.matrix)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.field_names:
+            raise KeyError("{} has no field {}".format(type(self).__name__, key))
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.field_names and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return [key for key in self.field_names if hasattr(self, key)]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.field_names else default
+
+    def copy(self):
+        """copy
+
+        Returns a shallow copy of the layer, sharing its data array
+        """
+        return type(self)(**dict(self.items()))
+
+    def __repr__(self):
+        return '{}({!r}, {}x{})'.format(type(self).__name__, self.get('name'),
+                                        self.get('width'), self.get('height'))
+
+
+class ScalarLayer(Layer):
+    """ScalarLayer
+
+    Height, light intensity or derived layer of one value per pixel. scale
+    is the factor converting the values to unit, e.g. the z length per digit
+    in micrometers for height data.
+    """
+    __slots__ = ('bit_depth', 'compression', 'data_byte_size', 'palette_range_min',
+                 'palette_range_max', 'palette', 'scale', 'unit')
+    field_names = Layer.field_names + __slots__
+
+    @property
+    def palette_colors(self):
+        # the palette is stored as 256 RGB triplets
+        return self.palette.reshape(-1, 3)
+
+
+class ColorLayer(Layer):
+    """ColorLayer
+
+    RGB peak or RGB + light layer, 'data' holding one row of color bytes
+    per pixel
+    """
+    __slots__ = ('bit_depth', 'compression', 'data_byte_size')
+    field_names = Layer.field_names + __slots__
+
+    @property
+    def matrix(self):
+        return self.data.reshape(self.height, self.width, -1)
+
+
+def layer_matrix(layer):
+    """layer_matrix
+
+    Returns the (height, width) or, for color data, (height, width, 3) view
+    of a layer's data, for layer objects as well as plain dicts
+
+    :param layer: Layer object or dict with 'data', 'width' and 'height'
+    """
+    if isinstance(layer, Layer):
+        return layer.matrix
+    shape = (layer['height'], layer['width'])
+    if layer['data'].ndim > 1:
+        shape += (-1,)
+    return layer['data'].reshape(shape)
@@ -0,0 +1,238 @@
+"""vk4mask
+
+This module detects invalid pixels in the height and light intensity data of
+VkContainer objects and optionally fills them in. Pixels are invalid if they
+hold 0 (no signal, a dropout) or the largest value allowed by the layer's
+effective bit depth from the measurement conditions (saturation).
+
+Masks are stored in the container's valid_masks dict as (height, width)
+boolean arrays, True for valid pixels, keyed by 'height' or 'light'. The
+calibrated height, the filtering and comparison statistics and the vk4out
+writers all exclude the masked pixels, writing them as NaN where the output
+holds floating point values.
+
+Alternatively, invalid pixels can be filled in place, either with the mean of
+their nearest valid pixels or by Laplacian inpainting, which solves for the
+smoothest surface matching the surrounding valid pixels. The fill only works
+on the invalid pixels and their neighbours, held as flat index arrays, so
+its cost scales with the number of invalid pixels and not the image size.
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+import vk4layer
+
+log = logging.getLogger('vk4_driver.vk4mask')
+
+# layer dict attribute and effective bit depth key for each data type
+mask_layers = {'height': ('height_data', 'height_effective_bit_depth'),
+               'light': ('light_intensity_data', 'light_effective_bit_depth')}
+
+
+def get_layer_matrix(vk4_container, d_type):
+    """get_layer_matrix
+
+    Returns a (height, width) view of the raw height or light data
+
+    :param vk4_container: VkContainer object
+    :param d_type: string - type of data, must be 'height' or 'light'
+    """
+    layer = getattr(vk4_container, mask_layers[d_type][0])
+    return vk4layer.layer_matrix(layer)
+
+
+def saturation_value(bit_depth, effective_bit_depth):
+    """saturation_value
+
+    Returns the value of saturated pixels of a layer, the largest value of
+    its effective bit depth, or of its storage bit depth if the effective
+    bit depth is not recorded
+
+    :param bit_depth: storage bit depth of the layer
+    :param effective_bit_depth: effective bit depth from the measurement
+        conditions
+    """
+    if effective_bit_depth <= 0 or effective_bit_depth > bit_depth:
+        effective_bit_depth = bit_depth
+    return 2 ** effective_bit_depth - 1
+
+
+def find_valid_pixels(vk4_container, d_type):
+    """find_valid_pixels
+
+    Returns a (height, width) boolean array which is False for pixels of the
+    height or light data that are 0 or saturated, i.e. equal to the largest
+    value of the layer's effective bit depth (or of its storage bit depth
+    if the effective bit depth is not recorded).
+
+    :param vk4_container: VkContainer object
+    :param d_type: string - type of data, must be 'height' or 'light'
+    """
+    log.debug("Entering find_valid_pixels()\n\tData type: {}".format(d_type))
+    layer = getattr(vk4_container, mask_layers[d_type][0])
+    saturated = saturation_value(layer['bit_depth'],
+                                 vk4_container.measurement_conditions[mask_layers[d_type][1]])
+
+    matrix = get_layer_matrix(vk4_container, d_type)
+    valid = matrix != 0
+    valid &= matrix < saturated
+
+    log.debug("Exiting find_valid_pixels() with {} invalid pixels"
+              .format(valid.size - np.count_nonzero(valid)))
+    return valid
+
+
+def mask_container(vk4_container):
+    """mask_container
+
+    Finds the invalid pixels of each height and light layer held by the
+    VkContainer and stores the masks in its valid_masks dict, so that
+    statistics and output exclude those pixels. Returns the valid_masks dict.
+
+    :param vk4_container: VkContainer object
+    """
+    log.debug("Entering mask_container()")
+    for d_type, (attribute, _) in mask_layers.items():
+        if getattr(vk4_container, attribute) is not None:
+            vk4_container.valid_masks[d_type] = find_valid_pixels(vk4_container, d_type)
+
+    log.debug("Exiting mask_container()")
+    return vk4_container.valid_masks
+
+
+def masked_view(vk4_container, d_type):
+    """masked_view
+
+    Returns the raw height or light data as a (height, width) numpy masked
+    array sharing the layer's data, masking the pixels marked invalid in the
+    container's valid_masks (none if the layer has no mask).
+
+    :param vk4_container: VkContainer object
+    :param d_type: string - type of data, must be 'height' or 'light'
+    """
+    matrix = get_layer_matrix(vk4_container, d_type)
+    valid = vk4_container.valid_masks.get(d_type)
+    if valid is None:
+        return np.ma.masked_array(matrix, copy=False)
+    return np.ma.masked_array(matrix, mask=~valid, copy=False)
+
+
+def hole_neighbours(valid):
+    """hole_neighbours
+
+    Returns the flat indices of the invalid pixels of a mask and an (n, 4)
+    array of the flat indices of their up, down, left and right neighbours,
+    with neighbours beyond the image edge replaced by the pixel itself.
+
+    :param valid: 2d boolean array, False for invalid pixels
+    """
+    n_rows, n_cols = valid.shape
+    holes = np.flatnonzero(~valid)
+    rows, cols = np.divmod(holes, n_cols)
+    neighbours = np.stack((np.maximum(rows - 1, 0) * n_cols + cols,
+                           np.minimum(rows + 1, n_rows - 1) * n_cols + cols,
+                           rows * n_cols + np.maximum(cols - 1, 0),
+                           rows * n_cols + np.minimum(cols + 1, n_cols - 1)), axis=1)
+    return holes, neighbours
+
+
+def fill_holes(matrix, valid, method='laplacian', iterations=500, tolerance=1.0e-2):
+    """fill_holes
+
+    Computes values for the invalid pixels of a matrix and returns them,
+    together with their flat indices, without modifying the matrix.
+
+    With the 'nearest' method holes are filled from their edges inwards, each
+    pixel taking the mean of its already known 4-neighbours. The 'laplacian'
+    method starts from the nearest fill and then repeatedly replaces each
+    hole pixel by the mean of its neighbours (Jacobi iteration of Laplace's
+    equation) until the largest change is below tolerance.
+
+    :param matrix: 2d numpy array of values
+    :param valid: 2d boolean array, False for invalid pixels
+    :param method: string - 'nearest' or 'laplacian'
+    :param iterations: maximum number of Laplacian iterations
+    :param tolerance: largest change, in the units of matrix, at which the
+        Laplacian iteration stops
+    """
+    log.debug("Entering fill_holes()\n\tMethod: {}".format(method))
+    holes, neighbours = hole_neighbours(valid)
+    flat_matrix = np.ravel(matrix)
+    flat_valid = np.ravel(valid)
+
+    # neighbours which are holes themselves read from the hole values
+    neighbour_is_hole = ~flat_valid[neighbours]
+    neighbour_position = np.searchsorted(holes, neighbours)
+    np.minimum(neighbour_position, max(holes.size - 1, 0), out=neighbour_position)
+    neighbour_values = flat_matrix[neighbours].astype(np.float64)
+    hole_values = np.zeros(holes.size)
+
+    known = np.zeros(holes.size, dtype=bool)
+    while not known.all():
+        neighbour_known = ~neighbour_is_hole | known[neighbour_position]
+        values = np.where(neighbour_is_hole, hole_values[neighbour_position], neighbour_values)
+        counts = neighbour_known.sum(axis=1)
+        reached = ~known & (counts > 0)
+        if not reached.any():
+            log.error("In fill_holes()\n\t{} pixels have no valid pixel to fill "
+                      "from".format(holes.size - np.count_nonzero(known)))
+            break
+        sums = np.where(neighbour_known, values, 0.0).sum(axis=1)
+        hole_values[reached] = sums[reached] / counts[reached]
+        known |= reached
+
+    if method == 'laplacian':
+        for iteration in range(iterations):
+            values = np.where(neighbour_is_hole, hole_values[neighbour_position], neighbour_values)
+            new_values = values.mean(axis=1)
+            change = np.abs(new_values - hole_values).max() if holes.size else 0.0
+            hole_values = new_values
+            if change < tolerance:
+                break
+        log.debug("In fill_holes()\n\tLaplacian fill stopped after {} iterations"
+                  .format(iteration + 1 if holes.size else 0))
+
+    log.debug("Exiting fill_holes()")
+    return holes, hole_values
+
+
+def fill_container(vk4_container, method='laplacian'):
+    """fill_container
+
+    Fills the invalid pixels of each height and light layer held by the
+    VkContainer in place, rounding the filled values to the layer's integer
+    type, and removes the layers from the container's valid_masks dict since
+    all of their pixels are then valid.
+
+    :param vk4_container: VkContainer object
+    :param method: string - 'nearest' or 'laplacian'
+    """
+    log.debug("Entering fill_container()\n\tMethod: {}".format(method))
+    for d_type, (attribute, _) in mask_layers.items():
+        layer = getattr(vk4_container, attribute)
+        if layer is None:
+            continue
+        valid = vk4_container.valid_masks.get(d_type)
+        if valid is None:
+            valid = find_valid_pixels(vk4_container, d_type)
+        matrix = get_layer_matrix(vk4_container, d_type)
+        holes, values = fill_holes(matrix, valid, method)
+        info = np.iinfo(layer['data'].dtype)
+        layer['data'][holes] = np.clip(np.rint(values), info.min, info.max)
+        vk4_container.valid_masks.pop(d_type, None)
+
+    log.debug("Exiting fill_container()")
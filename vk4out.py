@@ -2,7 +2,9 @@
 
 This module handles the output of data extracted from Keyence Profilometry
 vk4 data files and contained in VK4container objects. The data can be output in
-a text comma separated values format, or in jpeg, png, and tiff image formats.
+a text comma separated values format, in jpeg, png, and tiff image formats,
+as binary ply and stl meshes of the height data, or as calibrated Gwyddion
+(gsf) and BCR/ISO 25178-71 (sdf) surface fields.
 The data that can be output includes, height, light, RGB, and RGB + light
 (RGB + laser) data.
 
@@ -21,14 +23,20 @@ Created
 
 Last Modified
 -------------
-19 July 2018
+18 October 2026
 
 """
 
+import contextlib
+import io
 import logging
 import numpy as np
-from PIL import Image
 import os
+import struct
+import sys
+import threading
+import vk4layer
+import vk4progress
 
 log = logging.getLogger('vk4_driver.vk4out')
 
@@ -36,6 +44,9 @@ log = logging.getLogger('vk4_driver.vk4out')
 layer_dict = {'R': ['red', 'peak'], 'G': ['green', 'peak'], 'B': ['blue', 'peak'],
               'RL': ['red', 'light'], 'GL': ['green', 'light'], 'BL': ['blue', 'light']}
 
+# number of grid cells converted per block when streaming mesh and field output
+BLOCK_CELLS = 2 ** 18
+
 
 def output_file_name_maker(args):
     """output_file_name_maker
@@ -49,17 +60,84 @@ def output_file_name_maker(args):
     """
     log.debug("Entering output_file_name_maker()")
     path = os.getcwd() + '/out_files/'
-    if not os.path.isdir(path):
-        os.mkdir(path)
+    # several threads (see vk4server and vk4watch) may get here at once
+    os.makedirs(path, exist_ok=True)
 
     if args.output is None:
-        out_file_name = path + args.input[:-4] + '_' + args.type + '_' + args.layer
+        # input files in other directories still write to out_files
+        out_file_name = path + os.path.basename(args.input)[:-4] + '_' + args.type + \
+            '_' + args.layer
     else:
         out_file_name = path + args.output
 
     log.debug("Exiting output_file_name_maker()")
     return out_file_name
 
+
+def output_target(args, extension, out_stream=None):
+    """output_target
+
+    Returns '-' if output goes to a stream, otherwise the output filename
+    made by output_file_name_maker with the extension appended
+
+    :param args: list of argparse arguments
+    :param extension: string - file extension including the dot
+    :param out_stream: writable binary stream or None
+    """
+    if out_stream is not None:
+        return '-'
+    return output_file_name_maker(args) + extension
+
+
+@contextlib.contextmanager
+def open_output(out_file_name, out_stream=None):
+    """open_output
+
+    Context manager yielding out_stream if one is given, which is flushed
+    but left open afterwards, otherwise a temporary file next to
+    out_file_name opened for binary writing. The temporary file is renamed
+    to out_file_name once the output is complete and removed if writing
+    fails or is cancelled, so out_file_name never holds a partial output.
+
+    :param out_file_name: path to the output file, used without a stream
+    :param out_stream: writable binary stream or None
+    """
+    if out_stream is None:
+        # unique per thread, as several may write the same output at once
+        temp_name = '{}.{}-{}.part'.format(out_file_name, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_name, 'wb') as out_file:
+                yield out_file
+            os.replace(temp_name, out_file_name)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_name)
+            raise
+    else:
+        yield out_stream
+        out_stream.flush()
+
+
+@contextlib.contextmanager
+def open_text_output(out_file_name, out_stream=None, newline=None):
+    """open_text_output
+
+    Context manager like open_output, yielding a UTF-8 text stream over the
+    temporary file or out_stream, e.g. for csv and json writers
+
+    :param out_file_name: path to the output file, used without a stream
+    :param out_stream: writable binary stream or None
+    :param newline: newline argument of io.TextIOWrapper, '' for csv
+    """
+    with open_output(out_file_name, out_stream) as out_file:
+        text_file = io.TextIOWrapper(out_file, encoding='utf-8', newline=newline)
+        try:
+            yield text_file
+            text_file.flush()
+        finally:
+            # leaves the binary file to open_output to close or rename
+            text_file.detach()
+
 """
 def list_of_tuples(arr):
     """"""list_of_tuples
@@ -165,76 +243,136 @@ def get_data_from_layers(vk4_container, layers, step, is_image=False):
         # return create_separate_rgb_values(vk4_container, holder)
 
 
-def output_data(vk4_container, args):
+def get_layer_mask(vk4_container, layer):
+    """get_layer_mask
+
+    Returns the (height, width) boolean mask of valid pixels stored in the
+    VK4container for the height ('H') or light ('L') layer, or None if the
+    layer is not masked. Derived layers mark invalid pixels with NaN instead.
+
+    :param vk4_container: VK4container object
+    :param layer: string defining the layer
+    """
+    mask_types = {'H': 'height', 'L': 'light'}
+    if layer not in mask_types:
+        return None
+    return vk4_container.valid_masks.get(mask_types[layer])
+
+
+def output_data(vk4_container, args, out_stream=None):
     """output_data
 
     Determines what data to retrieve from VK4container object and outputs that
-    data as defined by the arguments provided with args
+    data as defined by the arguments provided with args. Output is written to
+    out_stream if given, to standard output if the output argument is '-',
+    and otherwise to a file in out_files. Returns the name of the file
+    written, or '-' for a stream.
 
     :param vk4_container: VK4container
     :param args: list of argparse arguments
+    :param out_stream: optional writable binary stream, e.g. a socket file or
+        io.BytesIO, which is not closed
     """
     log.info("Entering vk4out.py via output_data()")
     log.debug("Entering output_data()\n\tOutput type: {}\n\tData Layers: {}"
               .format(args.type, args.layer))
 
     layer = args.layer
-    is_image_dict = {'csv': False, 'hcsv': False, 'jpeg': True, 'png': True, 'tiff': True}
+    if out_stream is None and args.output == '-':
+        out_stream = sys.stdout.buffer
+    # the mesh writers begin with the rows of their (decimated) grid
+    vk4progress.begin('write', vk4_container.image_height, 'rows')
+
+    # Mesh and surface field output need calibrated height (or light) data
+    # rather than raw values, so those writers retrieve the data themselves.
+    calibrated_output_dict = {'ply': output_ply, 'stl': output_stl,
+                              'gsf': output_gsf, 'sdf': output_sdf}
+    if args.type in calibrated_output_dict:
+        log.debug("Exiting output_data() where output type is {}".format(args.type))
+        out_file_name = calibrated_output_dict[args.type](vk4_container, args, out_stream)
+        log.info("Exiting vk4out.py from output_data()")
+        return out_file_name
+
+    is_image_dict = {'csv': False, 'hcsv': False, 'npy': False, 'raw': False,
+                     'jpeg': True, 'png': True, 'tiff': True}
     single_noncomposite_layer_options = {'H': vk4_container.height_data,
                                          'L': vk4_container.light_intensity_data}
+    single_noncomposite_layer_options.update(vk4_container.derived_data)
 
     log.debug("Output type: %s" % args.type)
     is_image = is_image_dict[args.type]
 
-    # If the data of interest is height or light intensity values, we can
-    # retrieve those directly from the VK4container's height_data and
-    # light_intensity_data dicts. Otherwise call get_data_from_layers()
-    # to retrieve the RGB layers of interest.
-    if len(layer) == 1 and layer in single_noncomposite_layer_options:
-        data = single_noncomposite_layer_options[layer]['data']
-    elif layer[0] == 'L' or (len(layer) > 1 and layer[1] == 'L'):
-        lay = 'L'.join(layer[1:]) + 'L'
-        data = get_data_from_layers(vk4_container, lay, 2, is_image)
+    # If the data of interest is height or light intensity values, or a
+    # derived layer, we can retrieve those directly from the VK4container's
+    # height_data, light_intensity_data and derived_data dicts. Otherwise
+    # call get_data_from_layers() to retrieve the RGB layers of interest.
+    # The writers get (height, width) data, or (height, width, 3) for RGB
+    # images, shaped by the layer itself rather than the container's size.
+    if layer in single_noncomposite_layer_options:
+        data = vk4layer.layer_matrix(single_noncomposite_layer_options[layer])
     else:
-        data = get_data_from_layers(vk4_container, layer, 1, is_image)
+        if layer[0] == 'L' or (len(layer) > 1 and layer[1] == 'L'):
+            lay = 'L'.join(layer[1:]) + 'L'
+            data = get_data_from_layers(vk4_container, lay, 2, is_image)
+            color_layer = vk4_container.rgb_light_data
+        else:
+            data = get_data_from_layers(vk4_container, layer, 1, is_image)
+            color_layer = vk4_container.rgb_peak_data
+        data = data.reshape(vk4layer.layer_matrix(color_layer).shape[:2] + data.shape[1:])
 
     if is_image:
         log.debug("Exiting output_data() where is_image is {}".format(is_image))
-        output_image(vk4_container, args, data)
+        out_file_name = output_image(vk4_container, args, data, out_stream)
+    elif args.type in ('npy', 'raw'):
+        log.debug("Exiting output_data() where output type is {}".format(args.type))
+        out_file_name = output_binary(vk4_container, args, data, out_stream)
     else:
         log.debug("Exiting output_data() where is_image is {}".format(is_image))
-        output_csv(vk4_container, args, data)
+        out_file_name = output_csv(vk4_container, args, data, out_stream)
 
     log.info("Exiting vk4out.py from output_data()")
+    return out_file_name
 
 
-def output_csv(vk4_container, args, data):
+def output_csv(vk4_container, args, data, out_stream=None):
     """output_csv
 
-    Outputs data to file in comma separated values format
+    Outputs data to file, or out_stream, in comma separated values format
 
     :param vk4_container: VK4container object
     :param args: list of argparse arguments
-    :param data: numpy array of values
+    :param data: (height, width) numpy array of values
+    :param out_stream: optional writable binary stream
     """
     log.debug("Entering output_csv()\n\tData Layer: {}".format(args.layer))
 
-    out_file_name = output_file_name_maker(args) + '.csv'
-
-    width = vk4_container.image_width
-    height = vk4_container.image_height
-
-    data = np.reshape(data, (height, width))
+    out_file_name = output_target(args, '.csv', out_stream)
+    height, width = data.shape[:2]
     log.debug("\n\tData:\n\t%r".format(data))
+    valid = get_layer_mask(vk4_container, args.layer)
+
+    # derived layers hold calibrated float values rather than raw counts,
+    # and masked raw counts are written as floats so invalid pixels are nan
+    if data.dtype.kind == 'f':
+        fmt = '%.6g'
+    elif valid is not None:
+        fmt = '%.10g'
+    else:
+        fmt = '%d'
 
-    with open(out_file_name, 'w') as out_file:
+    with open_output(out_file_name, out_stream) as out_file:
         if args.type == 'hcsv':
             header = create_file_meta_data(vk4_container, args)
             np.savetxt(out_file, header, delimiter=',', fmt='%s')
-            out_file.write('\n')
-        np.savetxt(out_file, data, delimiter=',', fmt='%d')
+            out_file.write(b'\n')
+        for start, stop in row_blocks(height, width):
+            block = data[start:stop]
+            if valid is not None:
+                block = np.where(valid[start:stop], block, np.nan)
+            np.savetxt(out_file, block, delimiter=',', fmt=fmt)
 
     log.debug("Exiting output_csv()")
+    return out_file_name
 
 
 def scale_data(vk4_container, args, data):
@@ -273,37 +411,473 @@ def scale_data(vk4_container, args, data):
     return new_array
 
 
-def output_image(vk4_container, args, data):
+def output_image(vk4_container, args, data, out_stream=None):
     """output_image
 
-    Outputs data to file in jpeg, png, or tiff format
+    Outputs data to file, or out_stream, in jpeg, png, or tiff format
 
     :param vk4_container: VK4container object
     :param args: list of argparse arguments
-    :param data: list of tuples for jpeg and png images
+    :param data: (height, width) numpy array of values, or (height, width, 3)
+        of RGB values
+    :param out_stream: optional writable binary stream
     """
     log.debug("Entering output_image()\n\t Data Layer: {}".format(args.layer))
+    # PIL is only needed for image output
+    from PIL import Image
 
     not_rgb_list = ['L', 'H']
     out_type = args.type
     layer = args.layer
 
-    out_file_name = output_file_name_maker(args) + '.' + out_type
+    out_file_name = output_target(args, '.' + out_type, out_stream)
 
-    width = vk4_container.image_width
-    height = vk4_container.image_height
-    if layer in not_rgb_list:
+    height = data.shape[0]
+    if layer in not_rgb_list or layer in vk4_container.derived_data:
         # data = scale_data(vk4_container, args, data)
         log.debug("In output_image()\n\tData:\n{}".format(data))
-        image = Image.fromarray(np.reshape(data, (height, width)), 'F')
+        valid = get_layer_mask(vk4_container, layer)
+        if valid is not None:
+            data = np.where(valid, data, np.nan).astype(np.float32)
+        if out_type != 'tiff':
+            log.error("In output_image()\n\tLayer {} can only be output as a tiff "
+                      "image".format(layer))
+            return None
+        image = Image.fromarray(data, 'F')
     else:
         log.debug("In output_image()\n\tData:\n{}".format(data))
-        image = Image.fromarray(np.reshape(data, (height, width, 3)), 'RGB')
+        image = Image.fromarray(data, 'RGB')
 
     image.info = create_file_meta_data(vk4_container, args)
-    image.save(out_file_name, args.type.upper())
+    with open_output(out_file_name, out_stream) as out_file:
+        if out_file.seekable():
+            image.save(out_file, args.type.upper())
+        else:
+            # the tiff writer seeks back to fill in offsets, so images for
+            # pipes are encoded in memory first
+            buffer = io.BytesIO()
+            image.save(buffer, args.type.upper())
+            out_file.write(buffer.getbuffer())
+    vk4progress.advance('write', height)
 
     log.debug("Exiting output_image()")
+    return out_file_name
+
+
+def output_binary(vk4_container, args, data, out_stream=None):
+    """output_binary
+
+    Outputs data to file, or out_stream, as a NumPy .npy array of shape
+    (height, width) or as raw little-endian values without any header, in
+    row blocks. Height and light data keep their uint32 and uint16 counts
+    (float64 with nan for invalid pixels if masked), derived layers are
+    float32.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    :param data: (height, width) numpy array of values
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_binary()\n\tData Layer: {}".format(args.layer))
+
+    out_file_name = output_target(args, '.' + args.type, out_stream)
+    height, width = data.shape[:2]
+    valid = get_layer_mask(vk4_container, args.layer)
+    dtype = np.dtype(np.float64) if valid is not None else data.dtype.newbyteorder('<')
+
+    with open_output(out_file_name, out_stream) as out_file:
+        if args.type == 'npy':
+            np.lib.format.write_array_header_1_0(
+                out_file, {'descr': np.lib.format.dtype_to_descr(dtype),
+                           'fortran_order': False, 'shape': data.shape})
+        for start, stop in row_blocks(height, width):
+            block = data[start:stop].astype(dtype, copy=False)
+            if valid is not None:
+                block = np.where(valid[start:stop], block, np.nan)
+            out_file.write(np.ascontiguousarray(block).data)
+
+    log.debug("Exiting output_binary()")
+    return out_file_name
+
+
+def get_mesh_grid(vk4_container, args):
+    """get_mesh_grid
+
+    Returns the (optionally decimated) height matrix used for mesh output,
+    the matching mask of valid pixels (None if the height data is not
+    masked) and the physical x, y and z steps in micrometers. The matrix and
+    mask are strided views, so no copy of the full scan is made.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    """
+    log.debug("Entering get_mesh_grid()")
+    step = getattr(args, 'decimate', 1) or 1
+    meas_conds = vk4_container.measurement_conditions
+    width = vk4_container.image_width
+    height = vk4_container.image_height
+
+    # x, y and z calibration values are stored in picometers
+    height_matrix = vk4layer.layer_matrix(vk4_container.height_data)[::step, ::step]
+    valid = get_layer_mask(vk4_container, 'H')
+    if valid is not None:
+        valid = valid[::step, ::step]
+    x_step = meas_conds['x_length_per_pixel'] * step / 1.0e6
+    y_step = meas_conds['y_length_per_pixel'] * step / 1.0e6
+    z_step = meas_conds['z_length_per_digit'] / 1.0e6
+
+    log.debug("Exiting get_mesh_grid()")
+    return height_matrix, valid, x_step, y_step, z_step
+
+
+def mesh_triangle_masks(valid, start, stop):
+    """mesh_triangle_masks
+
+    Returns a (stop - start, n_cols - 1, 2) boolean array stating for both
+    triangles of each grid cell in rows start to stop whether all three of
+    its corners are valid pixels.
+
+    :param valid: 2d boolean array, False for invalid pixels
+    :param start: first row of cells
+    :param stop: row of cells after the last
+    """
+    sub = valid[start:stop + 1]
+    shared = sub[:-1, 1:] & sub[1:, :-1]
+    return np.stack((shared & sub[:-1, :-1], shared & sub[1:, 1:]), axis=-1)
+
+
+def count_mesh_faces(valid, n_rows, n_cols):
+    """count_mesh_faces
+
+    Returns the number of triangles in a mesh of the grid, two per grid cell
+    minus those with an invalid corner, counting one block of rows at a time.
+
+    :param valid: 2d boolean array, False for invalid pixels, or None
+    :param n_rows: number of rows in the grid
+    :param n_cols: number of columns in the grid
+    """
+    if valid is None:
+        return 2 * max(n_rows - 1, 0) * max(n_cols - 1, 0)
+    n_faces = 0
+    for start, stop in row_blocks(n_rows - 1, n_cols - 1, progress=False):
+        n_faces += int(np.count_nonzero(mesh_triangle_masks(valid, start, stop)))
+    return n_faces
+
+
+def row_blocks(n_rows, n_cols, progress=True):
+    """row_blocks
+
+    Yields (start, stop) row ranges such that each block holds roughly
+    BLOCK_CELLS grid cells, keeping memory use for streamed output bounded
+    regardless of scan size. Once a block is done its rows are reported to
+    the active progress tracker, which raises vk4progress.Cancelled if the
+    job was cancelled.
+
+    :param n_rows: number of rows in the grid
+    :param n_cols: number of columns in the grid
+    :param progress: if False the rows are not reported, e.g. for a
+        counting pass before the output is written
+    """
+    rows_per_block = max(1, BLOCK_CELLS // max(n_cols, 1))
+    for start in range(0, n_rows, rows_per_block):
+        stop = min(start + rows_per_block, n_rows)
+        yield start, stop
+        if progress:
+            vk4progress.advance('write', stop - start)
+
+
+def output_ply(vk4_container, args, out_stream=None):
+    """output_ply
+
+    Outputs height data as a binary little-endian PLY mesh with vertices in
+    micrometers and two triangular faces per grid cell. If the layer argument
+    is 'RGB' each vertex also carries the color peak value of its pixel.
+    Vertices and faces are generated and written one block of rows at a time.
+    Invalid pixels of masked height data are left out, along with the faces
+    that use them.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_ply()\n\tData Layer: {}".format(args.layer))
+
+    out_file_name = output_target(args, '.ply', out_stream)
+
+    height_matrix, valid, x_step, y_step, z_step = get_mesh_grid(vk4_container, args)
+    n_rows, n_cols = height_matrix.shape
+    vk4progress.begin('write', n_rows, 'rows')
+    n_faces = count_mesh_faces(valid, n_rows, n_cols)
+    if valid is None:
+        n_vertices = n_rows * n_cols
+    else:
+        # index of the first vertex of each row once invalid pixels are removed
+        row_offsets = np.concatenate(([0], np.cumsum(np.count_nonzero(valid, axis=1))))
+        n_vertices = int(row_offsets[-1])
+
+    with_color = args.layer == 'RGB'
+    vertex_fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if with_color:
+        step = getattr(args, 'decimate', 1) or 1
+        rgb_matrix = vk4layer.layer_matrix(vk4_container.rgb_peak_data)[::step, ::step]
+        vertex_fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertex_dtype = np.dtype(vertex_fields)
+    face_dtype = np.dtype([('count', 'u1'), ('index', '<i4', (3,))])
+
+    header = ['ply',
+              'format binary_little_endian 1.0',
+              'comment vk4_driver export of ' + str(vk4_container),
+              'comment units micrometer',
+              'element vertex %d' % n_vertices,
+              'property float x',
+              'property float y',
+              'property float z']
+    if with_color:
+        header += ['property uchar red', 'property uchar green', 'property uchar blue']
+    header += ['element face %d' % n_faces,
+               'property list uchar int vertex_indices',
+               'end_header']
+
+    x_coords = (np.arange(n_cols) * x_step).astype(np.float32)
+    with open_output(out_file_name, out_stream) as out_file:
+        out_file.write(('\n'.join(header) + '\n').encode('ascii', 'replace'))
+
+        # vertices, flipping rows so that the mesh is not mirrored
+        for start, stop in row_blocks(n_rows, n_cols):
+            block = np.empty((stop - start, n_cols), dtype=vertex_dtype)
+            block['x'] = x_coords
+            block['y'] = ((n_rows - 1 - np.arange(start, stop)) * y_step)[:, np.newaxis]
+            block['z'] = height_matrix[start:stop] * z_step
+            if with_color:
+                block['red'] = rgb_matrix[start:stop, :, 0]
+                block['green'] = rgb_matrix[start:stop, :, 1]
+                block['blue'] = rgb_matrix[start:stop, :, 2]
+            if valid is not None:
+                block = block[valid[start:stop]]
+            out_file.write(block.data)
+
+        # faces, two counter-clockwise triangles per grid cell
+        for start, stop in row_blocks(n_rows - 1, n_cols - 1, progress=False):
+            if valid is None:
+                index = np.arange(start * n_cols, (stop + 1) * n_cols).reshape(-1, n_cols)
+            else:
+                index = np.cumsum(valid[start:stop + 1], axis=None).reshape(-1, n_cols)
+                index += row_offsets[start] - 1
+            triangles = np.stack((np.stack((index[:-1, :-1], index[1:, :-1], index[:-1, 1:]), axis=-1),
+                                  np.stack((index[:-1, 1:], index[1:, :-1], index[1:, 1:]), axis=-1)),
+                                 axis=2)
+            if valid is None:
+                triangles = triangles.reshape(-1, 3)
+            else:
+                triangles = triangles[mesh_triangle_masks(valid, start, stop)]
+            block = np.empty(triangles.shape[0], dtype=face_dtype)
+            block['count'] = 3
+            block['index'] = triangles
+            out_file.write(block.data)
+
+    log.debug("Exiting output_ply()")
+    return out_file_name
+
+
+def output_stl(vk4_container, args, out_stream=None):
+    """output_stl
+
+    Outputs height data as a binary STL mesh in micrometers with two
+    triangles per grid cell. Triangles and their normals are generated and
+    written one block of rows at a time. Triangles with a corner on an
+    invalid pixel of masked height data are left out.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_stl()\n\tData Layer: {}".format(args.layer))
+
+    out_file_name = output_target(args, '.stl', out_stream)
+
+    height_matrix, valid, x_step, y_step, z_step = get_mesh_grid(vk4_container, args)
+    n_rows, n_cols = height_matrix.shape
+    # faces are written for the cells between the rows
+    vk4progress.begin('write', n_rows - 1, 'rows')
+    n_faces = count_mesh_faces(valid, n_rows, n_cols)
+    triangle_dtype = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)),
+                               ('attribute', '<u2')])
+
+    # the header must not begin with 'solid' or readers take it for ascii STL
+    header = 'vk4_driver binary STL, units micrometer'.encode('ascii')
+    x_coords = np.arange(n_cols) * x_step
+    with open_output(out_file_name, out_stream) as out_file:
+        out_file.write(header.ljust(80, b'\0'))
+        out_file.write(np.uint32(n_faces).tobytes())
+
+        for start, stop in row_blocks(n_rows - 1, n_cols - 1):
+            # corner points of every cell in the block, shape (rows, cols, 3)
+            rows = n_rows - 1 - np.arange(start, stop + 1)
+            grid = np.empty((stop + 1 - start, n_cols, 3), dtype=np.float32)
+            grid[..., 0] = x_coords
+            grid[..., 1] = (rows * y_step)[:, np.newaxis]
+            grid[..., 2] = height_matrix[start:stop + 1] * z_step
+            p00 = grid[:-1, :-1].reshape(-1, 3)
+            p01 = grid[:-1, 1:].reshape(-1, 3)
+            p10 = grid[1:, :-1].reshape(-1, 3)
+            p11 = grid[1:, 1:].reshape(-1, 3)
+
+            block = np.zeros((p00.shape[0], 2), dtype=triangle_dtype)
+            block['vertices'][:, 0] = np.stack((p00, p10, p01), axis=1)
+            block['vertices'][:, 1] = np.stack((p01, p10, p11), axis=1)
+            if valid is not None:
+                block = block[mesh_triangle_masks(valid, start, stop).reshape(-1, 2)]
+            vertices = block['vertices']
+            normals = np.cross(vertices[..., 1, :] - vertices[..., 0, :],
+                               vertices[..., 2, :] - vertices[..., 0, :])
+            norms = np.linalg.norm(normals, axis=-1, keepdims=True)
+            np.divide(normals, norms, out=normals, where=norms > 0)
+            block['normal'] = normals
+            out_file.write(block.data)
+
+    log.debug("Exiting output_stl()")
+    return out_file_name
+
+
+def get_field_data(vk4_container, layer):
+    """get_field_data
+
+    Returns a (height, width) view of the raw height or light data along with
+    the factor that scales it to physical units and the name of those units.
+    Height data and derived layers in micrometers are scaled to meters, light
+    data and other derived layers are left unscaled.
+
+    :param vk4_container: VK4container object
+    :param layer: string - 'H' for height data, 'L' for light data or the
+        name of a derived layer
+    """
+    log.debug("Entering get_field_data()\n\tData Layer: {}".format(layer))
+    if layer in vk4_container.derived_data:
+        derived = vk4_container.derived_data[layer]
+        matrix = vk4layer.layer_matrix(derived)
+        if derived['unit'] == 'um':
+            log.debug("Exiting get_field_data()")
+            return matrix, 1.0e-6, 'm'
+        log.debug("Exiting get_field_data()")
+        return matrix, 1.0, derived['unit']
+    elif layer == 'H':
+        matrix = vk4layer.layer_matrix(vk4_container.height_data)
+        # z length per digit is stored in picometers
+        scale = vk4_container.measurement_conditions['z_length_per_digit'] * 1.0e-12
+        unit = 'm'
+    else:
+        matrix = vk4layer.layer_matrix(vk4_container.light_intensity_data)
+        scale = 1.0
+        unit = ''
+
+    log.debug("Exiting get_field_data()")
+    return matrix, scale, unit
+
+
+def write_float32_rows(out_file, matrix, scale, valid=None):
+    """write_float32_rows
+
+    Writes a matrix of raw values scaled to little-endian float32, one block
+    of rows at a time, directly from the buffer of each converted block.
+    Pixels which are False in the optional valid mask are written as NaN.
+
+    :param out_file: open binary file object
+    :param matrix: 2d numpy array of raw values
+    :param scale: factor applied to each value
+    :param valid: optional 2d boolean array, False for invalid pixels
+    """
+    n_rows, n_cols = matrix.shape
+    for start, stop in row_blocks(n_rows, n_cols):
+        block = np.multiply(matrix[start:stop], scale, dtype=np.float64)
+        if valid is not None:
+            np.copyto(block, np.nan, where=~valid[start:stop])
+        out_file.write(block.astype('<f4').data)
+
+
+def output_gsf(vk4_container, args, out_stream=None):
+    """output_gsf
+
+    Outputs height or light data to a Gwyddion Simple Field (gsf) file: a
+    short text header with the image resolution, physical size and units,
+    NUL padded to a multiple of 4 bytes, followed by float32 values.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_gsf()\n\tData Layer: {}".format(args.layer))
+
+    out_file_name = output_target(args, '.gsf', out_stream)
+
+    matrix, scale, unit = get_field_data(vk4_container, args.layer)
+    meas_conds = vk4_container.measurement_conditions
+    width = vk4_container.image_width
+    height = vk4_container.image_height
+
+    # x and y length per pixel are stored in picometers
+    header = ['Gwyddion Simple Field 1.0',
+              'XRes = %d' % width,
+              'YRes = %d' % height,
+              'XReal = %r' % (width * meas_conds['x_length_per_pixel'] * 1.0e-12),
+              'YReal = %r' % (height * meas_conds['y_length_per_pixel'] * 1.0e-12),
+              'XYUnits = m',
+              'ZUnits = %s' % unit,
+              'Title = %s' % str(vk4_container)]
+    header = ('\n'.join(header) + '\n').encode('utf-8')
+    padding = 4 - len(header) % 4
+
+    with open_output(out_file_name, out_stream) as out_file:
+        out_file.write(header + b'\0' * padding)
+        write_float32_rows(out_file, matrix, scale, get_layer_mask(vk4_container, args.layer))
+
+    log.debug("Exiting output_gsf()")
+    return out_file_name
+
+
+def output_sdf(vk4_container, args, out_stream=None):
+    """output_sdf
+
+    Outputs height or light data to a binary BCR / ISO 25178-71 surface data
+    file (sdf): an 81 byte binary header with the image resolution and x, y
+    and z scales in meters, followed by float32 values.
+
+    :param vk4_container: VK4container object
+    :param args: list of argparse arguments
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_sdf()\n\tData Layer: {}".format(args.layer))
+
+    width = vk4_container.image_width
+    height = vk4_container.image_height
+    if width > 0xFFFF or height > 0xFFFF:
+        log.error("In output_sdf()\n\tImage of {}x{} pixels exceeds the sdf "
+                  "limit of 65535 points per axis".format(width, height))
+        return
+
+    out_file_name = output_target(args, '.sdf', out_stream)
+
+    matrix, scale, unit = get_field_data(vk4_container, args.layer)
+    meas_conds = vk4_container.measurement_conditions
+    date = '%02d%02d%04d%02d%02d' % (meas_conds['day'], meas_conds['month'],
+                                     meas_conds['year'], meas_conds['hour'],
+                                     meas_conds['minute'])
+    z_resolution = scale if args.layer == 'H' else -1.0
+
+    # version, manufacturer id, creation and modification dates, points per
+    # profile, number of profiles, x, y, z scale and z resolution, followed
+    # by compression, data type (3 = float32) and checksum type
+    header = struct.pack('<8s10s12s12sHHddddBBB', b'bBCR-1.0', b'Keyence',
+                         date.encode('ascii'), date.encode('ascii'), width, height,
+                         meas_conds['x_length_per_pixel'] * 1.0e-12,
+                         meas_conds['y_length_per_pixel'] * 1.0e-12,
+                         1.0, z_resolution, 0, 3, 0)
+
+    with open_output(out_file_name, out_stream) as out_file:
+        out_file.write(header)
+        write_float32_rows(out_file, matrix, scale, get_layer_mask(vk4_container, args.layer))
+
+    log.debug("Exiting output_sdf()")
+    return out_file_name
 
 
 def create_file_meta_data(vk4_container, args):
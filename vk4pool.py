@@ -0,0 +1,269 @@
+"""vk4pool
+
+This module keeps the decoded data of many vk4 files within a memory
+budget, for notebooks and services which open scans over and over. Opening
+a file through a ContainerPool reads only its metadata (offsets,
+measurement conditions, string data and layer sizes) and returns a
+PooledContainer, which can be used like any VkContainer: its height, light
+and RGB layers are decoded when first accessed.
+
+The pool counts the bytes of every decoded layer. When they exceed the
+budget, the least recently used layers of any file are dropped, while the
+metadata of every open file stays. A dropped layer is decoded again on its
+next access, so code holding a container never sees the difference apart
+from the time taken. If the file has changed since it was opened, decoding
+a layer raises FileChangedError and the container is closed, as its
+metadata no longer describes the file; open the file again. Layers assigned to a container cannot be decoded again
+and are kept until the file is closed; a layer changed in place, e.g. by
+vk4mask.fill_container, must be assigned back to the container to be kept.
+Derived layers and masks are held by the container itself and are not
+counted.
+
+Example
+-------
+    pool = vk4pool.ContainerPool(budget_bytes=2 * 2 ** 30)
+    for file_name in archive:
+        vk4_container = pool.open(file_name)
+        print(file_name, vk4_container.get_calibrated_height().max())
+    print(pool.snapshot())
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+import vk4extract as vk4in
+import vk4validate
+import VkContainer
+
+log = logging.getLogger('vk4_driver.vk4pool')
+
+# container attribute of each layer: Vk4Builder method and offset key
+pooled_layers = {'rgb_peak_data': ('rgb_peak', 'color_peak'),
+                 'rgb_light_data': ('rgb_light', 'color_light'),
+                 'light_intensity_data': ('light', 'light'),
+                 'height_data': ('height', 'height')}
+
+
+class FileChangedError(OSError):
+    """FileChangedError
+
+    Raised when a layer of a PooledContainer is decoded after its file has
+    changed size or modification time since it was opened.
+    """
+
+
+def pooled_layer(attribute):
+    # property decoding the layer through the container's pool
+    def get_layer(self):
+        return self.pool.get_layer(self, attribute)
+
+    def set_layer(self, layer):
+        self.pool.set_layer(self, attribute, layer)
+    return property(get_layer, set_layer)
+
+
+class PooledContainer(VkContainer.VkContainer):
+    """PooledContainer
+
+    VkContainer whose image layers are held by a ContainerPool and decoded
+    on access
+
+    :param pool: ContainerPool object
+    :param key: key of the file in the pool
+    """
+    rgb_peak_data = pooled_layer('rgb_peak_data')
+    rgb_light_data = pooled_layer('rgb_light_data')
+    light_intensity_data = pooled_layer('light_intensity_data')
+    height_data = pooled_layer('height_data')
+
+    def __init__(self, pool, key):
+        # set first, as VkContainer.__init__ assigns the layers
+        self.pool = pool
+        self.key = key
+        super().__init__()
+
+
+def layer_bytes(layer):
+    # bytes of the arrays of a layer
+    return sum(getattr(layer.get(field), 'nbytes', 0) for field in ('data', 'palette'))
+
+
+class ContainerPool(object):
+    """ContainerPool
+
+    Thread safe pool of PooledContainers keeping their decoded layers within
+    a memory budget by dropping the least recently used layers. Counts layer
+    hits, misses (decodes) and evictions.
+
+    :param budget_bytes: largest number of bytes of decoded layers held; the
+        layer being accessed is always held, even if larger
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.containers = dict()
+        # decoded layers by (key, attribute), least recently used first
+        self.layers = OrderedDict()
+        # layers assigned by the user, which cannot be decoded again
+        self.pinned = set()
+        self.resident_bytes = 0
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open(self, file_name):
+        """open
+
+        Returns the PooledContainer of a vk4 file, reading its metadata if
+        the file is not yet open or has changed since it was opened. Returns
+        None if the file is invalid.
+
+        :param file_name: path to the vk4 file
+        """
+        status = os.stat(file_name)
+        key = (os.path.realpath(file_name), status.st_size, status.st_mtime_ns)
+        with self.lock:
+            if key in self.containers:
+                return self.containers[key]
+
+        problems = vk4validate.validate_file(file_name)
+        if problems:
+            log.error("In open()\n\tInvalid file - {}\n\t{}"
+                      .format(file_name, '\n\t'.join(problems)))
+            return None
+        vk4_container = PooledContainer(self, key)
+        vk4_container.file_name = file_name
+        with open(file_name, 'rb') as in_file:
+            vk4_container.offsets = vk4in.extract_offsets(in_file)
+            vk4_container.measurement_conditions = \
+                vk4in.extract_measurement_conditions(vk4_container.offsets, in_file)
+            vk4_container.string_data = vk4in.extract_string_data(vk4_container.offsets, in_file)
+            headers = vk4in.extract_layer_headers(vk4_container.offsets, in_file)
+        for offset_key in ('height', 'light', 'color_peak', 'color_light'):
+            if offset_key in headers:
+                vk4_container.image_width = headers[offset_key]['width']
+                vk4_container.image_height = headers[offset_key]['height']
+                break
+
+        with self.lock:
+            # another thread may have opened it meanwhile
+            return self.containers.setdefault(key, vk4_container)
+
+    def close(self, vk4_container):
+        """close
+
+        Drops a container and all of its layers from the pool
+
+        :param vk4_container: PooledContainer object from open()
+        """
+        with self.lock:
+            self.containers.pop(vk4_container.key, None)
+            for attribute in pooled_layers:
+                self.drop((vk4_container.key, attribute))
+
+    def drop(self, layer_key):
+        # removes a layer, the lock must be held
+        layer = self.layers.pop(layer_key, None)
+        self.pinned.discard(layer_key)
+        if layer is not None:
+            self.resident_bytes -= layer_bytes(layer)
+
+    def get_layer(self, vk4_container, attribute):
+        """get_layer
+
+        Returns a layer of a container, decoding it if it is not held, or
+        None if the file has no such layer. Layers are decoded outside of
+        the lock so other threads are not held up by a slow decode. Raises
+        FileChangedError, and closes the container, if the file has changed
+        since it was opened.
+
+        :param vk4_container: PooledContainer object
+        :param attribute: string - container attribute of the layer
+        """
+        layer_key = (vk4_container.key, attribute)
+        with self.lock:
+            if layer_key in self.layers:
+                self.layers.move_to_end(layer_key)
+                self.hits += 1
+                return self.layers[layer_key]
+            self.misses += 1
+        method, offset_key = pooled_layers[attribute]
+        if vk4_container.offsets[offset_key] == 0:
+            return None
+
+        file_name = vk4_container.file_name
+        log.debug("In get_layer()\n\tDecoding {} of {}".format(attribute, file_name))
+        with open(file_name, 'rb') as in_file:
+            # checked on the open file, which is the one decoded
+            status = os.fstat(in_file.fileno())
+            if (status.st_size, status.st_mtime_ns) != vk4_container.key[1:]:
+                self.close(vk4_container)
+                raise FileChangedError("{} has changed since it was opened".format(file_name))
+            builder = VkContainer.Vk4Builder(in_file)
+            # the builder calibrates height data with the measurement conditions
+            builder.vk4.measurement_conditions = vk4_container.measurement_conditions
+            getattr(builder, method)()
+        layer = getattr(builder.vk4, attribute)
+
+        with self.lock:
+            if layer_key in self.layers:
+                return self.layers[layer_key]
+            self.layers[layer_key] = layer
+            self.resident_bytes += layer_bytes(layer)
+            self.evict(keep=layer_key)
+        return layer
+
+    def set_layer(self, vk4_container, attribute, layer):
+        """set_layer
+
+        Replaces a layer of a container. The layer is pinned, i.e. kept
+        until the container is closed, as it may differ from the file.
+        Setting None drops the layer, which is decoded again on access.
+
+        :param vk4_container: PooledContainer object
+        :param attribute: string - container attribute of the layer
+        :param layer: layer object, or None
+        """
+        layer_key = (vk4_container.key, attribute)
+        with self.lock:
+            self.drop(layer_key)
+            if layer is None:
+                return
+            self.layers[layer_key] = layer
+            self.pinned.add(layer_key)
+            self.resident_bytes += layer_bytes(layer)
+            self.evict(keep=layer_key)
+
+    def evict(self, keep=None):
+        # drops least recently used layers until within the budget, the
+        # lock must be held
+        for layer_key in list(self.layers):
+            if self.resident_bytes <= self.budget_bytes:
+                break
+            if layer_key == keep or layer_key in self.pinned:
+                continue
+            log.debug("In evict()\n\tDropping {} of {}".format(layer_key[1], layer_key[0][0]))
+            self.drop(layer_key)
+            self.evictions += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'containers': len(self.containers), 'layers': len(self.layers),
+                    'pinned': len(self.pinned), 'resident_bytes': self.resident_bytes,
+                    'budget_bytes': self.budget_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
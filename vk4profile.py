@@ -0,0 +1,310 @@
+"""vk4profile
+
+This module samples height or light intensity data along line profiles,
+e.g. cross sections drawn across a weld bead. A profile is a polyline given
+by its vertices in pixels or micrometers; it is sampled about every pixel
+along its length by bilinear interpolation of the four surrounding pixels.
+The sample points of all profiles are gathered from the layer at once.
+
+Profiles can be sampled from a decoded VkContainer, or straight from a vk4
+file, in which case the layer data is memory mapped and only the rows the
+profiles pass through are read from disk, so sampling a few lines of a
+large stitched scan takes a fraction of the time of decoding it.
+
+Example
+-------
+    lines = [vk4profile.parse_polyline('10,20;300,20'),
+             vk4profile.parse_polyline('150,0;150,239')]
+    result = vk4profile.sample_file('scan.vk4', lines, layer='H')
+    vk4profile.output_profiles_csv(result, 'scan_profiles.csv')
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+import vk4extract as vk4in
+import vk4mask
+import vk4layer
+import vk4out
+
+log = logging.getLogger('vk4_driver.vk4profile')
+
+# type of data of the height and light layers
+layer_types = {'H': 'height', 'L': 'light'}
+
+# measurement condition of the effective bit depth of each layer
+bit_depth_keys = {'H': 'height_effective_bit_depth', 'L': 'light_effective_bit_depth'}
+
+# columns of the csv and npy output, one row per sample point
+profile_columns = ('profile', 'distance_um', 'x_px', 'y_px', 'value')
+
+
+def parse_polyline(text):
+    """parse_polyline
+
+    Returns the vertices of a polyline written as 'x0,y0;x1,y1;...' as an
+    (n, 2) array of x, y values. Raises ValueError if the text is not a list
+    of at least two points.
+
+    :param text: string - semicolon separated x,y pairs
+    """
+    try:
+        points = np.array([[float(value) for value in point.split(',')]
+                           for point in text.strip().split(';') if point.strip()])
+    except ValueError:
+        raise ValueError("profile points must be numbers: {}".format(text))
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 2:
+        raise ValueError("a profile needs at least two x,y points: {}".format(text))
+    return points
+
+
+def densify_polylines(polylines, pixel_size, units='px', step=1.0):
+    """densify_polylines
+
+    Places sample points along each polyline, about every step pixels along
+    each segment and at every vertex. Returns the column and row of every
+    point in pixels, its distance along its polyline in micrometers (using
+    the x and y pixel sizes, which may differ) and the index of its polyline,
+    as four arrays of equal length.
+
+    :param polylines: list of (n, 2) arrays of x, y vertices
+    :param pixel_size: tuple - x and y length of a pixel in micrometers
+    :param units: string - units of the vertices, 'px' or 'um'
+    :param step: spacing of the sample points in pixels
+    """
+    pixel_size = np.asarray(pixel_size, dtype=np.float64)
+    columns, rows, distances, indices = [], [], [], []
+    for index, polyline in enumerate(polylines):
+        vertices = np.asarray(polyline, dtype=np.float64)
+        if units == 'um':
+            vertices = vertices / pixel_size
+        deltas = np.diff(vertices, axis=0)
+        n_steps = np.maximum(np.ceil(np.hypot(deltas[:, 0], deltas[:, 1]) / step), 1)
+        n_steps = n_steps.astype(np.int64)
+        # fraction along its segment of each point, the last vertex is added
+        # after the loop so that shared vertices are sampled once
+        segment = np.repeat(np.arange(len(deltas)), n_steps)
+        fraction = (np.arange(n_steps.sum()) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)) \
+            / np.repeat(n_steps, n_steps)
+        points = vertices[segment] + deltas[segment] * fraction[:, np.newaxis]
+        points = np.vstack((points, vertices[-1]))
+
+        lengths = np.hypot(*(np.diff(points, axis=0) * pixel_size).T)
+        columns.append(points[:, 0])
+        rows.append(points[:, 1])
+        distances.append(np.concatenate(([0.0], np.cumsum(lengths))))
+        indices.append(np.full(len(points), index, dtype=np.int64))
+
+    return (np.concatenate(columns), np.concatenate(rows), np.concatenate(distances),
+            np.concatenate(indices))
+
+
+def bilinear_sample(matrix, rows, columns, valid=None, saturated=None):
+    """bilinear_sample
+
+    Returns the bilinear interpolation of a (height, width) array, which may
+    be a memory map, at fractional row and column positions as float64
+    values. Points outside the array are NaN, as are points next to an
+    invalid pixel, i.e. one which is False in valid or whose value is 0 or at
+    least saturated. Only the band of rows the points lie in is read.
+
+    :param matrix: (height, width) array or memory map
+    :param rows: array of row positions
+    :param columns: array of column positions, same length as rows
+    :param valid: optional (height, width) boolean array of valid pixels
+    :param saturated: optional value from which on raw pixels are invalid
+    """
+    height, width = matrix.shape
+    values = np.full(len(rows), np.nan)
+    inside = (rows >= 0) & (rows <= height - 1) & (columns >= 0) & (columns <= width - 1)
+    if not inside.any():
+        return values
+    rows, columns = rows[inside], columns[inside]
+
+    # the top left pixel of the four, kept one short of the last row and
+    # column so that points on the far edges still have four pixels
+    row0 = np.minimum(np.floor(rows).astype(np.intp), max(height - 2, 0))
+    col0 = np.minimum(np.floor(columns).astype(np.intp), max(width - 2, 0))
+    row1 = np.minimum(row0 + 1, height - 1)
+    col1 = np.minimum(col0 + 1, width - 1)
+    row_fraction = rows - row0
+    col_fraction = columns - col0
+
+    first_row = row0.min()
+    band = np.asarray(matrix[first_row:row1.max() + 1])
+    row0 -= first_row
+    row1 -= first_row
+    corners = (band[row0, col0], band[row0, col1], band[row1, col0], band[row1, col1])
+
+    result = (corners[0] * (1 - col_fraction) + corners[1] * col_fraction) * (1 - row_fraction) + \
+        (corners[2] * (1 - col_fraction) + corners[3] * col_fraction) * row_fraction
+    if saturated is not None:
+        for corner in corners:
+            result[(corner == 0) | (corner >= saturated)] = np.nan
+    if valid is not None:
+        valid_band = valid[first_row:row1.max() + 1]
+        all_valid = valid_band[row0, col0] & valid_band[row0, col1] & \
+            valid_band[row1, col0] & valid_band[row1, col1]
+        result[~all_valid] = np.nan
+    values[inside] = result
+    return values
+
+
+def collect_profiles(values, columns, rows, distances, indices, layer, unit):
+    # splits the sample points of all profiles into one dictionary each
+    starts = np.searchsorted(indices, np.arange(indices[-1] + 2))
+    profiles = []
+    for start, stop in zip(starts[:-1], starts[1:]):
+        profiles.append({'distance_um': distances[start:stop], 'x_px': columns[start:stop],
+                         'y_px': rows[start:stop], 'value': values[start:stop]})
+    return {'layer': layer, 'unit': unit, 'profiles': profiles}
+
+
+def sample_container(vk4_container, polylines, layer='H', units='px', step=1.0):
+    """sample_container
+
+    Samples a layer of a VkContainer along polylines. Height data is
+    calibrated to micrometers; pixels marked invalid in valid_masks are
+    excluded. Returns a dictionary with the layer, the unit of the values
+    and 'profiles', a list with for each polyline a dictionary of the
+    arrays 'distance_um', 'x_px', 'y_px' and 'value'.
+
+    :param vk4_container: VkContainer object
+    :param polylines: list of (n, 2) arrays of x, y vertices
+    :param layer: string - 'H', 'L' or the name of a derived layer
+    :param units: string - units of the vertices, 'px' or 'um'
+    :param step: spacing of the sample points in pixels
+    """
+    log.debug("Entering sample_container()\n\tLayer: {}\tProfiles: {}"
+              .format(layer, len(polylines)))
+    valid = None
+    if layer in vk4_container.derived_data:
+        data_layer = vk4_container.derived_data[layer]
+        scale, unit = 1.0, data_layer['unit']
+    elif layer in layer_types:
+        d_type = layer_types[layer]
+        data_layer = getattr(vk4_container, 'height_data' if layer == 'H'
+                             else 'light_intensity_data')
+        valid = vk4_container.valid_masks.get(d_type)
+        scale, unit = 1.0, ''
+        if layer == 'H':
+            # z length per digit is stored in picometers
+            scale = vk4_container.measurement_conditions['z_length_per_digit'] / 1.0e6
+            unit = 'um'
+    else:
+        log.error("In sample_container()\n\tLayer {} must be H, L or a derived layer"
+                  .format(layer))
+        return None
+
+    matrix = vk4layer.layer_matrix(data_layer)
+    columns, rows, distances, indices = densify_polylines(
+        polylines, vk4_container.get_pixel_size(), units, step)
+    values = bilinear_sample(matrix, rows, columns, valid) * scale
+
+    log.debug("Exiting sample_container()")
+    return collect_profiles(values, columns, rows, distances, indices, layer, unit)
+
+
+def sample_file(file_name, polylines, layer='H', units='px', mask=False, step=1.0):
+    """sample_file
+
+    Samples the height or light data of a vk4 file along polylines without
+    decoding the file: the layer is memory mapped and only the rows the
+    profiles pass through are read. Returns the same dictionary as
+    sample_container.
+
+    :param file_name: path to a valid vk4 file
+    :param polylines: list of (n, 2) arrays of x, y vertices
+    :param layer: string - 'H' or 'L'
+    :param units: string - units of the vertices, 'px' or 'um'
+    :param mask: if True pixels which are 0 or saturated are excluded
+    :param step: spacing of the sample points in pixels
+    """
+    log.debug("Entering sample_file()\n\tFile: {}\tLayer: {}".format(file_name, layer))
+    with open(file_name, 'rb') as in_file:
+        offsets = vk4in.extract_offsets(in_file)
+        conditions = vk4in.extract_measurement_conditions(offsets, in_file)
+    layer_data = vk4in.map_img_data(offsets, layer_types[layer], file_name)
+    matrix = layer_data.matrix
+
+    saturated = None
+    if mask:
+        saturated = vk4mask.saturation_value(layer_data['bit_depth'],
+                                             conditions[bit_depth_keys[layer]])
+    scale, unit = 1.0, ''
+    if layer == 'H':
+        scale, unit = conditions['z_length_per_digit'] / 1.0e6, 'um'
+    pixel_size = (conditions['x_length_per_pixel'] / 1.0e6,
+                  conditions['y_length_per_pixel'] / 1.0e6)
+
+    columns, rows, distances, indices = densify_polylines(polylines, pixel_size, units, step)
+    values = bilinear_sample(matrix, rows, columns, saturated=saturated) * scale
+    del matrix, layer_data
+
+    log.debug("Exiting sample_file()")
+    return collect_profiles(values, columns, rows, distances, indices, layer, unit)
+
+
+def profile_table(result):
+    """profile_table
+
+    Returns the sample points of all profiles as an (n, 5) float64 array
+    with the columns of profile_columns
+
+    :param result: dictionary returned by sample_container or sample_file
+    """
+    tables = [np.column_stack((np.full(len(profile['value']), index, dtype=np.float64),
+                               profile['distance_um'], profile['x_px'], profile['y_px'],
+                               profile['value']))
+              for index, profile in enumerate(result['profiles'])]
+    return np.vstack(tables) if tables else np.empty((0, len(profile_columns)))
+
+
+def output_profiles_csv(result, out_file_name, out_stream=None):
+    """output_profiles_csv
+
+    Writes the sampled profiles to a csv file, or out_stream, one row per
+    sample point with a header row of the column names; missing values are
+    written as nan
+
+    :param result: dictionary returned by sample_container or sample_file
+    :param out_file_name: path to the csv file
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_profiles_csv()")
+    names = list(profile_columns)
+    if result['unit']:
+        names[-1] += '_' + result['unit']
+    with vk4out.open_output(out_file_name, out_stream) as out_file:
+        np.savetxt(out_file, profile_table(result), fmt=('%d', '%.6g', '%.3f', '%.3f', '%.6g'),
+                   delimiter=',', header=','.join(names), comments='')
+    log.debug("Exiting output_profiles_csv()")
+
+
+def output_profiles_npy(result, out_file_name, out_stream=None):
+    """output_profiles_npy
+
+    Writes the sampled profiles to a NumPy .npy file, or out_stream, as an
+    (n, 5) float64 array with the columns of profile_columns
+
+    :param result: dictionary returned by sample_container or sample_file
+    :param out_file_name: path to the npy file
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_profiles_npy()")
+    with vk4out.open_output(out_file_name, out_stream) as out_file:
+        np.save(out_file, profile_table(result))
+    log.debug("Exiting output_profiles_npy()")
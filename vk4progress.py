@@ -0,0 +1,224 @@
+"""vk4progress
+
+This module reports the progress of long running decodes, writes and
+batches, and lets them be cancelled. A ProgressTracker is made active for
+the current thread with the tracking() context manager; while it is, the
+decoding (vk4extract), writing (vk4out) and batch loops (vk4_driver) report
+the bytes read, rows written and files done to it at every chunk of work.
+Code not run under a tracker pays only for a thread local lookup per chunk.
+
+Each report is passed to the tracker's callback as a dictionary holding the
+stage ('decode', 'write' or 'files'), its unit, the amount done and the
+total (None if not known in advance), the elapsed time, the throughput and,
+if the total is known, the estimated time remaining.
+
+Cancelling the tracker's CancelToken, e.g. from a signal handler or another
+thread, makes the next chunk boundary raise Cancelled. Output files are
+written to a temporary file which is only renamed to the output name once
+complete (see vk4out.open_output), so a cancelled job leaves no partial
+output behind.
+
+Example
+-------
+    token = vk4progress.CancelToken()
+    tracker = vk4progress.ProgressTracker(vk4progress.render_progress, token)
+    with vk4progress.tracking(tracker):
+        vk4_container = VkContainer.VkDirector(builder).build()
+        vk4out.output_data(vk4_container, args)
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import contextlib
+import logging
+import sys
+import threading
+import time
+
+log = logging.getLogger('vk4_driver.vk4progress')
+
+# shortest time in seconds between two reports of the same stage
+REPORT_INTERVAL = 0.2
+
+# units of the amounts reported for each stage
+stage_units = {'decode': 'bytes', 'write': 'rows', 'files': 'files'}
+
+
+class Cancelled(Exception):
+    """Cancelled
+
+    Raised at a chunk boundary of a job whose CancelToken was cancelled
+    """
+
+
+class CancelToken(object):
+    """CancelToken
+
+    Thread safe flag asking a job to stop at its next chunk boundary
+    """
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled("job cancelled")
+
+
+class ProgressTracker(object):
+    """ProgressTracker
+
+    Keeps the amount done of each stage of a job and passes reports to a
+    callback, at most every REPORT_INTERVAL seconds per stage and whenever a
+    stage completes
+
+    :param callback: function taking a report dictionary, or None
+    :param token: CancelToken checked at every report, or None
+    """
+    def __init__(self, callback=None, token=None):
+        self.callback = callback
+        self.token = token
+        self.stages = dict()
+        self.lock = threading.Lock()
+
+    def begin(self, stage, total=None, unit=None):
+        """begin
+
+        Starts (or restarts) counting a stage
+
+        :param stage: string - name of the stage
+        :param total: amount of work of the stage, or None if not known
+        :param unit: string - unit of the amounts, defaults to the one in
+            stage_units
+        """
+        if unit is None:
+            unit = stage_units.get(stage, '')
+        with self.lock:
+            self.stages[stage] = {'total': total, 'unit': unit, 'done': 0,
+                                  'start': time.monotonic(), 'reported': 0.0}
+
+    def advance(self, stage, amount):
+        """advance
+
+        Adds to the amount done of a stage, reports it if due and raises
+        Cancelled if the token was cancelled
+
+        :param stage: string - name of the stage, begun if not yet
+        :param amount: amount of work done since the last call
+        """
+        if self.token is not None:
+            self.token.check()
+        if stage not in self.stages:
+            self.begin(stage)
+        with self.lock:
+            state = self.stages[stage]
+            state['done'] += amount
+            now = time.monotonic()
+            finished = state['total'] is not None and state['done'] >= state['total']
+            if self.callback is None or (now - state['reported'] < REPORT_INTERVAL and
+                                         not finished):
+                return
+            state['reported'] = now
+            report = self.report(stage)
+        self.callback(report)
+
+    def report(self, stage):
+        """report
+
+        Returns the report dictionary of a stage
+
+        :param stage: string - name of the stage
+        """
+        state = self.stages[stage]
+        elapsed = time.monotonic() - state['start']
+        rate = state['done'] / elapsed if elapsed > 0 else None
+        eta = None
+        if state['total'] is not None and rate:
+            eta = max(state['total'] - state['done'], 0) / rate
+        return {'stage': stage, 'unit': state['unit'], 'done': state['done'],
+                'total': state['total'], 'elapsed': elapsed, 'rate': rate, 'eta': eta}
+
+
+thread_state = threading.local()
+
+
+@contextlib.contextmanager
+def tracking(tracker):
+    """tracking
+
+    Context manager making a ProgressTracker the active one of the current
+    thread, restoring the previous one afterwards
+
+    :param tracker: ProgressTracker object
+    """
+    previous = getattr(thread_state, 'tracker', None)
+    thread_state.tracker = tracker
+    try:
+        yield tracker
+    finally:
+        thread_state.tracker = previous
+
+
+def begin(stage, total=None, unit=None):
+    # starts a stage of the active tracker, if any
+    tracker = getattr(thread_state, 'tracker', None)
+    if tracker is not None:
+        tracker.begin(stage, total, unit)
+
+
+def advance(stage, amount):
+    # reports work to the active tracker, if any, which may raise Cancelled
+    tracker = getattr(thread_state, 'tracker', None)
+    if tracker is not None:
+        tracker.advance(stage, amount)
+
+
+def format_amount(amount, unit):
+    if unit == 'bytes':
+        return '{:.1f} MB'.format(amount / 1.0e6)
+    return '{:d} {}'.format(int(amount), unit)
+
+
+def render_progress(report, stream=None):
+    """render_progress
+
+    Writes a report as a single line, overwriting the previous one, to a
+    text stream (standard error by default), e.g.
+
+        write 1200/4800 rows  310 rows/s  ETA 12 s
+
+    :param report: report dictionary from a ProgressTracker
+    :param stream: writable text stream
+    """
+    stream = sys.stderr if stream is None else stream
+    done = format_amount(report['done'], report['unit'])
+    if report['total'] is not None:
+        done = '{}/{}'.format(format_amount(report['done'], report['unit']).split()[0],
+                              format_amount(report['total'], report['unit']))
+    parts = [report['stage'], done]
+    if report['rate'] is not None:
+        parts.append(format_amount(report['rate'], report['unit']) + '/s')
+    if report['eta'] is not None:
+        parts.append('ETA {:.0f} s'.format(report['eta']))
+    stream.write('\r' + '  '.join(parts).ljust(60))
+    if report['total'] is not None and report['done'] >= report['total'] and \
+            report['stage'] == 'files':
+        stream.write('\n')
+    stream.flush()
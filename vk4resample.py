@@ -0,0 +1,247 @@
+"""vk4resample
+
+This module resamples the layers of VkContainer objects to a target pixel
+pitch, so that scans taken with different lens magnifications or optical
+zooms, and so different x and y lengths per pixel, can be compared, stacked
+or output pixel for pixel.
+
+Each axis is resampled on its own. Along an axis whose pitch grows (down
+sampling) every new pixel is the area average of the old pixels it covers,
+partly covered pixels weighted by their overlap; along an axis whose pitch
+shrinks (up sampling) it is the linear interpolation of the two nearest old
+pixel centers, giving bilinear interpolation when both axes are up sampled.
+An axis is described by the indices and weights of the old pixels each new
+pixel is formed from, so the resampling is a handful of vectorized gathers,
+done in tiles of new rows which only read the band of old rows they need.
+
+Height, light, RGB and derived layers are resampled and rounded back to
+their data type, and the container's image size and x and y length per
+pixel are updated. Pixels invalid in valid_masks are left out of the
+averages; a new pixel is valid if at least half of its weight comes from
+valid pixels.
+
+Example
+-------
+    vk4resample.resample_container(vk4_container, 0.5)        # 0.5 um pixels
+    vk4resample.resample_container(vk4_container, 0.5, 1.0)   # x and y pitch
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+import vk4layer
+
+log = logging.getLogger('vk4_driver.vk4resample')
+
+# number of new pixels computed at once
+RESAMPLE_BLOCK_CELLS = 2 ** 20
+
+# container attributes of the image layers and the valid_masks key of each
+resampled_layers = {'rgb_peak_data': None, 'rgb_light_data': None,
+                    'light_intensity_data': 'light', 'height_data': 'height'}
+
+
+def parse_pitch(text):
+    """parse_pitch
+
+    Returns the x and y pitch in micrometers from 'X' or 'X,Y'. Raises
+    ValueError if the pitch is not one or two positive numbers.
+
+    :param text: string - pitch in micrometers
+    """
+    try:
+        values = [float(value) for value in text.split(',')]
+    except ValueError:
+        raise ValueError("pixel pitch must be numbers: {}".format(text))
+    if len(values) not in (1, 2) or min(values) <= 0:
+        raise ValueError("pixel pitch must be one or two positive numbers: {}".format(text))
+    return values[0], values[-1]
+
+
+def resampled_size(n_in, ratio):
+    # number of new pixels along an axis of n_in old pixels
+    return max(1, int(round(n_in / ratio)))
+
+
+def axis_weights(n_in, ratio):
+    """axis_weights
+
+    Returns the old pixel indices and weights forming each new pixel along
+    an axis as two (n_out, k) arrays, the weights of each new pixel summing
+    to 1. New pixels are ratio old pixels long; if ratio is at least 1 they
+    are area averages of the old pixels they cover, otherwise linear
+    interpolations of the two nearest old pixel centers. The axis keeps its
+    start, and its length is rounded to a whole number of new pixels.
+
+    :param n_in: number of old pixels along the axis
+    :param ratio: new pitch divided by old pitch
+    """
+    n_out = resampled_size(n_in, ratio)
+    if ratio >= 1:
+        # new pixel i covers old pixels [i * ratio, (i + 1) * ratio)
+        starts = np.arange(n_out) * ratio
+        stops = np.minimum(starts + ratio, n_in)
+        first = np.minimum(np.floor(starts).astype(np.intp), n_in - 1)
+        indices = first[:, np.newaxis] + np.arange(int(np.ceil(ratio)) + 1)
+        overlap = np.minimum(indices + 1, stops[:, np.newaxis]) - \
+            np.maximum(indices, starts[:, np.newaxis])
+        weights = np.clip(overlap, 0.0, None)
+        weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1.0e-12)
+        return np.minimum(indices, n_in - 1), weights
+
+    centers = np.clip((np.arange(n_out) + 0.5) * ratio - 0.5, 0.0, n_in - 1)
+    first = np.minimum(np.floor(centers).astype(np.intp), max(n_in - 2, 0))
+    fraction = centers - first
+    indices = np.stack((first, np.minimum(first + 1, n_in - 1)), axis=1)
+    weights = np.stack((1.0 - fraction, fraction), axis=1)
+    return indices, weights
+
+
+def gather(values, indices, weights, axis):
+    # weighted sum of the values at indices along an axis, k terms per index
+    result = 0.0
+    shape = [1] * values.ndim
+    shape[axis] = len(weights)
+    for term in range(indices.shape[1]):
+        result = result + np.take(values, indices[:, term], axis=axis) * \
+            weights[:, term].reshape(shape)
+    return result
+
+
+def resample_matrix(matrix, row_weights, column_weights, valid=None, dtype=None):
+    """resample_matrix
+
+    Resamples a (height, width) or (height, width, channels) array, which
+    may be a memory map, with the row and column indices and weights from
+    axis_weights, in tiles of about RESAMPLE_BLOCK_CELLS new pixels. Returns
+    the new array, rounded and clipped to dtype if it is an integer type,
+    and the new valid mask (None if valid is None). Invalid pixels are left
+    out of the weighted sums and set to 0 in integer output, NaN otherwise.
+
+    :param matrix: array of old pixels
+    :param row_weights: (indices, weights) of the rows from axis_weights
+    :param column_weights: (indices, weights) of the columns
+    :param valid: optional (height, width) boolean array of valid pixels
+    :param dtype: data type of the result, defaults to matrix's
+    """
+    dtype = np.dtype(matrix.dtype if dtype is None else dtype)
+    row_indices, row_factors = row_weights
+    column_indices, column_factors = column_weights
+    n_rows, n_cols = len(row_factors), len(column_factors)
+    result = np.empty((n_rows, n_cols) + matrix.shape[2:], dtype=dtype)
+    new_valid = None if valid is None else np.empty((n_rows, n_cols), dtype=bool)
+    rows_per_tile = max(1, RESAMPLE_BLOCK_CELLS // max(n_cols, 1))
+
+    for start in range(0, n_rows, rows_per_tile):
+        stop = min(start + rows_per_tile, n_rows)
+        indices = row_indices[start:stop]
+        first, last = indices.min(), indices.max() + 1
+        band = np.asarray(matrix[first:last], dtype=np.float64)
+        indices = indices - first
+        if valid is None:
+            values = gather(gather(band, indices, row_factors[start:stop], 0),
+                            column_indices, column_factors, 1)
+        else:
+            band_valid = valid[first:last]
+            band = np.where(band_valid.reshape(band_valid.shape + (1,) * (band.ndim - 2)),
+                            band, 0.0)
+            weight = gather(gather(band_valid.astype(np.float64), indices,
+                                   row_factors[start:stop], 0),
+                            column_indices, column_factors, 1)
+            values = gather(gather(band, indices, row_factors[start:stop], 0),
+                            column_indices, column_factors, 1)
+            tile_valid = weight >= 0.5
+            weight = weight.reshape(weight.shape + (1,) * (values.ndim - 2))
+            values = values / np.maximum(weight, 1.0e-12)
+            values[~tile_valid] = 0 if dtype.kind in 'iu' else np.nan
+            new_valid[start:stop] = tile_valid
+        if dtype.kind in 'iu':
+            info = np.iinfo(dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        result[start:stop] = values
+
+    return result, new_valid
+
+
+def resample_layer(layer, x_ratio, y_ratio, valid=None):
+    """resample_layer
+
+    Returns a copy of a layer resampled so that its pixels are x_ratio and
+    y_ratio old pixels long, keeping its data type, and the resampled valid
+    mask (None if valid is None)
+
+    :param layer: vk4layer.ScalarLayer or ColorLayer object
+    :param x_ratio: new x pitch divided by old x pitch
+    :param y_ratio: new y pitch divided by old y pitch
+    :param valid: optional (height, width) boolean array of valid pixels
+    """
+    matrix = vk4layer.layer_matrix(layer)
+    data, new_valid = resample_matrix(matrix, axis_weights(matrix.shape[0], y_ratio),
+                                      axis_weights(matrix.shape[1], x_ratio), valid)
+    new_layer = layer.copy()
+    new_layer['height'], new_layer['width'] = data.shape[:2]
+    new_layer['data'] = data.reshape((-1,) + data.shape[2:]) if data.ndim > 2 \
+        else np.ravel(data)
+    if 'data_byte_size' in new_layer:
+        new_layer['data_byte_size'] = data.nbytes
+    return new_layer, new_valid
+
+
+def resample_container(vk4_container, x_pitch, y_pitch=None):
+    """resample_container
+
+    Resamples every image layer, derived layer and valid mask of a
+    VkContainer to pixels of x_pitch by y_pitch micrometers, replacing the
+    layers rather than changing them in place, and updates the container's
+    image size and the x and y length per pixel of its measurement
+    conditions (a new dictionary, so copies sharing the old one keep it).
+    Returns the container.
+
+    :param vk4_container: VkContainer object
+    :param x_pitch: new x length of a pixel in micrometers
+    :param y_pitch: new y length of a pixel in micrometers, defaults to
+        x_pitch
+    """
+    y_pitch = x_pitch if y_pitch is None else y_pitch
+    old_x, old_y = vk4_container.get_pixel_size()
+    x_ratio, y_ratio = x_pitch / old_x, y_pitch / old_y
+    log.debug("Entering resample_container()\n\tPitch: {} x {} um from {} x {} um"
+              .format(x_pitch, y_pitch, old_x, old_y))
+
+    valid_masks = dict()
+    for attribute, d_type in resampled_layers.items():
+        layer = getattr(vk4_container, attribute)
+        if layer is None:
+            continue
+        layer, valid = resample_layer(layer, x_ratio, y_ratio,
+                                      vk4_container.valid_masks.get(d_type))
+        setattr(vk4_container, attribute, layer)
+        if valid is not None:
+            valid_masks[d_type] = valid
+    for name, layer in list(vk4_container.derived_data.items()):
+        vk4_container.derived_data[name] = resample_layer(layer, x_ratio, y_ratio)[0]
+    vk4_container.valid_masks = valid_masks
+
+    columns = resampled_size(vk4_container.image_width, x_ratio)
+    rows = resampled_size(vk4_container.image_height, y_ratio)
+    vk4_container.image_width, vk4_container.image_height = columns, rows
+    # x and y length per pixel are stored in picometers
+    vk4_container.measurement_conditions = dict(vk4_container.measurement_conditions,
+                                                x_length_per_pixel=int(round(x_pitch * 1.0e6)),
+                                                y_length_per_pixel=int(round(y_pitch * 1.0e6)))
+
+    log.debug("Exiting resample_container()\n\tImage size: {} x {}".format(columns, rows))
+    return vk4_container
@@ -0,0 +1,427 @@
+"""vk4segment
+
+This module detects features, such as residue particles and pits, in the
+height or light intensity data of VkContainer objects. The height data is
+first leveled by subtracting its least squares plane. Pixels lying more than
+a threshold above (particles) or below (pits) the median level are selected
+and grouped into 8-connected (or 4-connected) features, for which the area,
+volume, maximum height, centroid and bounding box are reported in physical
+units.
+
+Labeling works on runs of selected pixels rather than on single pixels. The
+runs of each row are found with array operations, runs of neighbouring rows
+which touch are linked, and the linked runs are resolved into features by a
+vectorized union-find (hooking to the smaller label followed by pointer
+jumping). The image is processed in tiles of rows: each tile is labeled and
+reduced to per-feature partial results on its own, and features which cross
+the seam between two tiles are joined by linking the runs of the rows on
+either side of the seam and merging their partial results.
+
+Example
+-------
+    features = vk4segment.detect_features(vk4_container, 'particles')
+    vk4segment.output_features_csv(features, out_file_name)
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import csv
+import json
+import logging
+import numpy as np
+import vk4layer
+import vk4out
+
+log = logging.getLogger('vk4_driver.vk4segment')
+
+# number of pixels labeled per tile of rows
+SEGMENT_BLOCK_CELLS = 2 ** 21
+
+# feature fields in output order
+feature_fields = ('label', 'pixels', 'area_um2', 'volume_um3', 'max_height',
+                  'centroid_x_um', 'centroid_y_um', 'min_x_um', 'min_y_um',
+                  'max_x_um', 'max_y_um')
+
+# layer: (layer dict attribute, valid_masks key, unit of the values)
+segment_layers = {'H': ('height_data', 'height', 'um'),
+                  'L': ('light_intensity_data', 'light', '')}
+
+
+def level_height(vk4_container):
+    """level_height
+
+    Returns the calibrated height data of a VkContainer in micrometers, as a
+    (height, width) float64 array, with its least squares plane subtracted.
+    Pixels marked invalid in the height mask are NaN and do not take part in
+    the plane fit.
+
+    :param vk4_container: VkContainer object with height data
+    """
+    log.debug("Entering level_height()")
+    height_matrix = vk4_container.get_calibrated_height()
+    n_rows, n_cols = height_matrix.shape
+    valid = np.isfinite(height_matrix)
+    rows, cols = np.nonzero(valid)
+    if rows.size < 3:
+        return height_matrix
+
+    # normal equations of z = a * x + b * y + c
+    x = cols.astype(np.float64)
+    y = rows.astype(np.float64)
+    z = height_matrix[valid]
+    normal = np.array([[np.dot(x, x), np.dot(x, y), x.sum()],
+                       [np.dot(x, y), np.dot(y, y), y.sum()],
+                       [x.sum(), y.sum(), float(x.size)]])
+    rhs = np.array([np.dot(x, z), np.dot(y, z), z.sum()])
+    a, b, c = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+
+    height_matrix -= a * np.arange(n_cols)[np.newaxis, :]
+    height_matrix -= b * np.arange(n_rows)[:, np.newaxis]
+    height_matrix -= c
+    log.debug("Exiting level_height()")
+    return height_matrix
+
+
+def find_runs(selected):
+    """find_runs
+
+    Returns the runs of True pixels in each row of a 2d boolean array as
+    three arrays, the row, the first column and one past the last column of
+    each run, ordered by row and then column.
+
+    :param selected: 2d boolean array
+    """
+    n_rows, n_cols = selected.shape
+    padded = np.zeros((n_rows, n_cols + 2), dtype=np.int8)
+    padded[:, 1:-1] = selected
+    edges = np.diff(padded, axis=1)
+    start_rows, starts = np.nonzero(edges == 1)
+    stops = np.nonzero(edges == -1)[1]
+    return start_rows, starts, stops
+
+
+def link_runs(upper, lower, connectivity=8):
+    """link_runs
+
+    Returns the pairs of indices (i, j) of runs upper[i] and lower[j] which
+    touch, where every lower run lies in the row below its upper runs. Both
+    sets of runs must be ordered by row and then column as given by
+    find_runs.
+
+    :param upper: (rows, starts, stops) tuple of runs
+    :param lower: (rows, starts, stops) tuple of runs, one row further down
+    :param connectivity: 8 to join runs touching diagonally, otherwise 4
+    """
+    upper_rows, upper_starts, upper_stops = upper
+    lower_rows, lower_starts, lower_stops = lower
+    if not upper_rows.size or not lower_rows.size:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    # keys order runs by row then column, each row getting its own range
+    row_size = int(max(upper_stops.max(), lower_stops.max())) + 2
+    touch = 1 if connectivity == 8 else 0
+    upper_start_keys = upper_rows * row_size + upper_starts
+    upper_stop_keys = upper_rows * row_size + upper_stops
+    row_keys = (lower_rows - 1) * row_size
+    # upper runs ending at or after the lower run's start...
+    first = np.searchsorted(upper_stop_keys, row_keys + lower_starts + 1 - touch, 'left')
+    # ...and starting before (or at) its stop
+    last = np.searchsorted(upper_start_keys, row_keys + lower_stops - 1 + touch, 'right')
+
+    n_links = np.maximum(last - first, 0)
+    lower_index = np.repeat(np.arange(lower_rows.size), n_links)
+    link_start = np.cumsum(n_links) - n_links
+    upper_index = np.arange(n_links.sum()) - np.repeat(link_start - first, n_links)
+    return upper_index, lower_index
+
+
+def resolve_labels(n_nodes, first, second):
+    """resolve_labels
+
+    Returns the connected component of every node of a graph as the smallest
+    node index in the component, using vectorized union-find: every edge
+    hooks the larger of its two labels to the smaller, then labels are
+    shortened by pointer jumping, until no label changes.
+
+    :param n_nodes: number of nodes
+    :param first: array of node indices of one end of each edge
+    :param second: array of node indices of the other end of each edge
+    """
+    labels = np.arange(n_nodes)
+    if not first.size:
+        return labels
+    while True:
+        first_labels, second_labels = labels[first], labels[second]
+        smaller = np.minimum(first_labels, second_labels)
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, first_labels, smaller)
+        np.minimum.at(new_labels, second_labels, smaller)
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def reduce_runs(runs, run_labels, n_labels, values):
+    """reduce_runs
+
+    Returns the partial feature results of a tile as a dictionary of arrays
+    indexed by label: pixel count, sums of the values and of the pixel
+    columns and rows, maximum value and bounding box in pixels.
+
+    :param runs: (rows, starts, stops) tuple of runs, rows relative to values
+    :param run_labels: label of each run
+    :param n_labels: number of labels
+    :param values: 2d array of the tile's values, measured from the reference
+        level towards the features
+    """
+    rows, starts, stops = runs
+    lengths = stops - starts
+    pixel_labels = np.repeat(run_labels, lengths)
+    # column of every selected pixel, in run order
+    pixel_cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+    pixel_rows = np.repeat(rows, lengths)
+    pixel_values = values[pixel_rows, pixel_cols]
+
+    maximum = np.full(n_labels, -np.inf)
+    np.maximum.at(maximum, pixel_labels, pixel_values)
+    min_col = np.full(n_labels, np.iinfo(np.int64).max)
+    np.minimum.at(min_col, run_labels, starts)
+    max_col = np.full(n_labels, -1)
+    np.maximum.at(max_col, run_labels, stops - 1)
+    min_row = np.full(n_labels, np.iinfo(np.int64).max)
+    np.minimum.at(min_row, run_labels, rows)
+    max_row = np.full(n_labels, -1)
+    np.maximum.at(max_row, run_labels, rows)
+    return {'pixels': np.bincount(run_labels, weights=lengths, minlength=n_labels),
+            'value_sum': np.bincount(pixel_labels, weights=pixel_values, minlength=n_labels),
+            'col_sum': np.bincount(pixel_labels, weights=pixel_cols, minlength=n_labels),
+            'row_sum': np.bincount(pixel_labels, weights=pixel_rows, minlength=n_labels),
+            'maximum': maximum,
+            'min_col': min_col, 'max_col': max_col,
+            'min_row': min_row, 'max_row': max_row}
+
+
+def label_features(values, selected, connectivity=8):
+    """label_features
+
+    Labels the connected features of the selected pixels of a matrix tile by
+    tile and returns their merged partial results (see reduce_runs) with
+    rows counted from the top of the matrix, ordered by their first pixel.
+
+    :param values: 2d float array, measured from the reference level towards
+        the features
+    :param selected: 2d boolean array, True for feature pixels
+    :param connectivity: 8 or 4
+    """
+    log.debug("Entering label_features()")
+    n_rows, n_cols = selected.shape
+    rows_per_tile = max(1, SEGMENT_BLOCK_CELLS // max(n_cols, 1))
+
+    partials = []
+    seam_first, seam_second = [], []
+    n_features = 0
+    previous_last_row = None
+    for start in range(0, n_rows, rows_per_tile):
+        stop = min(start + rows_per_tile, n_rows)
+        runs = find_runs(selected[start:stop])
+        run_labels = resolve_labels(runs[0].size, *link_runs(runs, runs, connectivity))
+        roots, run_labels = np.unique(run_labels, return_inverse=True)
+        partial = reduce_runs(runs, run_labels, roots.size, values[start:stop])
+        partial['min_row'] += start
+        partial['max_row'] += start
+        partial['row_sum'] += start * partial['pixels']
+        partials.append(partial)
+
+        # runs of the first row of this tile against the last row of the
+        # previous tile, which is held as row 0
+        row_breaks = np.searchsorted(runs[0], np.arange(stop - start + 1))
+        first_row = row_breaks[1]
+        if previous_last_row is not None and first_row:
+            previous_runs, previous_labels = previous_last_row
+            first_runs = (np.ones(first_row, dtype=np.intp),
+                          runs[1][:first_row], runs[2][:first_row])
+            up, low = link_runs(previous_runs, first_runs, connectivity)
+            seam_first.append(previous_labels[up])
+            seam_second.append(run_labels[low] + n_features)
+
+        last_row = row_breaks[-2]
+        previous_last_row = ((np.zeros(runs[0].size - last_row, dtype=np.intp),
+                              runs[1][last_row:], runs[2][last_row:]),
+                             run_labels[last_row:] + n_features)
+        n_features += roots.size
+
+    if not partials:
+        partials.append(reduce_runs(find_runs(selected), np.zeros(0, dtype=np.intp), 0, values))
+    merged = {key: np.concatenate([partial[key] for partial in partials])
+              for key in partials[0]}
+    if seam_first:
+        features = resolve_labels(n_features, np.concatenate(seam_first),
+                                  np.concatenate(seam_second))
+        roots, features = np.unique(features, return_inverse=True)
+        merged = merge_partials(merged, features, roots.size)
+
+    log.debug("Exiting label_features() with {} features".format(merged['pixels'].size))
+    return merged
+
+
+def merge_partials(partial, labels, n_labels):
+    """merge_partials
+
+    Combines the partial feature results of features given the same label
+
+    :param partial: dictionary of partial results, see reduce_runs
+    :param labels: new label of each feature
+    :param n_labels: number of new labels
+    """
+    merged = {}
+    for key in ('pixels', 'value_sum', 'col_sum', 'row_sum'):
+        merged[key] = np.bincount(labels, weights=partial[key], minlength=n_labels)
+    for key, function, initial in (('maximum', np.maximum, -np.inf),
+                                   ('min_col', np.minimum, np.iinfo(np.int64).max),
+                                   ('max_col', np.maximum, -1),
+                                   ('min_row', np.minimum, np.iinfo(np.int64).max),
+                                   ('max_row', np.maximum, -1)):
+        merged[key] = np.full(n_labels, initial, dtype=partial[key].dtype)
+        function.at(merged[key], labels, partial[key])
+    return merged
+
+
+def detect_features(vk4_container, polarity='particles', layer='H', threshold=None,
+                    connectivity=8, min_pixels=1):
+    """detect_features
+
+    Detects the particles (pixels above the reference level) or pits (pixels
+    below it) of the leveled height data, or of the light intensity data, of
+    a VkContainer. The reference level is the median of the valid pixels.
+    Returns a dictionary holding the 'threshold' used, the 'reference'
+    level, the 'unit' of the layer's values and the 'features', a list of
+    dictionaries with the keys of feature_fields:
+
+        label - feature number, in order of the feature's first pixel
+        pixels, area_um2 - size of the feature
+        volume_um3 - sum of the feature's height above (particles) or depth
+            below (pits) the reference level times the pixel area, for
+            height data only
+        max_height - largest height above, or depth below, the reference
+            level, in the layer's unit
+        centroid_x_um, centroid_y_um - mean position of the feature's pixels
+        min_x_um, min_y_um, max_x_um, max_y_um - bounding box of the
+            feature's pixel positions
+
+    Positions are those of the pixel centres, with (0, 0) at the first pixel
+    of the data. Returns None if the container lacks the layer.
+
+    :param vk4_container: VkContainer object
+    :param polarity: string - 'particles' or 'pits'
+    :param layer: 'H' for height or 'L' for light intensity data
+    :param threshold: distance from the reference level, in the layer's unit,
+        beyond which pixels belong to features. Defaults to three times the
+        robust standard deviation (1.4826 * median absolute deviation)
+    :param connectivity: 8 to join pixels touching diagonally, otherwise 4
+    :param min_pixels: smallest number of pixels of a reported feature
+    """
+    log.debug("Entering detect_features()\n\tPolarity: {}\tLayer: {}"
+              .format(polarity, layer))
+    attribute, mask_key, unit = segment_layers[layer]
+    layer_dict = getattr(vk4_container, attribute)
+    if layer_dict is None:
+        log.error("In detect_features()\n\tContainer has no {} data".format(mask_key))
+        return None
+
+    if layer == 'H':
+        values = level_height(vk4_container)
+    else:
+        values = vk4layer.layer_matrix(layer_dict).astype(np.float64)
+        valid = vk4_container.valid_masks.get(mask_key)
+        if valid is not None:
+            values[~valid] = np.nan
+
+    finite_values = values[np.isfinite(values)]
+    reference = float(np.median(finite_values)) if finite_values.size else 0.0
+    if threshold is None:
+        threshold = 3.0 * 1.4826 * float(np.median(np.abs(finite_values - reference))) \
+            if finite_values.size else 0.0
+    del finite_values
+
+    # values are measured from the reference level towards the features
+    values -= reference
+    if polarity == 'pits':
+        np.negative(values, out=values)
+    with np.errstate(invalid='ignore'):
+        selected = values > threshold
+
+    partial = label_features(values, selected, connectivity)
+    del values, selected
+
+    x_size, y_size = vk4_container.get_pixel_size()
+    pixel_area = x_size * y_size
+    features = []
+    for index in np.flatnonzero(partial['pixels'] >= min_pixels):
+        pixels = partial['pixels'][index]
+        features.append({'label': len(features) + 1,
+                         'pixels': int(pixels),
+                         'area_um2': float(pixels * pixel_area),
+                         'volume_um3': float(partial['value_sum'][index] * pixel_area)
+                         if layer == 'H' else None,
+                         'max_height': float(partial['maximum'][index]),
+                         'centroid_x_um': float(partial['col_sum'][index] / pixels * x_size),
+                         'centroid_y_um': float(partial['row_sum'][index] / pixels * y_size),
+                         'min_x_um': float(partial['min_col'][index] * x_size),
+                         'min_y_um': float(partial['min_row'][index] * y_size),
+                         'max_x_um': float(partial['max_col'][index] * x_size),
+                         'max_y_um': float(partial['max_row'][index] * y_size)})
+
+    log.debug("Exiting detect_features() with {} features".format(len(features)))
+    return {'polarity': polarity, 'layer': layer, 'unit': unit,
+            'reference': reference, 'threshold': float(threshold), 'features': features}
+
+
+def output_features_csv(result, out_file_name, out_stream=None):
+    """output_features_csv
+
+    Writes the features found by detect_features to a csv file, or
+    out_stream, one row per feature with a header row of the field names
+
+    :param result: dictionary returned by detect_features
+    :param out_file_name: path to the csv file
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_features_csv()")
+    with vk4out.open_text_output(out_file_name, out_stream, newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=feature_fields)
+        writer.writeheader()
+        writer.writerows(result['features'])
+    log.debug("Exiting output_features_csv()")
+
+
+def output_features_json(result, out_file_name, out_stream=None):
+    """output_features_json
+
+    Writes the result of detect_features, the features together with the
+    threshold and reference level, to a json file, or out_stream
+
+    :param result: dictionary returned by detect_features
+    :param out_file_name: path to the json file
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_features_json()")
+    with vk4out.open_text_output(out_file_name, out_stream) as out_file:
+        json.dump(result, out_file, indent=2)
+    log.debug("Exiting output_features_json()")
@@ -0,0 +1,569 @@
+"""vk4server
+
+This module runs the vk4 driver as a long running local HTTP service, so
+that callers converting many files pay the interpreter start up, module
+imports and file decoding once rather than on every call. Decoded
+VkContainers are kept in a least recently used cache keyed by file path,
+size and modification time (or by the SHA-1 of uploaded bytes), and a
+bounded number of requests are worked on at once by the server's threads.
+
+Endpoints
+---------
+    POST /convert   convert a file as the command line would, returning the
+                    path of the output file
+    GET|POST /stats      height and light intensity statistics of a file
+    GET|POST /metadata   header, measurement conditions and layer sizes of a
+                    file, read without decoding any image data
+    GET /metrics    request counts, errors, latency histograms and cache
+                    counters
+
+Parameters are given as a JSON object body or in the query string, using the
+names of the command line options: path, type, layer, output, decimate,
+cutoff, mask, fill and pitch. Instead of a path, the vk4 file itself may be posted
+as an application/octet-stream body, with its parameters in the query
+string and an optional name used for the output file.
+
+Example
+-------
+    $ python3 vk4_driver.py --serve 8040 --workers 4
+    $ curl -d '{"path": "/data/scan.vk4", "type": "tiff", "layer": "H"}' \\
+        localhost:8040/convert
+    $ curl --data-binary @scan.vk4 -H 'Content-Type: application/octet-stream' \\
+        'localhost:8040/stats?name=scan.vk4&mask=1'
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import argparse
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import vk4_driver
+import vk4extract as vk4in
+import vk4filter
+import vk4out
+import vk4resample
+import vk4surface
+import vk4validate
+import VkContainer
+
+log = logging.getLogger('vk4_driver.vk4server')
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# default largest request body in bytes
+MAX_UPLOAD_BYTES = 2 ** 30
+
+
+class RequestError(Exception):
+    """RequestError
+
+    Raised for requests which cannot be served, e.g. missing parameters or
+    invalid files, and returned to the client with a 400 status, or the
+    status given.
+
+    :param message: error message returned to the client
+    :param status: HTTP status of the response
+    """
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class ContainerCache(object):
+    """ContainerCache
+
+    Thread safe least recently used cache of decoded VkContainers. Counts
+    hits, misses, evictions and requests which waited for another request's
+    decode of the same file ('shared') for the metrics endpoint.
+
+    :param capacity: largest number of containers held
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.containers = OrderedDict()
+        # futures of the containers being built, by key
+        self.building = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared = 0
+
+    def get(self, key, build):
+        """get
+
+        Returns the container cached under key, or builds, caches and returns
+        it with build() if it is not cached. Containers are built outside of
+        the lock so other requests are not held up by a slow decode. Requests
+        for a key which is being built wait for that build, and get its
+        container or its exception, rather than decoding the file again.
+
+        :param key: hashable cache key
+        :param build: function taking no arguments returning a VkContainer
+        """
+        with self.lock:
+            if key in self.containers:
+                self.containers.move_to_end(key)
+                self.hits += 1
+                return self.containers[key]
+            future = self.building.get(key)
+            waiting = future is not None
+            if waiting:
+                self.shared += 1
+            else:
+                future = self.building[key] = Future()
+                self.misses += 1
+        if waiting:
+            return future.result()
+
+        try:
+            vk4_container = build()
+        except BaseException as err:
+            with self.lock:
+                del self.building[key]
+            future.set_exception(err)
+            raise
+        with self.lock:
+            del self.building[key]
+            self.containers[key] = vk4_container
+            self.containers.move_to_end(key)
+            while len(self.containers) > self.capacity:
+                self.containers.popitem(last=False)
+                self.evictions += 1
+        future.set_result(vk4_container)
+        return vk4_container
+
+    def snapshot(self):
+        with self.lock:
+            return {'entries': len(self.containers), 'capacity': self.capacity,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'shared': self.shared}
+
+
+class Metrics(object):
+    """Metrics
+
+    Thread safe request counters and latency histograms per endpoint
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = dict()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def observe(self, endpoint, seconds, ok):
+        """observe
+
+        Records a request's latency and whether it succeeded
+
+        :param endpoint: string - endpoint name
+        :param seconds: time taken to serve the request
+        :param ok: False if the request failed
+        """
+        with self.lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = {'requests': 0, 'errors': 0, 'latency_sum_s': 0.0,
+                                            'counts': [0] * (len(LATENCY_BUCKETS) + 1)}
+            record = self.endpoints[endpoint]
+            record['requests'] += 1
+            record['errors'] += 0 if ok else 1
+            record['latency_sum_s'] += seconds
+            record['counts'][int(np.searchsorted(LATENCY_BUCKETS, seconds))] += 1
+
+    def snapshot(self):
+        """snapshot
+
+        Returns the metrics as a dictionary, with cumulative latency
+        histogram counts keyed by bucket upper bound as Prometheus does
+        """
+        with self.lock:
+            endpoints = dict()
+            for endpoint, record in self.endpoints.items():
+                cumulative = np.cumsum(record['counts']).tolist()
+                bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+                endpoints[endpoint] = {'requests': record['requests'],
+                                       'errors': record['errors'],
+                                       'latency_sum_s': record['latency_sum_s'],
+                                       'latency_buckets': dict(zip(bounds, cumulative))}
+            return {'uptime_s': time.time() - self.started, 'in_flight': self.in_flight,
+                    'rejected': self.rejected, 'endpoints': endpoints}
+
+
+class Vk4Server(ThreadingHTTPServer):
+    """Vk4Server
+
+    HTTP server handling each request in its own thread, with at most
+    workers requests being worked on at once. Requests waiting longer than
+    queue_timeout seconds for a free worker are rejected with a 503 status.
+
+    :param address: (host, port) tuple
+    :param workers: number of requests worked on at once
+    :param cache_size: number of decoded containers cached
+    :param queue_timeout: seconds a request may wait for a free worker
+    :param max_upload: largest request body in bytes; larger requests are
+        rejected with a 413 status
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=4, cache_size=8, queue_timeout=30.0,
+                 max_upload=MAX_UPLOAD_BYTES):
+        ThreadingHTTPServer.__init__(self, address, Vk4RequestHandler)
+        self.cache = ContainerCache(cache_size)
+        self.metrics = Metrics()
+        self.work_slots = threading.BoundedSemaphore(workers)
+        self.queue_timeout = queue_timeout
+        self.max_upload = max_upload
+
+
+class Vk4RequestHandler(BaseHTTPRequestHandler):
+    """Vk4RequestHandler
+
+    Dispatches requests to the convert, stats, metadata and metrics
+    endpoints and sends their results as JSON
+    """
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s" % (self.address_string(), format % args))
+
+    def send_json(self, status, result):
+        body = json.dumps(result, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_request(self, parsed):
+        """read_request
+
+        Returns the request parameters and the posted vk4 bytes, or None if
+        the request has no application/octet-stream body. Bodies larger than
+        the server's max_upload are rejected before they are read.
+
+        :param parsed: urllib ParseResult of the request path
+        """
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            raise RequestError("invalid Content-Length")
+        if length > self.server.max_upload:
+            # the unread body would be taken for the next request
+            self.close_connection = True
+            raise RequestError("request body of {} bytes exceeds the limit of {} bytes"
+                               .format(length, self.server.max_upload), 413)
+        body = self.rfile.read(length) if length else None
+        content_type = self.headers.get('Content-Type', '')
+        if body is not None and content_type.startswith('application/octet-stream'):
+            return params, body
+        if body:
+            try:
+                params.update(json.loads(body.decode('utf-8')))
+            except ValueError:
+                raise RequestError("request body is not a JSON object")
+        return params, None
+
+    def handle_request(self):
+        parsed = urlparse(self.path)
+        endpoint = parsed.path.strip('/')
+        server = self.server
+        if endpoint == 'metrics':
+            result = server.metrics.snapshot()
+            result['cache'] = server.cache.snapshot()
+            self.send_json(200, result)
+            return
+        if endpoint not in endpoint_handlers:
+            self.send_json(404, {'error': "unknown endpoint '{}'".format(endpoint)})
+            return
+
+        start = time.perf_counter()
+        if not server.work_slots.acquire(timeout=server.queue_timeout):
+            with server.metrics.lock:
+                server.metrics.rejected += 1
+            self.send_json(503, {'error': "server busy"})
+            return
+        with server.metrics.lock:
+            server.metrics.in_flight += 1
+
+        status = 500
+        try:
+            params, body = self.read_request(parsed)
+            result = endpoint_handlers[endpoint](server, params, body)
+            status = 200
+        except RequestError as err:
+            status, result = err.status, {'error': str(err)}
+        except Exception as err:
+            log.exception("In handle_request()\n\tRequest to {} failed".format(endpoint))
+            result = {'error': repr(err)}
+        finally:
+            with server.metrics.lock:
+                server.metrics.in_flight -= 1
+            server.work_slots.release()
+
+        seconds = time.perf_counter() - start
+        server.metrics.observe(endpoint, seconds, status == 200)
+        result['seconds'] = seconds
+        self.send_json(status, result)
+
+
+def request_args(params):
+    """request_args
+
+    Returns an argparse Namespace like the command line's from request
+    parameters. The output name must be a plain file name, since it is
+    written under the server's out_files folder.
+
+    :param params: dictionary of request parameters
+    """
+    def flag(value):
+        return str(value).lower() in ('1', 'true', 'yes')
+
+    try:
+        args = argparse.Namespace(input=params.get('name'), type=params.get('type'),
+                                  layer=params.get('layer'), output=params.get('output'),
+                                  decimate=int(params.get('decimate', 1)),
+                                  cutoff=float(params['cutoff']) if params.get('cutoff') else None,
+                                  mask=flag(params.get('mask', False)),
+                                  fill=params.get('fill'),
+                                  pitch=vk4resample.parse_pitch(str(params['pitch']))
+                                  if params.get('pitch') else None)
+    except ValueError as err:
+        raise RequestError(str(err))
+    if args.fill not in (None, 'nearest', 'laplacian'):
+        raise RequestError("fill must be nearest or laplacian")
+    if args.output is not None:
+        output = str(args.output)
+        # '-' would write to the server's stdout, anything else with a
+        # directory part could leave out_files
+        if output in ('', '-', '.', '..') or '/' in output or '\\' in output or \
+                os.path.isabs(output):
+            raise RequestError("output must be a plain file name: {}".format(output))
+    return args
+
+
+def open_source(params, body):
+    """open_source
+
+    Returns a cache key, a file name and a function opening the requested
+    vk4 file, which is either the local file given by the 'path' parameter
+    or the posted bytes
+
+    :param params: dictionary of request parameters
+    :param body: posted vk4 bytes or None
+    """
+    if body is not None:
+        digest = hashlib.sha1(body).hexdigest()
+        name = os.path.basename(params.get('name') or 'upload_' + digest[:12] + '.vk4')
+        return ('upload', digest), name, lambda: io.BytesIO(body)
+
+    path = params.get('path')
+    if not path:
+        raise RequestError("a path parameter or an application/octet-stream body is required")
+    path = os.path.realpath(path)
+    try:
+        status = os.stat(path)
+    except OSError as err:
+        raise RequestError("{} cannot be read: {}".format(path, err.strerror))
+    return (path, status.st_size, status.st_mtime_ns), os.path.basename(path), \
+        lambda: open(path, 'rb')
+
+
+def load_container(server, source, builder_class):
+    """load_container
+
+    Returns the VkContainer of a source built with the given builder class,
+    from the server's cache if possible. Files are validated before they
+    are decoded.
+
+    :param server: Vk4Server object
+    :param source: (key, name, opener) tuple from open_source
+    :param builder_class: VkBuilder class deciding which layers to extract
+    """
+    key, name, opener = source
+
+    def build():
+        log.info("Decoding {} with {}".format(name, builder_class.__name__))
+        with opener() as in_file:
+            problems = vk4validate.validate_vk4(in_file)
+            if problems:
+                raise RequestError("invalid file {}: {}".format(name, '; '.join(problems)))
+            return VkContainer.VkDirector(builder_class(in_file)).build()
+
+    return server.cache.get(key + (builder_class.__name__,), build)
+
+
+def working_copy(vk4_container, args):
+    """working_copy
+
+    Returns a shallow copy of a cached VkContainer with its own derived
+    layers and masks, which the request may change without affecting the
+    cache, with its invalid pixels masked or filled and its layers
+    resampled as requested. Layers which are filled are copied first.
+
+    :param vk4_container: VkContainer object
+    :param args: argparse Namespace from request_args
+    """
+    working = copy.copy(vk4_container)
+    working.derived_data = dict()
+    working.valid_masks = dict()
+    if args.fill is not None:
+        for attribute in ('height_data', 'light_intensity_data'):
+            layer = getattr(working, attribute)
+            if layer is not None:
+                layer = layer.copy()
+                layer['data'] = layer['data'].copy()
+                setattr(working, attribute, layer)
+    vk4_driver.prepare_container(working, args)
+    return working
+
+
+def convert_request(server, params, body):
+    """convert_request
+
+    Converts a vk4 file as the command line would and returns the path of
+    the output file
+
+    :param server: Vk4Server object
+    :param params: dictionary of request parameters
+    :param body: posted vk4 bytes or None
+    """
+    source = open_source(params, body)
+    args = request_args(params)
+    args.input = source[1]
+    if args.type is None or args.layer is None:
+        raise RequestError("type and layer parameters are required")
+    try:
+        builder_class = vk4_driver.select_builder(args)
+    except ValueError as err:
+        raise RequestError(str(err))
+
+    vk4_container = working_copy(load_container(server, source, builder_class), args)
+    if args.layer in ('waviness', 'roughness'):
+        vk4filter.filter_container(vk4_container, args.cutoff)
+    elif args.layer in vk4surface.surface_maps:
+        vk4surface.surface_container(vk4_container, (args.layer,))
+    out_file_name = vk4out.output_data(vk4_container, args)
+    if out_file_name is None:
+        raise RequestError("no output was written, see the server log")
+    return {'output': os.path.abspath(out_file_name)}
+
+
+def layer_statistics(values):
+    """layer_statistics
+
+    Returns the minimum, maximum, mean and standard deviation of the finite
+    values of an array and the fraction of values which are finite
+
+    :param values: numpy array
+    """
+    finite = values[np.isfinite(values)]
+    if not finite.size:
+        return {'valid_fraction': 0.0}
+    return {'min': float(finite.min()), 'max': float(finite.max()),
+            'mean': float(finite.mean()), 'std': float(finite.std()),
+            'valid_fraction': finite.size / float(values.size)}
+
+
+def stats_request(server, params, body):
+    """stats_request
+
+    Returns the image size, pixel size and the statistics of the calibrated
+    height (in micrometers) and raw light intensity data of a vk4 file,
+    decoded once into a container holding both layers
+
+    :param server: Vk4Server object
+    :param params: dictionary of request parameters
+    :param body: posted vk4 bytes or None
+    """
+    source = open_source(params, body)
+    args = request_args(params)
+    vk4_container = working_copy(load_container(server, source,
+                                                VkContainer.Vk4BuilderHeightLight), args)
+
+    light_values = vk4_container.light_intensity_data['data'].astype(np.float64)
+    if 'light' in vk4_container.valid_masks:
+        light_values[~np.ravel(vk4_container.valid_masks['light'])] = np.nan
+    return {'title': vk4_container.string_data['title'],
+            'width': vk4_container.image_width,
+            'height': vk4_container.image_height,
+            'pixel_size_um': list(vk4_container.get_pixel_size()),
+            'height_um': layer_statistics(vk4_container.get_calibrated_height()),
+            'light': layer_statistics(light_values)}
+
+
+def metadata_request(server, params, body):
+    """metadata_request
+
+    Returns the header, offsets, measurement conditions, string data and
+    layer sizes of a vk4 file, read without decoding any image data
+
+    :param server: Vk4Server object
+    :param params: dictionary of request parameters
+    :param body: posted vk4 bytes or None
+    """
+    key, name, opener = open_source(params, body)
+    with opener() as in_file:
+        problems = vk4validate.validate_vk4(in_file)
+        if problems:
+            raise RequestError("invalid file {}: {}".format(name, '; '.join(problems)))
+        return vk4in.extract_metadata(in_file)
+
+
+endpoint_handlers = {'convert': convert_request,
+                     'stats': stats_request,
+                     'metadata': metadata_request}
+
+
+def serve(host, port, workers=4, cache_size=8, queue_timeout=30.0, max_upload=MAX_UPLOAD_BYTES):
+    """serve
+
+    Runs a Vk4Server until interrupted
+
+    :param host: host name or address to listen on
+    :param port: port to listen on
+    :param workers: number of requests worked on at once
+    :param cache_size: number of decoded containers cached
+    :param queue_timeout: seconds a request may wait for a free worker
+    :param max_upload: largest request body in bytes
+    """
+    server = Vk4Server((host, port), workers, cache_size, queue_timeout, max_upload)
+    log.info("Serving on {}:{} with {} workers".format(host, server.server_address[1], workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Shutting down server")
+    finally:
+        server.server_close()
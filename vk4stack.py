@@ -0,0 +1,293 @@
+"""vk4stack
+
+This module stacks the height or light intensity data of many vk4 files
+taken with the same geometry, e.g. repeated scans of one part for a
+repeatability study or a time series of a wearing surface. The files must
+agree in image size, pixel size, z resolution, lens magnification and
+optical zoom; a batch with any mismatch is rejected before anything is
+written.
+
+The layer of each file is memory mapped and copied, in tiles of rows and in
+parallel threads, into one (files, height, width) float32 array stored as an
+npy file and memory mapped itself. Height data is calibrated to
+micrometers; with mask, invalid pixels (0 or saturated) are NaN.
+
+The per-pixel mean, standard deviation, minimum and maximum over the stack
+are reduced tile by tile, and within a tile over chunks of files whose
+partial results are merged, so neither the stack nor a full-height slab of
+it has to fit in memory.
+
+Example
+-------
+    stack = vk4stack.build_stack(file_names, 'repeat.npy', layer='H', mask=True)
+    statistics = vk4stack.stack_statistics(stack)
+    vk4stack.output_statistics(statistics, 'repeat_stats.npz')
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import contextlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import vk4extract as vk4in
+import vk4mask
+import vk4out
+import vk4progress
+
+log = logging.getLogger('vk4_driver.vk4stack')
+
+# number of stack cells read or written at once
+STACK_BLOCK_CELLS = 2 ** 22
+
+# type of data of the height and light layers
+layer_types = {'H': 'height', 'L': 'light'}
+
+# measurement conditions which must match across the stack, for each layer
+stack_conditions = {'H': ('x_length_per_pixel', 'y_length_per_pixel', 'z_length_per_digit',
+                          'lens_magnification', 'optical_zoom'),
+                    'L': ('x_length_per_pixel', 'y_length_per_pixel',
+                          'lens_magnification', 'optical_zoom')}
+
+# per-pixel reductions of stack_statistics
+stack_reductions = ('mean', 'std', 'min', 'max', 'count')
+
+
+def read_geometry(file_name, layer='H'):
+    """read_geometry
+
+    Returns the width and height of a layer of a vk4 file together with the
+    measurement conditions in stack_conditions as a dictionary, or None if
+    the file has no such layer
+
+    :param file_name: path to the vk4 file
+    :param layer: string - 'H' for height or 'L' for light data
+    """
+    d_type = layer_types[layer]
+    with open(file_name, 'rb') as in_file:
+        offsets = vk4in.extract_offsets(in_file)
+        conditions = vk4in.extract_measurement_conditions(offsets, in_file)
+        headers = vk4in.extract_layer_headers(offsets, in_file)
+    if d_type not in headers:
+        return None
+    geometry = {'width': headers[d_type]['width'], 'height': headers[d_type]['height']}
+    for key in stack_conditions[layer]:
+        geometry[key] = conditions[key]
+    return geometry
+
+
+def stack_geometry(file_names, layer='H'):
+    """stack_geometry
+
+    Checks that the layer of every file has the geometry of the first file
+    and returns that geometry. Logs every mismatch and returns None if any
+    file differs or lacks the layer.
+
+    :param file_names: list of paths to vk4 files
+    :param layer: string - 'H' for height or 'L' for light data
+    """
+    log.debug("Entering stack_geometry()\n\tFiles: {}".format(len(file_names)))
+    geometry = None
+    matching = True
+    for file_name in file_names:
+        file_geometry = read_geometry(file_name, layer)
+        if file_geometry is None:
+            log.error("In stack_geometry()\n\t{} has no {} data"
+                      .format(file_name, layer_types[layer]))
+            matching = False
+        elif geometry is None:
+            geometry = file_geometry
+        else:
+            differences = ['{} {} != {}'.format(key, file_geometry[key], geometry[key])
+                           for key in geometry if file_geometry[key] != geometry[key]]
+            if differences:
+                log.error("In stack_geometry()\n\t{} does not match {}\n\t{}"
+                          .format(file_name, file_names[0], '\n\t'.join(differences)))
+                matching = False
+
+    log.debug("Exiting stack_geometry()")
+    return geometry if matching else None
+
+
+def copy_layer(stack, index, file_name, layer='H', mask=False):
+    """copy_layer
+
+    Copies the memory mapped layer of a vk4 file into one frame of a stack
+    in tiles of rows, calibrating height data to micrometers and, with mask,
+    writing invalid pixels as NaN
+
+    :param stack: (files, height, width) float32 array or memory map
+    :param index: index of the frame in the stack
+    :param file_name: path to the vk4 file
+    :param layer: string - 'H' for height or 'L' for light data
+    :param mask: if True invalid pixels are NaN
+    """
+    d_type = layer_types[layer]
+    with open(file_name, 'rb') as in_file:
+        offsets = vk4in.extract_offsets(in_file)
+        conditions = vk4in.extract_measurement_conditions(offsets, in_file)
+    layer_data = vk4in.map_img_data(offsets, d_type, file_name)
+    matrix = layer_data.matrix
+    scale = conditions['z_length_per_digit'] / 1.0e6 if layer == 'H' else 1.0
+    saturated = vk4mask.saturation_value(layer_data['bit_depth'],
+                                         conditions[vk4mask.mask_layers[d_type][1]])
+
+    n_rows, n_cols = matrix.shape
+    rows_per_tile = max(1, STACK_BLOCK_CELLS // max(n_cols, 1))
+    for start in range(0, n_rows, rows_per_tile):
+        stop = min(start + rows_per_tile, n_rows)
+        block = np.asarray(matrix[start:stop])
+        values = np.multiply(block, scale, dtype=np.float64)
+        if mask:
+            values[(block == 0) | (block >= saturated)] = np.nan
+        stack[index, start:stop] = values
+    del matrix, layer_data
+
+
+def build_stack(file_names, out_file_name, layer='H', workers=None, mask=False):
+    """build_stack
+
+    Stacks the height (in micrometers) or light data of vk4 files of matching
+    geometry into a (files, height, width) float32 npy file, copying the
+    files in parallel threads. The stack is written to a temporary file
+    which is only renamed to out_file_name once complete. Returns the stack
+    memory mapped read only, or None if the geometries do not match.
+
+    :param file_names: list of paths to vk4 files
+    :param out_file_name: path to the npy file
+    :param layer: string - 'H' for height or 'L' for light data
+    :param workers: number of threads, defaults to the number of CPUs
+    :param mask: if True invalid pixels are NaN
+    """
+    log.debug("Entering build_stack()\n\tFiles: {}".format(len(file_names)))
+    geometry = stack_geometry(file_names, layer)
+    if geometry is None:
+        log.error("In build_stack()\n\tThe files do not have matching geometry")
+        return None
+    workers = workers or os.cpu_count() or 1
+    shape = (len(file_names), geometry['height'], geometry['width'])
+
+    vk4progress.begin('files', len(file_names))
+    temp_name = '{}.{}-{}.part'.format(out_file_name, os.getpid(), threading.get_ident())
+    try:
+        stack = np.lib.format.open_memmap(temp_name, mode='w+', dtype=np.float32,
+                                          shape=shape)
+        # each thread writes its own frames, so the threads need no lock
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(copy_layer, stack, index, file_name, layer, mask)
+                       for index, file_name in enumerate(file_names)]
+            try:
+                for future in futures:
+                    future.result()
+                    vk4progress.advance('files', 1)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        stack.flush()
+        del stack
+        os.replace(temp_name, out_file_name)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_name)
+        raise
+
+    log.debug("Exiting build_stack()")
+    return np.load(out_file_name, mmap_mode='r')
+
+
+def stack_statistics(stack, block_cells=STACK_BLOCK_CELLS):
+    """stack_statistics
+
+    Returns the per-pixel mean, sample standard deviation, minimum and
+    maximum over the frames of a stack, ignoring NaN, as (height, width)
+    float32 arrays, and the number of non NaN values as an int32 array,
+    keyed by the names in stack_reductions. Pixels without values are NaN,
+    the standard deviation also where there is a single value.
+
+    The stack is read in tiles of rows, and each tile in chunks of frames,
+    of about block_cells cells; the count, mean and sum of squared
+    deviations of each chunk are merged into those of the tile (Chan et
+    al.'s pairwise update), so the result does not depend on the chunking.
+
+    :param stack: (files, height, width) array or memory map
+    :param block_cells: number of cells read at once
+    """
+    log.debug("Entering stack_statistics()")
+    n_frames, n_rows, n_cols = stack.shape
+    statistics = {name: np.full((n_rows, n_cols), np.nan, dtype=np.float32)
+                  for name in stack_reductions[:-1]}
+    statistics['count'] = np.zeros((n_rows, n_cols), dtype=np.int32)
+    rows_per_tile = max(1, block_cells // max(n_frames * n_cols, 1))
+    frames_per_chunk = max(1, block_cells // max(rows_per_tile * n_cols, 1))
+    vk4progress.begin('write', n_rows)
+
+    for start in range(0, n_rows, rows_per_tile):
+        stop = min(start + rows_per_tile, n_rows)
+        tile_shape = (stop - start, n_cols)
+        count = np.zeros(tile_shape)
+        mean = np.zeros(tile_shape)
+        squares = np.zeros(tile_shape)
+        low = np.full(tile_shape, np.inf)
+        high = np.full(tile_shape, -np.inf)
+        for first in range(0, n_frames, frames_per_chunk):
+            chunk = np.asarray(stack[first:first + frames_per_chunk, start:stop],
+                               dtype=np.float64)
+            valid = ~np.isnan(chunk)
+            chunk_count = valid.sum(axis=0)
+            chunk_mean = np.where(valid, chunk, 0.0).sum(axis=0) / np.maximum(chunk_count, 1)
+            chunk_squares = (np.where(valid, chunk - chunk_mean, 0.0) ** 2).sum(axis=0)
+            total = count + chunk_count
+            delta = chunk_mean - mean
+            weight = chunk_count / np.maximum(total, 1)
+            squares += chunk_squares + delta ** 2 * count * weight
+            mean += delta * weight
+            count = total
+            # fmin and fmax skip NaN unless all values are NaN
+            np.fmin(low, np.fmin.reduce(chunk, axis=0), out=low)
+            np.fmax(high, np.fmax.reduce(chunk, axis=0), out=high)
+
+        has_values = count > 0
+        spread = count > 1
+        statistics['count'][start:stop] = count
+        statistics['mean'][start:stop][has_values] = mean[has_values]
+        statistics['min'][start:stop][has_values] = low[has_values]
+        statistics['max'][start:stop][has_values] = high[has_values]
+        statistics['std'][start:stop][spread] = np.sqrt(squares[spread] / (count[spread] - 1))
+        vk4progress.advance('write', stop - start)
+
+    log.debug("Exiting stack_statistics()")
+    return statistics
+
+
+def output_statistics(statistics, out_file_name, out_stream=None):
+    """output_statistics
+
+    Writes the per-pixel statistics of a stack as an npz file with one
+    (height, width) array per reduction. Returns the name of the file
+    written, or '-' if written to out_stream.
+
+    :param statistics: dictionary from stack_statistics
+    :param out_file_name: path to the npz file
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering output_statistics()")
+    with vk4out.open_output(out_file_name, out_stream) as out_file:
+        np.savez(out_file, **statistics)
+
+    log.debug("Exiting output_statistics()")
+    return '-' if out_stream is not None else out_file_name
@@ -0,0 +1,286 @@
+"""vk4subset
+
+This module writes a smaller vk4 file holding a subset of the layers of
+another, optionally cropped to a window of pixels, for sending a region of
+interest to a partner or archiving only the layers that matter. The file
+follows the layout of VK4layout.pdf: the header, the offset table, the
+measurement conditions, the kept RGB, RGB + light, light and height layers,
+their thumbnails, the assembly, line and string sections. It can be read by
+vk4extract and passes vk4validate.
+
+The layers are copied straight from the memory mapped input file in blocks
+of rows: an uncropped layer is copied as whole blocks of bytes, a cropped one
+as the window's bytes of each row, without decoding the values. The
+thumbnails of the kept layers are regenerated from the (cropped) layers,
+sampled to fit the size of the input's thumbnails; light and height
+thumbnails are drawn with the layer's palette over its range of values.
+Sections whose contents are not decoded (the unread part of the measurement
+conditions, assembly information, line measurements and the strings) are
+copied unchanged. The measurement conditions keep the pixel sizes, which a
+crop does not change, and mark the color image as omitted if no RGB layer is
+kept.
+
+Example
+-------
+    vk4subset.write_subset('scan.vk4', 'weld_toe.vk4', layers=('height', 'light'),
+                           crop=(200, 100, 512, 384))
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import os
+import struct
+import numpy as np
+import vk4out
+import vk4progress
+import vk4validate
+
+log = logging.getLogger('vk4_driver.vk4subset')
+
+# bytes copied at once from sections which are not decoded
+COPY_CHUNK_BYTES = 2 ** 24
+
+# entries of the offset table at byte 12, including the second and third
+# light and height layers which extract_offsets skips
+table_keys = ('meas_conds', 'color_peak', 'color_light', 'light', 'light_2', 'light_3',
+              'height', 'height_2', 'height_3', 'clr_peak_thumb', 'clr_thumb',
+              'light_thumb', 'height_thumb', 'assembly_info', 'line_measure',
+              'line_thickness', 'string_data', 'reserved')
+
+# layer names of the -l argument for each offset key, in file order
+subset_layers = {'RGB': 'color_peak', 'LRGB': 'color_light', 'L': 'light', 'H': 'height'}
+
+# thumbnail offset key of each layer
+thumbnail_keys = {'color_peak': 'clr_peak_thumb', 'color_light': 'clr_thumb',
+                  'light': 'light_thumb', 'height': 'height_thumb'}
+
+# sections copied unchanged, in file order
+copied_sections = ('assembly_info', 'line_measure', 'line_thickness', 'string_data')
+
+# byte offset within the measurement conditions of the color image flag
+OMIT_COLOR_IMG_OFFSET = 236
+
+# thumbnail size if the input has no thumbnail to take it from
+THUMBNAIL_SIZE = (196, 147)
+
+
+def parse_crop(text):
+    """parse_crop
+
+    Returns the crop window (x, y, width, height) in pixels from 'X,Y,W,H'.
+    Raises ValueError if it is not four integers with a positive size.
+
+    :param text: string - left column, top row, width and height
+    """
+    try:
+        window = tuple(int(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError("crop window must be integers: {}".format(text))
+    if len(window) != 4 or min(window[:2]) < 0 or min(window[2:]) <= 0:
+        raise ValueError("crop window must be X,Y,W,H with a positive size: {}".format(text))
+    return window
+
+
+def section_sizes(offsets, file_size):
+    # bytes of each section up to the next section, or the end of the file
+    starts = sorted(set(offset for offset in offsets.values() if offset))
+    ends = dict(zip(starts, starts[1:] + [file_size]))
+    return {key: ends[offset] - offset for key, offset in offsets.items() if offset}
+
+
+def copy_bytes(in_file, out_file, offset, size):
+    # copies a section of the input file in chunks
+    in_file.seek(offset)
+    while size > 0:
+        chunk = in_file.read(min(size, COPY_CHUNK_BYTES))
+        if not chunk:
+            raise EOFError("vk4 file ended {} bytes before the end of a section".format(size))
+        out_file.write(chunk)
+        size -= len(chunk)
+
+
+def layer_window(file_name, offset, header, header_size, crop):
+    """layer_window
+
+    Returns the (height, width, bytes per pixel) uint8 memory map of the
+    crop window of a layer of a vk4 file
+
+    :param file_name: path to the vk4 file
+    :param offset: offset of the layer
+    :param header: dictionary of the layer's width, height and bit_depth
+    :param header_size: bytes of the layer header, including any palette
+    :param crop: tuple - x, y, width and height of the window
+    """
+    pixel_bytes = header['bit_depth'] // 8
+    matrix = np.memmap(file_name, dtype=np.uint8, mode='r', offset=offset + header_size,
+                       shape=(header['height'], header['width'], pixel_bytes))
+    x, y, width, height = crop
+    return matrix[y:y + height, x:x + width]
+
+
+def render_thumbnail(window, header, size, palette=None):
+    """render_thumbnail
+
+    Returns the bytes of a thumbnail section, a 24 bit RGB image fitting
+    size sampled from a layer window. Color layers are sampled as stored;
+    light and height values are mapped through the layer's palette over the
+    range of the sampled non-zero values.
+
+    :param window: (height, width, bytes per pixel) uint8 array or memmap
+    :param header: dictionary of the layer's bit_depth
+    :param size: tuple - largest width and height of the thumbnail
+    :param palette: 768 byte palette of light and height layers, or None
+    """
+    height, width = window.shape[:2]
+    scale = min(size[0] / width, size[1] / height)
+    thumb_width = max(1, int(round(width * scale)))
+    thumb_height = max(1, int(round(height * scale)))
+    rows = ((np.arange(thumb_height) + 0.5) * height / thumb_height).astype(np.intp)
+    columns = ((np.arange(thumb_width) + 0.5) * width / thumb_width).astype(np.intp)
+    # only the sampled rows are read from the memory map
+    sample = np.asarray(window[rows])[:, columns]
+
+    if palette is None:
+        rgb = sample[..., :3]
+    else:
+        values = np.ascontiguousarray(sample).view('<u{}'.format(header['bit_depth'] // 8))
+        values = values[..., 0].astype(np.float64)
+        nonzero = values[values > 0]
+        low, high = (nonzero.min(), nonzero.max()) if nonzero.size else (0.0, 1.0)
+        index = np.clip((values - low) * 255.0 / max(high - low, 1.0), 0, 255)
+        rgb = np.frombuffer(palette, dtype=np.uint8).reshape(-1, 3)[index.astype(np.intp)]
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    return struct.pack('<5I', thumb_width, thumb_height, 24, 0, rgb.nbytes) + rgb.tobytes()
+
+
+def write_subset(in_file_name, out_file_name, layers=None, crop=None, out_stream=None):
+    """write_subset
+
+    Writes a vk4 file holding the given layers of a vk4 file, cropped to a
+    window if crop is given, with thumbnails regenerated for the kept
+    layers. The file is written atomically (see vk4out.open_output).
+    Returns the name of the file written, '-' if written to out_stream, or
+    None if a layer is missing or the crop window does not fit.
+
+    :param in_file_name: path to the input vk4 file
+    :param out_file_name: path to the output vk4 file
+    :param layers: offset keys of the layers to keep ('color_peak',
+        'color_light', 'light', 'height'), defaults to all present
+    :param crop: tuple - x, y, width and height of the window in pixels, or
+        None for the whole image
+    :param out_stream: optional writable binary stream
+    """
+    log.debug("Entering write_subset()\n\tLayers: {}\n\tCrop: {}".format(layers, crop))
+    file_size = os.path.getsize(in_file_name)
+    with open(in_file_name, 'rb') as in_file:
+        header_bytes = in_file.read(12)
+        offsets = dict(zip(table_keys, struct.unpack('<18I', in_file.read(72))))
+        sizes = section_sizes(offsets, file_size)
+        headers = dict()
+        for key in subset_layers.values():
+            if offsets[key]:
+                in_file.seek(offsets[key])
+                fields = struct.unpack('<7I', in_file.read(28))
+                headers[key] = dict(zip(('width', 'height', 'bit_depth', 'compression',
+                                         'data_byte_size', 'palette_range_min',
+                                         'palette_range_max'), fields))
+                headers[key]['palette'] = in_file.read(768)
+        thumbnail_size = THUMBNAIL_SIZE
+        for key in thumbnail_keys.values():
+            if offsets[key]:
+                in_file.seek(offsets[key])
+                thumbnail_size = struct.unpack('<2I', in_file.read(8))
+                break
+        in_file.seek(offsets['meas_conds'])
+        conditions = bytearray(in_file.read(sizes['meas_conds']))
+
+    layers = [key for key in subset_layers.values()
+              if key in (headers if layers is None else layers)]
+    missing = [key for key in layers if key not in headers]
+    if missing or not layers:
+        log.error("In write_subset()\n\t{} has no {} layer".format(
+            in_file_name, ', '.join(missing) or 'requested'))
+        return None
+    windows = dict()
+    for key in layers:
+        window = crop or (0, 0, headers[key]['width'], headers[key]['height'])
+        if window[0] + window[2] > headers[key]['width'] or \
+                window[1] + window[3] > headers[key]['height']:
+            log.error("In write_subset()\n\tCrop window {} does not fit the {}x{} {} layer"
+                      .format(window, headers[key]['width'], headers[key]['height'], key))
+            return None
+        windows[key] = window
+    if not any(key in layers for key in ('color_peak', 'color_light')):
+        struct.pack_into('<I', conditions, OMIT_COLOR_IMG_OFFSET, 1)
+
+    # sections in file order with their sizes, so the offset table can be
+    # written first
+    thumbnails = dict()
+    for key in layers:
+        header_size = vk4validate.layer_layout[key][0]
+        window = layer_window(in_file_name, offsets[key], headers[key], header_size,
+                              windows[key])
+        palette = headers[key]['palette'] if header_size > 20 else None
+        thumbnails[thumbnail_keys[key]] = render_thumbnail(window, headers[key],
+                                                           thumbnail_size, palette)
+    new_sizes = {'meas_conds': len(conditions)}
+    for key in layers:
+        window = windows[key]
+        new_sizes[key] = vk4validate.layer_layout[key][0] + \
+            window[2] * window[3] * headers[key]['bit_depth'] // 8
+    for key, thumbnail in thumbnails.items():
+        new_sizes[key] = len(thumbnail)
+    for key in copied_sections:
+        if offsets[key]:
+            new_sizes[key] = sizes[key]
+    new_offsets = dict.fromkeys(table_keys, 0)
+    position = 12 + 72
+    for key in table_keys:
+        if key in new_sizes:
+            new_offsets[key] = position
+            position += new_sizes[key]
+
+    vk4progress.begin('write', sum(windows[key][3] for key in layers))
+    with vk4out.open_output(out_file_name, out_stream) as out_file, \
+            open(in_file_name, 'rb') as in_file:
+        out_file.write(header_bytes)
+        out_file.write(struct.pack('<18I', *(new_offsets[key] for key in table_keys)))
+        out_file.write(conditions)
+        for key in layers:
+            header = headers[key]
+            header_size = vk4validate.layer_layout[key][0]
+            window = layer_window(in_file_name, offsets[key], header, header_size,
+                                  windows[key])
+            height, width, pixel_bytes = window.shape
+            out_file.write(struct.pack('<5I', width, height, header['bit_depth'],
+                                       header['compression'], width * height * pixel_bytes))
+            if header_size > 20:
+                out_file.write(struct.pack('<2I', header['palette_range_min'],
+                                           header['palette_range_max']))
+                out_file.write(header['palette'])
+            # uncropped rows are contiguous and written without a copy
+            for start, stop in vk4out.row_blocks(height, width * pixel_bytes):
+                out_file.write(memoryview(np.ascontiguousarray(window[start:stop])).cast('B'))
+            del window
+        for key in table_keys:
+            if key in thumbnails:
+                out_file.write(thumbnails[key])
+        for key in copied_sections:
+            if offsets[key]:
+                copy_bytes(in_file, out_file, offsets[key], sizes[key])
+
+    log.debug("Exiting write_subset()\n\t{} bytes".format(position))
+    return '-' if out_stream is not None else out_file_name
@@ -0,0 +1,228 @@
+"""vk4summary
+
+This module summarizes a batch of vk4 files for quality control. Each file
+is decoded on its own, in parallel worker processes, and reduced to a small
+summary: image and pixel size, the coverage of valid height pixels, the
+height range, the fraction of saturated light pixels, a light intensity
+histogram and key measurement conditions. No per-file output is written.
+
+The summaries are mergeable partial results: the batch totals are formed by
+adding pixel counts and histograms and taking the extremes of the height
+ranges, so they do not depend on the order in which the workers finish.
+The report is written as a csv file with one row per file and as a json file
+holding the rows, the batch totals and the combined light histogram.
+
+Example
+-------
+    summaries, combined = vk4summary.summarize_files(file_names, workers=8)
+    vk4summary.write_report('shift_report', summaries, combined)
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import csv
+import json
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import vk4mask
+import vk4out
+import vk4progress
+import vk4validate
+import VkContainer
+
+log = logging.getLogger('vk4_driver.vk4summary')
+
+# number of light intensity histogram bins over the 16 bit range
+LIGHT_HISTOGRAM_BINS = 256
+
+# measurement conditions copied into each summary
+summary_conditions = ('lens_magnification', 'optical_zoom', 'x_length_per_pixel',
+                      'y_length_per_pixel', 'z_length_per_digit', 'PMT_gain',
+                      'ND_filter', 'num_aperture', 'light_effective_bit_depth',
+                      'height_effective_bit_depth')
+
+# summary fields in csv column order
+summary_fields = ('file', 'title', 'date', 'width', 'height', 'pixel_size_x_um',
+                  'pixel_size_y_um', 'valid_fraction', 'height_min_um', 'height_max_um',
+                  'height_range_um', 'height_mean_um', 'light_saturated_fraction',
+                  'light_mean') + summary_conditions + ('problems',)
+
+
+def summarize_container(vk4_container):
+    """summarize_container
+
+    Returns the summary of a VkContainer with height and light data as a
+    dictionary with the keys of summary_fields (apart from file and
+    problems) plus 'light_histogram', a list of LIGHT_HISTOGRAM_BINS counts
+    over the 16 bit light intensity range, and the pixel counts 'pixels',
+    'valid_pixels' and 'saturated_pixels' used to merge summaries.
+
+    :param vk4_container: VkContainer object with height and light data
+    """
+    conditions = vk4_container.measurement_conditions
+    summary = {'title': vk4_container.string_data['title'],
+               'date': '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+                   conditions['year'], conditions['month'], conditions['day'],
+                   conditions['hour'], conditions['minute'], conditions['second']),
+               'width': vk4_container.image_width,
+               'height': vk4_container.image_height}
+    summary['pixel_size_x_um'], summary['pixel_size_y_um'] = vk4_container.get_pixel_size()
+    for key in summary_conditions:
+        summary[key] = conditions[key]
+
+    # invalid height pixels are 0 or saturated
+    vk4_container.valid_masks['height'] = vk4mask.find_valid_pixels(vk4_container, 'height')
+    height_matrix = vk4_container.get_calibrated_height()
+    valid_heights = height_matrix[np.isfinite(height_matrix)]
+    summary['pixels'] = int(height_matrix.size)
+    summary['valid_pixels'] = int(valid_heights.size)
+    summary['valid_fraction'] = valid_heights.size / float(max(height_matrix.size, 1))
+    if valid_heights.size:
+        summary['height_min_um'] = float(valid_heights.min())
+        summary['height_max_um'] = float(valid_heights.max())
+        summary['height_range_um'] = summary['height_max_um'] - summary['height_min_um']
+        summary['height_mean_um'] = float(valid_heights.mean())
+    del height_matrix, valid_heights
+
+    light = vk4_container.light_intensity_data['data']
+    light_valid = vk4mask.find_valid_pixels(vk4_container, 'light')
+    summary['saturated_pixels'] = int(np.count_nonzero(np.ravel(~light_valid) & (light != 0)))
+    summary['light_saturated_fraction'] = summary['saturated_pixels'] / float(max(light.size, 1))
+    summary['light_mean'] = float(light.mean()) if light.size else None
+    bin_width = 2 ** 16 // LIGHT_HISTOGRAM_BINS
+    summary['light_histogram'] = np.bincount(light // bin_width,
+                                             minlength=LIGHT_HISTOGRAM_BINS).tolist()
+    return summary
+
+
+def summarize_file(file_name):
+    """summarize_file
+
+    Validates, decodes and summarizes a single vk4 file. Returns the summary
+    dictionary (see summarize_container) with the file name, or, for an
+    invalid file, a dictionary holding the file name and its problems.
+
+    :param file_name: path to the vk4 file
+    """
+    problems = vk4validate.validate_file(file_name)
+    if problems:
+        return {'file': file_name, 'problems': '; '.join(problems)}
+    try:
+        with open(file_name, 'rb') as in_file:
+            director = VkContainer.VkDirector(VkContainer.Vk4BuilderHeightLight(in_file))
+            vk4_container = director.build()
+        summary = summarize_container(vk4_container)
+    except (OSError, EOFError, KeyError, ValueError, struct.error) as err:
+        # a file which passes validation may still fail to decode
+        return {'file': file_name, 'problems': str(err)}
+    summary['file'] = file_name
+    summary['problems'] = ''
+    return summary
+
+
+def merge_summaries(summaries):
+    """merge_summaries
+
+    Reduces file summaries, or previously merged summaries, into a single
+    dictionary of batch totals: numbers of files and invalid files, pixel
+    counts, overall valid and saturated fractions, the lowest and highest
+    height and the combined light histogram.
+
+    :param summaries: list of dictionaries from summarize_file or
+        merge_summaries
+    """
+    combined = {'files': 0, 'invalid_files': 0, 'pixels': 0, 'valid_pixels': 0,
+                'saturated_pixels': 0, 'height_min_um': None, 'height_max_um': None,
+                'light_histogram': [0] * LIGHT_HISTOGRAM_BINS}
+    for summary in summaries:
+        if 'files' in summary:  # already merged
+            combined['files'] += summary['files']
+            combined['invalid_files'] += summary['invalid_files']
+        else:
+            combined['files'] += 1
+            if summary.get('problems'):
+                combined['invalid_files'] += 1
+                continue
+        for key in ('pixels', 'valid_pixels', 'saturated_pixels'):
+            combined[key] += summary[key]
+        for key, function in (('height_min_um', min), ('height_max_um', max)):
+            if summary.get(key) is not None:
+                combined[key] = summary[key] if combined[key] is None \
+                    else function(combined[key], summary[key])
+        combined['light_histogram'] = (np.array(combined['light_histogram']) +
+                                       summary['light_histogram']).tolist()
+
+    pixels = float(max(combined['pixels'], 1))
+    combined['valid_fraction'] = combined['valid_pixels'] / pixels
+    combined['light_saturated_fraction'] = combined['saturated_pixels'] / pixels
+    return combined
+
+
+def summarize_files(file_names, workers=None):
+    """summarize_files
+
+    Summarizes vk4 files in parallel worker processes and merges their
+    summaries. Returns the list of file summaries, in the order of
+    file_names, and the merged batch totals.
+
+    :param file_names: list of paths to vk4 files
+    :param workers: number of worker processes, defaults to the number of CPUs
+    """
+    log.debug("Entering summarize_files()\n\tFiles: {}".format(len(file_names)))
+    workers = workers or os.cpu_count() or 1
+    vk4progress.begin('files', len(file_names))
+    summaries = []
+    if workers == 1 or len(file_names) < 2:
+        for file_name in file_names:
+            summaries.append(summarize_file(file_name))
+            vk4progress.advance('files', 1)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            # chunks keep the inter process overhead low for large batches
+            chunk_size = max(1, min(16, len(file_names) // (4 * workers)))
+            for summary in executor.map(summarize_file, file_names, chunksize=chunk_size):
+                summaries.append(summary)
+                vk4progress.advance('files', 1)
+
+    combined = merge_summaries(summaries)
+    log.debug("Exiting summarize_files()")
+    return summaries, combined
+
+
+def write_report(out_file_name, summaries, combined):
+    """write_report
+
+    Writes the summaries as a csv file, one row per file, and the summaries,
+    batch totals and histograms as a json file. Returns the names of the two
+    files written. Each file is written atomically (see vk4out.open_output).
+
+    :param out_file_name: path of the report without extension
+    :param summaries: list of file summaries from summarize_files
+    :param combined: merged batch totals from summarize_files
+    """
+    log.debug("Entering write_report()")
+    csv_name, json_name = out_file_name + '.csv', out_file_name + '.json'
+    with vk4out.open_text_output(csv_name, newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=summary_fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(summaries)
+    with vk4out.open_text_output(json_name) as out_file:
+        json.dump({'combined': combined, 'files': summaries}, out_file, indent=1)
+
+    log.debug("Exiting write_report()")
+    return csv_name, json_name
@@ -0,0 +1,190 @@
+"""vk4surface
+
+This module computes surface maps from the height data of VkContainer
+objects by finite differences: the gradient magnitude, the slope angle, the
+aspect (direction of steepest descent) and the mean curvature. The x and y
+pixel sizes are used separately, so scans with rectangular pixels give
+correct maps.
+
+First derivatives are central differences, one sided at the edges of the
+image; second derivatives use the three point stencil, with the edge values
+repeated from their neighbours. The image is processed in blocks of rows,
+each read with one row of halo above and below, so the results are the same
+as for the whole image at once while only a block's worth of temporary
+arrays is held in memory. Invalid (NaN) heights make the maps NaN at their
+neighbours.
+
+The maps are stored as derived layers which every writer able to output
+derived layers can write (see vk4_driver.derived_output_types).
+
+    gradient    |grad z| = sqrt(zx ** 2 + zy ** 2), micrometer per micrometer
+    slope       arctan(|grad z|) in degrees
+    aspect      direction of steepest descent in degrees, counterclockwise
+                from the +x axis with +y pointing up the image, in [0, 360)
+    curvature   mean curvature in 1/micrometer, positive for valleys
+                ((1 + zy ** 2) * zxx - 2 * zx * zy * zxy + (1 + zx ** 2) * zyy) /
+                (2 * (1 + zx ** 2 + zy ** 2) ** 1.5)
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import numpy as np
+import vk4layer
+
+log = logging.getLogger('vk4_driver.vk4surface')
+
+# number of pixels processed per block of rows
+SURFACE_BLOCK_CELLS = 2 ** 20
+
+# surface maps and the units of their derived layers
+surface_maps = {'gradient': '', 'slope': 'deg', 'aspect': 'deg', 'curvature': 'um^-1'}
+
+
+def second_difference(block, spacing, axis):
+    """second_difference
+
+    Returns the second derivative of a block along an axis by the three
+    point stencil, with the first and last values repeated from their
+    neighbours, or zeros if the axis has fewer than three values
+
+    :param block: 2d numpy array of float64 values
+    :param spacing: pixel size along the axis
+    :param axis: 0 for rows (y), 1 for columns (x)
+    """
+    result = np.zeros_like(block)
+    if block.shape[axis] < 3:
+        return result
+    moved = np.moveaxis(block, axis, 0)
+    out = np.moveaxis(result, axis, 0)
+    np.subtract(moved[2:], moved[1:-1], out=out[1:-1])
+    out[1:-1] -= moved[1:-1]
+    out[1:-1] += moved[:-2]
+    out[1:-1] /= spacing * spacing
+    out[0] = out[1]
+    out[-1] = out[-2]
+    return result
+
+
+def block_maps(block, x_size, y_size, maps):
+    """block_maps
+
+    Returns the requested surface maps of a block of heights as a dictionary
+    of float64 arrays with the shape of the block
+
+    :param block: 2d numpy array of heights in micrometers
+    :param x_size: pixel size along x (columns) in micrometers
+    :param y_size: pixel size along y (rows) in micrometers
+    :param maps: names of the maps to compute, keys of surface_maps
+    """
+    # one sided differences need two values along each axis
+    zx = np.gradient(block, x_size, axis=1) if block.shape[1] > 1 else np.zeros_like(block)
+    zy = np.gradient(block, y_size, axis=0) if block.shape[0] > 1 else np.zeros_like(block)
+    results = dict()
+    if 'gradient' in maps or 'slope' in maps:
+        magnitude = np.hypot(zx, zy)
+        if 'slope' in maps:
+            results['slope'] = np.degrees(np.arctan(magnitude))
+        if 'gradient' in maps:
+            results['gradient'] = magnitude
+    if 'aspect' in maps:
+        # rows run down the image, so the descent along +y is +zy
+        aspect = np.degrees(np.arctan2(zy, -zx))
+        results['aspect'] = np.mod(aspect, 360.0, out=aspect)
+    if 'curvature' in maps:
+        zxy = np.gradient(zx, y_size, axis=0) if block.shape[0] > 1 else np.zeros_like(block)
+        zx2 = zx * zx
+        zy2 = zy * zy
+        numerator = (1.0 + zy2) * second_difference(block, x_size, 1)
+        numerator -= 2.0 * zx * zy * zxy
+        numerator += (1.0 + zx2) * second_difference(block, y_size, 0)
+        zx2 += zy2
+        zx2 += 1.0
+        results['curvature'] = numerator / (2.0 * zx2 ** 1.5)
+    return results
+
+
+def surface_derivatives(matrix, x_size, y_size, maps=tuple(surface_maps), scale=1.0,
+                        valid=None):
+    """surface_derivatives
+
+    Returns the requested surface maps of a height matrix as a dictionary of
+    (height, width) float32 arrays. The matrix is processed in blocks of
+    about SURFACE_BLOCK_CELLS pixels with one halo row on each side; each
+    block is scaled to micrometers and its invalid pixels set to NaN as it
+    is read, so raw height data can be given without calibrating it first.
+
+    :param matrix: 2d numpy array of heights
+    :param x_size: pixel size along x (columns) in micrometers
+    :param y_size: pixel size along y (rows) in micrometers
+    :param maps: names of the maps to compute, keys of surface_maps
+    :param scale: factor scaling the matrix values to micrometers
+    :param valid: optional 2d boolean array, False for invalid pixels
+    """
+    log.debug("Entering surface_derivatives()\n\tMaps: {}".format(', '.join(maps)))
+    n_rows, n_cols = matrix.shape
+    results = {name: np.empty((n_rows, n_cols), dtype=np.float32) for name in maps}
+
+    rows_per_block = max(1, SURFACE_BLOCK_CELLS // max(n_cols, 1))
+    for start in range(0, n_rows, rows_per_block):
+        stop = min(start + rows_per_block, n_rows)
+        halo_start, halo_stop = max(start - 1, 0), min(stop + 1, n_rows)
+        block = np.multiply(matrix[halo_start:halo_stop], scale, dtype=np.float64)
+        if valid is not None:
+            block[~valid[halo_start:halo_stop]] = np.nan
+        block_rows = slice(start - halo_start, stop - halo_start)
+        for name, values in block_maps(block, x_size, y_size, maps).items():
+            results[name][start:stop] = values[block_rows]
+
+    log.debug("Exiting surface_derivatives()")
+    return results
+
+
+def surface_container(vk4_container, maps=tuple(surface_maps), layer='H'):
+    """surface_container
+
+    Computes surface maps of a VkContainer's height data, or of a derived
+    height layer such as the waviness, and stores them in the container as
+    derived layers named after the maps. Pixels marked invalid in the
+    container's height mask are treated as missing. Returns the dictionary
+    of maps from surface_derivatives.
+
+    :param vk4_container: VkContainer object with height data
+    :param maps: names of the maps to compute, keys of surface_maps
+    :param layer: string - 'H' or the name of a derived layer in micrometers
+    """
+    log.debug("Entering surface_container()\n\tLayer: {}".format(layer))
+    unknown = set(maps) - set(surface_maps)
+    if unknown:
+        log.error("In surface_container()\n\tUnknown surface maps: {}"
+                  .format(', '.join(sorted(unknown))))
+        return None
+    x_size, y_size = vk4_container.get_pixel_size()
+    if layer in vk4_container.derived_data:
+        data_layer = vk4_container.derived_data[layer]
+        scale, valid = 1.0, None
+    else:
+        data_layer = vk4_container.height_data
+        # z length per digit is stored in picometers
+        scale = vk4_container.measurement_conditions['z_length_per_digit'] / 1.0e6
+        valid = vk4_container.valid_masks.get('height')
+    matrix = vk4layer.layer_matrix(data_layer)
+
+    results = surface_derivatives(matrix, x_size, y_size, maps, scale, valid)
+    for name, values in results.items():
+        vk4_container.add_derived_layer(name, values, surface_maps[name])
+
+    log.debug("Exiting surface_container()")
+    return results
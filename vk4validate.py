@@ -0,0 +1,163 @@
+"""vk4validate
+
+This module checks Keyence Profilometry vk4 data files for corruption and
+truncation before any image data is extracted from them. The checks only
+read the file header, offset table and the small header of each data layer,
+so a bad file is rejected almost immediately instead of failing partway
+through a layer extraction.
+
+The checks performed are:
+
+    the file begins with the 'VK4_' extension, has a non-zero dll version
+    and a file type of 0
+
+    every offset in the offset table lies within the file
+
+    each image layer's width * height * bit depth / 8 matches its data byte
+    size, and the file holds at least that many bytes after the layer header
+
+    the string data lengths fit within the file
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import logging
+import os
+import struct
+import vk4extract as vk4in
+
+log = logging.getLogger('vk4_driver.vk4validate')
+
+# offset key: (header size in bytes excluding data, expected bit depth)
+# the light and height layers carry a 768 byte palette after their header
+layer_layout = {'color_peak': (20, 24),
+                'color_light': (20, 24),
+                'light': (28 + 768, 16),
+                'height': (28 + 768, 32)}
+
+# offsets which must be present for any vk4 file to be read
+required_offsets = ('meas_conds', 'string_data')
+
+# bytes of the measurement conditions read by extract_measurement_conditions
+MEAS_CONDS_BYTES = 76 * 4
+
+
+def validate_vk4(in_file):
+    """validate_vk4
+
+    Checks an open vk4 file for corruption and truncation. Returns a list of
+    strings describing each problem found, which is empty for a valid file.
+
+    :param in_file: open file obj, opened in binary mode, or a binary stream
+        such as io.BytesIO
+    """
+    log.debug("Entering validate_vk4()")
+    problems = []
+    file_size = in_file.seek(0, os.SEEK_END)
+
+    # header (12 bytes) and offset table (72 bytes)
+    if file_size < 84:
+        problems.append("file is {} bytes, smaller than the vk4 header and "
+                        "offset table".format(file_size))
+        log.debug("Exiting validate_vk4() with problems: {}".format(problems))
+        return problems
+
+    header = vk4in.extract_header(in_file)
+    if header['extension'] != vk4in.VK4_EXTENSION:
+        problems.append("extension {!r} is not {!r}"
+                        .format(header['extension'], vk4in.VK4_EXTENSION))
+        log.debug("Exiting validate_vk4() with problems: {}".format(problems))
+        return problems
+    if header['dll_version'] == 0:
+        problems.append("dll version is 0")
+    if header['file_type'] != 0:
+        problems.append("file type is {}, expected 0".format(header['file_type']))
+
+    offsets = vk4in.extract_offsets(in_file)
+    for key in required_offsets:
+        if offsets[key] == 0:
+            problems.append("offset '{}' is missing".format(key))
+    for key, offset in offsets.items():
+        if offset >= file_size:
+            problems.append("offset '{}' ({}) is beyond the end of the file ({} "
+                            "bytes)".format(key, offset, file_size))
+    if problems:
+        log.debug("Exiting validate_vk4() with problems: {}".format(problems))
+        return problems
+
+    if offsets['meas_conds'] + MEAS_CONDS_BYTES > file_size:
+        problems.append("measurement conditions need {} bytes but the file ends "
+                        "after {}".format(MEAS_CONDS_BYTES, file_size - offsets['meas_conds']))
+
+    for key, (header_size, bit_depth) in layer_layout.items():
+        if offsets[key] == 0:
+            continue
+        if offsets[key] + header_size > file_size:
+            problems.append("layer '{}' needs a {} byte header but the file ends "
+                            "after {}".format(key, header_size, file_size - offsets[key]))
+            continue
+        in_file.seek(offsets[key])
+        width, height, depth, compression, byte_size = \
+            struct.unpack('<5I', in_file.read(20))
+        if depth != bit_depth:
+            problems.append("layer '{}' has bit depth {}, expected {}"
+                            .format(key, depth, bit_depth))
+        elif width * height * depth // 8 != byte_size:
+            problems.append("layer '{}' is {}x{} pixels at {} bits but holds "
+                            "{} bytes".format(key, width, height, depth, byte_size))
+        remaining = file_size - offsets[key] - header_size
+        if width * height * depth // 8 > remaining:
+            problems.append("layer '{}' needs {} bytes but the file ends after "
+                            "{}".format(key, width * height * depth // 8,
+                                        max(remaining, 0)))
+
+    string_offset = offsets['string_data']
+    if string_offset + 4 > file_size:
+        problems.append("title length runs past the end of the file")
+        log.debug("Exiting validate_vk4() with problems: {}".format(problems))
+        return problems
+    in_file.seek(string_offset)
+    title_length = struct.unpack('<I', in_file.read(4))[0]
+    lens_offset = string_offset + 4 + 2 * title_length
+    if lens_offset + 4 > file_size:
+        problems.append("title of {} characters runs past the end of the file"
+                        .format(title_length))
+    else:
+        in_file.seek(lens_offset)
+        lens_name_length = struct.unpack('<I', in_file.read(4))[0]
+        if lens_offset + 4 + 2 * lens_name_length > file_size:
+            problems.append("lens name of {} characters runs past the end of "
+                            "the file".format(lens_name_length))
+
+    log.debug("Exiting validate_vk4() with problems: {}".format(problems))
+    return problems
+
+
+def validate_file(file_name):
+    """validate_file
+
+    Opens and checks a vk4 file for corruption and truncation. Returns a list
+    of strings describing each problem found, which is empty for a valid file.
+
+    :param file_name: path to the vk4 file
+    """
+    try:
+        with open(file_name, 'rb') as in_file:
+            return validate_vk4(in_file)
+    except OSError as err:
+        return ["cannot be read: {}".format(err.strerror)]
+    except (struct.error, ValueError) as err:
+        # validate_vk4 checks every read, this guards against what it missed
+        return ["cannot be validated: {}".format(err)]
@@ -0,0 +1,284 @@
+"""vk4watch
+
+This module watches a folder for vk4 files dropped by instruments and feeds
+each new or changed file, once, to a conversion function. The folder is
+polled at a fixed interval. A file is only taken once it has settled, i.e.
+its size and modification time are unchanged since the previous poll, so
+files still being copied are left for a later poll. A settled file which
+fails the vk4validate checks is recorded as failed rather than converted,
+and only looked at again once it changes.
+
+Settled files are put on a bounded queue worked on by a few threads. When
+the queue is full, polling blocks until there is room again, so a burst of
+files never builds up more than the queue's worth of pending work. The path,
+size and modification time of every processed file are recorded in a small
+JSON state store, saved after every poll and at most every few seconds in
+between rather than after each file, so that working through a backlog of
+files does not rewrite the whole state once per file. After a restart only
+the files which are new, changed or were not finished (or saved) are
+processed.
+
+Example
+-------
+    state = vk4watch.StateStore('vk4_watch_state.json')
+    watcher = vk4watch.FolderWatcher('/share/scans', convert, state)
+    watcher.run()
+
+Author
+------
+Wylie Gunn
+Behzad Torkian
+
+Created
+-------
+18 October 2026
+
+Last Modified
+-------------
+18 October 2026
+
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import vk4validate
+
+log = logging.getLogger('vk4_driver.vk4watch')
+
+# least number of seconds between saves of the state while recording files
+STATE_SAVE_INTERVAL = 5.0
+
+
+class StateStore(object):
+    """StateStore
+
+    Thread safe record of processed files, keyed by path, holding the size
+    and modification time each file had when processed and whether it was
+    processed successfully. Stored as JSON and replaced atomically on save.
+    Records are saved at most every save_interval seconds by record() and
+    otherwise by flush().
+
+    :param file_name: path to the JSON state file, created if missing
+    :param save_interval: least number of seconds between saves by record()
+    """
+    def __init__(self, file_name, save_interval=STATE_SAVE_INTERVAL):
+        self.file_name = file_name
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.files = dict()
+        self.unsaved = False
+        self.saved = time.monotonic()
+        if os.path.isfile(file_name):
+            with open(file_name) as state_file:
+                self.files = json.load(state_file)
+            log.info("Loaded state of {} files from {}".format(len(self.files), file_name))
+
+    def is_current(self, path, size, mtime_ns):
+        """is_current
+
+        Returns True if the file was processed with this size and
+        modification time
+
+        :param path: path to the file
+        :param size: file size in bytes
+        :param mtime_ns: modification time in nanoseconds
+        """
+        with self.lock:
+            record = self.files.get(path)
+        return record is not None and record['size'] == size and record['mtime_ns'] == mtime_ns
+
+    def record(self, path, size, mtime_ns, status):
+        """record
+
+        Records that a file was processed, saving the state if it was last
+        saved save_interval seconds ago or more
+
+        :param path: path to the file
+        :param size: file size in bytes when processed
+        :param mtime_ns: modification time in nanoseconds when processed
+        :param status: string - 'done' or 'failed'
+        """
+        with self.lock:
+            self.files[path] = {'size': size, 'mtime_ns': mtime_ns, 'status': status,
+                                'processed': time.time()}
+            self.unsaved = True
+            if time.monotonic() - self.saved >= self.save_interval:
+                self.save()
+
+    def flush(self):
+        """flush
+
+        Saves the state if files were recorded since it was last saved
+        """
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+    def save(self):
+        # called with the lock held; written to a temporary file first so a
+        # crash never leaves a truncated state file
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w') as state_file:
+            json.dump(self.files, state_file, indent=1)
+        os.replace(temp_name, self.file_name)
+        self.unsaved = False
+        self.saved = time.monotonic()
+
+
+def scan_folder(folder, recursive=False):
+    """scan_folder
+
+    Returns a dictionary of the size and modification time in nanoseconds of
+    every vk4 file in a folder, keyed by absolute path
+
+    :param folder: path to the folder
+    :param recursive: if True sub folders are scanned too
+    """
+    files = dict()
+    try:
+        entries = list(os.scandir(folder))
+    except OSError as err:
+        log.error("In scan_folder()\n\tCannot read {}: {}".format(folder, err.strerror))
+        return files
+    for entry in entries:
+        try:
+            if entry.is_dir() and recursive:
+                files.update(scan_folder(entry.path, recursive))
+            elif entry.is_file() and entry.name.lower().endswith('.vk4'):
+                status = entry.stat()
+                files[os.path.abspath(entry.path)] = (status.st_size, status.st_mtime_ns)
+        except OSError:
+            # the file was removed or renamed during the scan
+            continue
+    return files
+
+
+class FolderWatcher(object):
+    """FolderWatcher
+
+    Polls a folder and passes each new or changed vk4 file, once it has
+    settled, to process(path) on one of the worker threads. process should
+    return True on success; files it fails on (or raises an exception for),
+    and settled files which fail validation, are recorded as failed and only
+    retried once they change.
+
+    :param folder: path to the folder to watch
+    :param process: function taking the path of a vk4 file
+    :param state: StateStore object
+    :param interval: seconds between polls
+    :param queue_size: largest number of settled files waiting to be
+        processed before polling blocks
+    :param workers: number of worker threads
+    :param recursive: if True sub folders are watched too
+    """
+    def __init__(self, folder, process, state, interval=5.0, queue_size=16, workers=1,
+                 recursive=False):
+        self.folder = folder
+        self.process = process
+        self.state = state
+        self.interval = interval
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.recursive = recursive
+        self.stop_event = threading.Event()
+        # files seen changing at the last poll, path: (size, mtime_ns)
+        self.unsettled = dict()
+        # files queued or being processed
+        self.active = set()
+        self.active_lock = threading.Lock()
+
+    def poll(self):
+        """poll
+
+        Scans the folder once and queues the files which are new or changed
+        and have settled, blocking while the queue is full. Returns the
+        number of files queued.
+        """
+        files = scan_folder(self.folder, self.recursive)
+        previous, self.unsettled = self.unsettled, dict()
+        n_queued = 0
+        for path, (size, mtime_ns) in sorted(files.items()):
+            with self.active_lock:
+                if path in self.active:
+                    continue
+            if self.state.is_current(path, size, mtime_ns):
+                continue
+            if previous.get(path) != (size, mtime_ns):
+                self.unsettled[path] = (size, mtime_ns)
+                continue
+            # the file has not changed for a whole poll, so a file which is
+            # still invalid is taken to be corrupt rather than being copied
+            problems = vk4validate.validate_file(path)
+            if problems:
+                log.error("In poll()\n\tSkipping invalid file - {}\n\t{}"
+                          .format(path, '\n\t'.join(problems)))
+                self.state.record(path, size, mtime_ns, 'failed')
+                continue
+
+            with self.active_lock:
+                self.active.add(path)
+            # blocks while the queue is full, holding back further polls
+            while not self.stop_event.is_set():
+                try:
+                    self.work_queue.put((path, size, mtime_ns), timeout=1.0)
+                    n_queued += 1
+                    break
+                except queue.Full:
+                    continue
+        return n_queued
+
+    def worker(self):
+        while True:
+            item = self.work_queue.get()
+            if item is None:
+                self.work_queue.task_done()
+                return
+            path, size, mtime_ns = item
+            log.info("Processing {}".format(path))
+            try:
+                ok = self.process(path)
+            except Exception:
+                log.exception("In worker()\n\tProcessing {} failed".format(path))
+                ok = False
+            self.state.record(path, size, mtime_ns, 'done' if ok else 'failed')
+            with self.active_lock:
+                self.active.discard(path)
+            self.work_queue.task_done()
+
+    def run(self, max_polls=None):
+        """run
+
+        Polls the folder until stop() is called, or max_polls polls have
+        been made, and then waits for the queued files to be processed
+
+        :param max_polls: number of polls to make, or None to poll forever
+        """
+        log.info("Watching {} every {} s".format(self.folder, self.interval))
+        threads = [threading.Thread(target=self.worker, daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        n_polls = 0
+        try:
+            while not self.stop_event.is_set():
+                self.poll()
+                self.state.flush()
+                n_polls += 1
+                if max_polls is not None and n_polls >= max_polls:
+                    break
+                self.stop_event.wait(self.interval)
+        except KeyboardInterrupt:
+            log.info("Stopping watch, finishing queued files")
+        finally:
+            for _ in threads:
+                self.work_queue.put(None)
+            for thread in threads:
+                thread.join()
+            self.state.flush()
+
+    def stop(self):
+        self.stop_event.set()